@@ -0,0 +1,323 @@
+"""
+豆包大模型API服务（asyncio 版本）
+与 DoubaoService 功能一致，可以直接在 FastAPI 的 async 接口中 await，
+不需要为每次生成占用一个线程
+"""
+import asyncio
+import base64
+import contextvars
+import os
+import time
+from io import BytesIO
+from PIL import Image
+import config
+from doubao_service import doubao_service
+from image_download import StreamingDownload, Base64JsonDecoder
+from metrics import metrics
+from stt_errors import STT_ERROR_PREFIX
+
+# 尝试导入 httpx（可选）
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+    print("⚠️ httpx 未安装，异步 API 客户端不可用（将回退到线程方式）")
+
+
+class AsyncDoubaoService:
+    """豆包API服务类（异步）"""
+
+    def __init__(self):
+        self.api_key = config.DOUBAO_API_KEY
+        self.stt_url = config.STT_URL
+        self.tti_url = config.TTI_URL
+        self.has_api_key = bool(self.api_key)
+
+        # 客户端在第一次使用时创建（需要在事件循环中创建）
+        self._api_client = None
+        self._cdn_client = None
+
+    def _new_client(self, timeout: float):
+        """创建带连接池限制的异步客户端（与同步版本共用连接池配置）"""
+        limits = httpx.Limits(
+            max_connections=config.HTTP_POOL_SIZE,
+            max_keepalive_connections=config.HTTP_POOL_SIZE,
+            keepalive_expiry=config.HTTP_POOL_IDLE_TIMEOUT,
+        )
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    @property
+    def api_client(self):
+        """API 主机（STT/TTI）客户端"""
+        if self._api_client is None:
+            self._api_client = self._new_client(timeout=120)
+        return self._api_client
+
+    @property
+    def cdn_client(self):
+        """图片 CDN 客户端"""
+        if self._cdn_client is None:
+            self._cdn_client = self._new_client(timeout=30)
+        return self._cdn_client
+
+    async def aclose(self):
+        """关闭客户端（应用退出时调用）"""
+        for client in (self._api_client, self._cdn_client):
+            if client is not None:
+                await client.aclose()
+        self._api_client = None
+        self._cdn_client = None
+
+    async def audio_to_text(self, audio_file_path, filename: str = "audio.wav"):
+        """
+        音频转文字
+
+        Args:
+            audio_file_path: 音频文件路径，或内存中的音频数据（bytes、文件对象或字节块迭代器）
+            filename: 音频数据不是文件路径时上传使用的文件名
+
+        Returns:
+            str: 识别的文字
+        """
+        if not self.has_api_key:
+            # 模拟模式
+            return "这是一段测试文字，用于生成图片"
+
+        try:
+            api_url = self.stt_url if self.stt_url else 'https://www.dmxapi.com/v1/audio/transcriptions'
+            print(f"🔗 STT请求URL: {api_url}")
+            if not isinstance(audio_file_path, str):
+                audio_bytes = doubao_service._read_audio_data(audio_file_path)
+                print(f"📁 音频数据: {len(audio_bytes)} 字节（内存）")
+            else:
+                print(f"📁 音频文件: {audio_file_path}")
+                # 读取文件放到默认线程池执行，不阻塞事件循环
+                loop = asyncio.get_running_loop()
+                audio_bytes = await loop.run_in_executor(None, self._read_file, audio_file_path)
+                filename = os.path.basename(audio_file_path)
+
+            # 与同步版本共用识别结果缓存
+            cache_key = doubao_service.stt_cache.make_key(audio_bytes)
+            cached_text = doubao_service.lookup_cached_transcript(cache_key)
+            if cached_text is not None:
+                return cached_text
+
+            files = {"file": (filename, audio_bytes)}
+            data = {"model": "whisper-1"}
+            headers = {"Authorization": f"Bearer {self.api_key}"}
+
+            with metrics.span("stt_request"):
+                response = await self.api_client.post(
+                    api_url,
+                    headers=headers,
+                    files=files,
+                    data=data,
+                    timeout=60
+                )
+            response.raise_for_status()
+            result = response.json()
+
+            voice_text = result.get("text", "")
+            if voice_text:
+                print(f"✅ 识别成功: {voice_text}")
+                doubao_service.stt_cache.put(cache_key, voice_text)
+                return voice_text
+            else:
+                print(f"⚠️ API返回空文本: {result}")
+                return f"{STT_ERROR_PREFIX}，未返回文本"
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 401:
+                print("=" * 60)
+                print("❌ API密钥验证失败 (401 Unauthorized)")
+                print("请检查 .env 文件中的 DMX_API_KEY 是否正确")
+                print("=" * 60)
+            print(f"❌ 音频转文字HTTP错误 ({e.response.status_code}): {e} - {e.response.text}")
+            return f"{STT_ERROR_PREFIX}，请检查API密钥和网络连接"
+        except httpx.RequestError as e:
+            print(f"❌ 音频转文字网络错误: {e}")
+            return f"{STT_ERROR_PREFIX}，网络连接错误"
+        except Exception as e:
+            print(f"❌ 音频转文字错误: {e}")
+            import traceback
+            traceback.print_exc()
+            return f"{STT_ERROR_PREFIX}: {str(e)}"
+
+    async def download_image(self, image_url: str, progress_callback=None) -> Image.Image:
+        """
+        流式下载图片（分块写入下载目录，内存占用与图片大小无关）
+
+        Args:
+            image_url: 图片地址
+            progress_callback: 下载进度回调 callback(已下载字节数, 总字节数或None)
+
+        Returns:
+            PIL.Image: 按需解码的图片（image.filename 为下载文件路径）
+        """
+        print(f"📥 从URL下载图片: {image_url[:80]}...")
+        # 写文件和打开图片放到线程池执行，多 MB 的图片不会阻塞事件循环上的其他请求和 SSE 推送；
+        # 进度回调在工作线程中调用，复制上下文让进度事件带上任务ID
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        async with self.cdn_client.stream('GET', image_url) as response:
+            response.raise_for_status()
+            total = int(response.headers.get('Content-Length') or 0) or None
+            with StreamingDownload(total, progress_callback=progress_callback) as download:
+                async for chunk in response.aiter_bytes(config.DOWNLOAD_CHUNK_SIZE):
+                    await loop.run_in_executor(None, context.run, download.write, chunk)
+        image = await loop.run_in_executor(None, download.open_image)
+        print(f"✅ 图片下载成功，尺寸: {image.size}，{download.downloaded} 字节")
+        return image
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        """读取整个文件（磁盘 I/O，在线程池中调用）"""
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _decode_b64_image(image_b64: str) -> Image.Image:
+        """解码响应中完整的 base64 图片（CPU 操作，在线程池中调用）"""
+        return Image.open(BytesIO(base64.b64decode(image_b64)))
+
+    async def text_to_image(self, text: str, progress_callback=None):
+        """
+        文字生成图片（Doubao 模型）
+
+        Args:
+            text: 文字描述
+            progress_callback: 图片下载进度回调 callback(已下载字节数, 总字节数或None)
+
+        Returns:
+            (PIL.Image, str): 生成的图片对象和原始文字
+        """
+        if not self.has_api_key:
+            return doubao_service._mock_text_to_image(text)
+
+        # 提示词缓存与同步版本共用（读取磁盘文件放到线程中，不阻塞事件循环）
+        model = doubao_service.DOUBAO_MODEL
+        cache_key = doubao_service.prompt_cache.make_key(text, model, doubao_service.DOUBAO_SIZE)
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, doubao_service.lookup_cached_image, cache_key, text)
+        if cached is not None:
+            return cached
+
+        # 相同提示词正在生成时（包括同步版本发起的生成）等待那次的结果，不重复调用上游
+        image, _ = await doubao_service.tti_flight.do_async(
+            cache_key, self._generate_image, text, cache_key, progress_callback
+        )
+        return image, text
+
+    async def _generate_image(self, text: str, cache_key: str, progress_callback=None):
+        """
+        调用 Doubao 文生图接口生成图片（失败时返回占位图片）
+
+        Returns:
+            (PIL.Image, str): 生成的图片对象和原始文字
+        """
+        model = doubao_service.DOUBAO_MODEL
+        # base64 解码、写文件、打开图片和写入缓存都放到线程池执行，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        try:
+            api_url = self.tti_url if self.tti_url else "https://www.dmxapi.com/v1/images/generations"
+            response_format = doubao_service.response_format.choose()
+            request_data = {
+                "model": model,
+                "prompt": text,
+                "size": doubao_service.DOUBAO_SIZE,
+                "stream": False,
+                "response_format": response_format,
+                "watermark": False
+            }
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            }
+
+            print(f"🔗 请求URL: {api_url}")
+            print(f"📝 提示词: {text[:50]}..." if len(text) > 50 else f"📝 提示词: {text}")
+            print(f"🤖 使用模型: {request_data['model']}")
+
+            request_start = time.perf_counter()
+            if response_format == "b64_json":
+                # 流式读取响应体，边接收边解码图片
+                async with self.api_client.stream('POST', api_url, headers=headers, json=request_data) as response:
+                    if response.is_error:
+                        # 读取错误响应体，便于下方打印错误详情
+                        await response.aread()
+                    response.raise_for_status()
+                    metrics.observe("tti_request", time.perf_counter() - request_start)
+                    print(f"✅ API响应成功，状态码: {response.status_code}，响应格式: {response_format}")
+                    transfer_start = time.perf_counter()
+                    total = Base64JsonDecoder.estimate_size(response.headers.get('Content-Length'))
+                    with StreamingDownload(total, progress_callback=progress_callback) as download:
+                        decoder = Base64JsonDecoder(download)
+                        async for chunk in response.aiter_bytes(config.DOWNLOAD_CHUNK_SIZE):
+                            await loop.run_in_executor(None, context.run, decoder.feed, chunk)
+                        data = await loop.run_in_executor(None, decoder.close)
+                image = await loop.run_in_executor(None, decoder.open_image)
+                if image is not None:
+                    transfer_duration = time.perf_counter() - transfer_start
+                    doubao_service.response_format.record("b64_json", transfer_duration)
+                    metrics.observe("download", transfer_duration)
+                    print(f"✅ 图片解码成功，尺寸: {image.size}，{download.downloaded} 字节")
+                    return await loop.run_in_executor(
+                        None, doubao_service.store_cached_image, cache_key, image, text, model
+                    )
+            else:
+                response = await self.api_client.post(api_url, headers=headers, json=request_data)
+                response.raise_for_status()
+                metrics.observe("tti_request", time.perf_counter() - request_start)
+                data = response.json()
+                print(f"✅ API响应成功，状态码: {response.status_code}，响应格式: {response_format}")
+
+            # 响应格式：{"data": [{"url": "..."}]} 或 {"data": [{"b64_json": "..."}]}，兼容直接返回 url/b64_json
+            if 'data' in data and len(data['data']) > 0:
+                image_data_item = data['data'][0]
+            else:
+                image_data_item = data
+            image_url = image_data_item.get('url', '')
+            image_b64 = image_data_item.get('b64_json', '')
+
+            if image_b64:
+                print("📥 从base64数据解码图片")
+                image = await loop.run_in_executor(None, self._decode_b64_image, image_b64)
+                print(f"✅ 图片解码成功，尺寸: {image.size}")
+                return await loop.run_in_executor(
+                    None, doubao_service.store_cached_image, cache_key, image, text, model
+                )
+            elif image_url:
+                download_start = time.perf_counter()
+                image = await self.download_image(image_url, progress_callback)
+                download_duration = time.perf_counter() - download_start
+                doubao_service.response_format.record("url", download_duration)
+                metrics.observe("download", download_duration)
+                return await loop.run_in_executor(
+                    None, doubao_service.store_cached_image, cache_key, image, text, model
+                )
+            else:
+                print(f"❌ API响应中未找到图片数据，响应内容: {data}")
+                raise ValueError("API响应中未找到图片数据")
+
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 401:
+                print("=" * 60)
+                print("❌ API密钥验证失败 (401 Unauthorized)")
+                print("请检查 .env 文件中的 DMX_API_KEY 或 API_KEY 是否正确")
+                print("=" * 60)
+            print(f"❌ API调用HTTP错误 ({e.response.status_code}): {e} - {e.response.text}")
+            return doubao_service._mock_text_to_image(text)
+        except httpx.RequestError as e:
+            print(f"❌ API调用错误: {e}")
+            return doubao_service._mock_text_to_image(text)
+        except Exception as e:
+            print(f"❌ 图片生成错误: {e}")
+            import traceback
+            traceback.print_exc()
+            return doubao_service._mock_text_to_image(text)
+
+
+# 创建全局服务实例
+async_doubao_service = AsyncDoubaoService()
@@ -0,0 +1,101 @@
+"""
+进程内音频解码
+使用 PyAV 解封装/解码 webm（Opus）等格式，NumPy 重采样为 16kHz 单声道，
+在内存中生成 WAV 字节，替代 ffmpeg 子进程和临时文件
+"""
+import wave
+from io import BytesIO
+
+# 尝试导入 PyAV 和 NumPy（可选）
+try:
+    import av
+    import numpy as np
+    AUDIO_DECODE_AVAILABLE = True
+except ImportError:
+    AUDIO_DECODE_AVAILABLE = False
+    print("⚠️ av/numpy 未安装，音频转换将使用 ffmpeg 子进程")
+
+
+# Whisper API 推荐的输入格式：16kHz 单声道 16 位 PCM
+TARGET_SAMPLE_RATE = 16000
+
+
+def decode_audio(source) -> tuple:
+    """
+    解码音频为单声道 float32 采样
+
+    Args:
+        source: 文件路径或文件对象（webm/ogg/wav 等 PyAV 支持的格式）
+
+    Returns:
+        (np.ndarray, int): 单声道采样（-1~1）和采样率
+    """
+    with av.open(source) as container:
+        stream = container.streams.audio[0]
+        # 只转换采样格式和声道（交错 float32 单声道），不改变采样率，重采样由 NumPy 完成
+        converter = av.AudioResampler(format='flt', layout='mono', rate=stream.rate)
+        chunks = []
+        for frame in container.decode(stream):
+            for converted in converter.resample(frame):
+                chunks.append(converted.to_ndarray().reshape(-1))
+        for converted in converter.resample(None):
+            chunks.append(converted.to_ndarray().reshape(-1))
+        sample_rate = stream.rate
+
+    if not chunks:
+        return np.zeros(0, dtype=np.float32), sample_rate
+    return np.concatenate(chunks).astype(np.float32, copy=False), sample_rate
+
+
+def resample(samples, src_rate: int, dst_rate: int = TARGET_SAMPLE_RATE):
+    """
+    线性插值重采样；降采样前先做滑动平均低通滤波，减少混叠
+
+    Args:
+        samples: 单声道 float32 采样
+        src_rate: 原采样率
+        dst_rate: 目标采样率
+
+    Returns:
+        np.ndarray: 重采样后的采样
+    """
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    if src_rate > dst_rate:
+        width = int(round(src_rate / dst_rate))
+        if width > 1:
+            kernel = np.ones(width, dtype=np.float32) / width
+            samples = np.convolve(samples, kernel, mode='same')
+    duration = len(samples) / src_rate
+    dst_length = int(round(duration * dst_rate))
+    src_times = np.arange(len(samples), dtype=np.float64) / src_rate
+    dst_times = np.arange(dst_length, dtype=np.float64) / dst_rate
+    return np.interp(dst_times, src_times, samples).astype(np.float32)
+
+
+def to_wav_bytes(samples, sample_rate: int) -> bytes:
+    """将 float32 单声道采样编码为 16 位 PCM WAV 字节"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def decode_to_wav_bytes(source, sample_rate: int = TARGET_SAMPLE_RATE) -> bytes:
+    """
+    解码任意音频并转换为 16kHz 单声道 WAV 字节（全程在内存中完成）
+
+    Args:
+        source: 文件路径或文件对象
+        sample_rate: 目标采样率
+
+    Returns:
+        bytes: WAV 文件内容
+    """
+    samples, src_rate = decode_audio(source)
+    samples = resample(samples, src_rate, sample_rate)
+    return to_wav_bytes(samples, sample_rate)
@@ -0,0 +1,157 @@
+"""
+离线端到端基准测试
+启动本地模拟 DMX API 和指向它的应用实例，按给定并发向 /vad_upload 上传录音样本，统计：
+- 吞吐量（每分钟完成的生成任务数）和端到端耗时分位数（上传到任务完成）
+- 流程各阶段耗时分位数（读取应用的 /metrics）
+- 应用进程的峰值内存
+
+用法（在 python 目录下，需要 Linux 读取峰值内存）：
+    python benchmark/e2e_bench.py --requests 20 --concurrency 2 --fixtures "audio/*.webm"
+    python benchmark/e2e_bench.py --tti-latency lognormal:8,0.3 --error-rate 0.05 --json result.json
+模拟 DMX API 的参数（--stt-latency、--tti-latency、--cdn-latency、--bandwidth-mbps、--image-size、
+--error-rate、--response-format）原样传给 fake_dmx_server.py
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import harness
+
+# 原样传给 fake_dmx_server.py 的参数
+UPSTREAM_OPTIONS = ('stt_latency', 'tti_latency', 'cdn_latency', 'bandwidth_mbps', 'image_size',
+                    'error_rate', 'response_format', 'seed')
+
+
+def load_fixtures(pattern: str) -> list:
+    """读取录音样本，没有匹配的文件时生成一段正弦波 WAV"""
+    fixtures = []
+    for path in sorted(glob.glob(pattern)) if pattern else []:
+        with open(path, 'rb') as f:
+            fixtures.append((os.path.basename(path), f.read()))
+    if not fixtures:
+        print("⚠️ 没有找到录音样本，使用生成的正弦波 WAV")
+        fixtures.append(('fixture.wav', harness.make_wav_fixture()))
+    return fixtures
+
+
+def upstream_args(args) -> list:
+    result = []
+    for option in UPSTREAM_OPTIONS:
+        value = getattr(args, option)
+        if value is not None:
+            result += [f"--{option.replace('_', '-')}", str(value)]
+    return result
+
+
+def run_load(app_url: str, fixtures: list, total: int, concurrency: int) -> tuple:
+    """按并发数上传 total 段录音，返回 (每次上传的结果, 总耗时秒数)"""
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            name, audio = fixtures[index % len(fixtures)]
+            result = harness.upload_and_wait(app_url, audio, name)
+            with lock:
+                results.append(result)
+                print(f"  [{len(results)}/{total}] {result['status']} {result['latency']:.2f}s")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    latencies = [r['latency'] for r in results if r['status'] == 'done']
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    return {
+        'requests': len(results),
+        'statuses': statuses,
+        'wall_seconds': wall_seconds,
+        'throughput_per_minute': len(latencies) * 60 / wall_seconds if wall_seconds else 0.0,
+        'latency': {f"p{int(q * 100)}": harness.percentile(latencies, q) for q in (0.5, 0.95, 0.99)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端基准测试（本地模拟 DMX API）")
+    parser.add_argument('--requests', type=int, default=20, help='上传次数')
+    parser.add_argument('--concurrency', type=int, default=2, help='同时进行的上传数')
+    parser.add_argument('--fixtures', default=None, help='录音样本（glob，如 "audio/*.webm"）')
+    parser.add_argument('--app-port', type=int, default=9200)
+    parser.add_argument('--upstream-port', type=int, default=9100)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='传给应用的环境变量（如 JOB_WORKERS=4、TTI_CACHE_ENABLED=true），可多次指定')
+    parser.add_argument('--json', dest='json_path', default=None, help='把结果写入 JSON 文件')
+    parser.add_argument('--stt-latency', default=None)
+    parser.add_argument('--tti-latency', default=None)
+    parser.add_argument('--cdn-latency', default=None)
+    parser.add_argument('--bandwidth-mbps', type=float, default=None)
+    parser.add_argument('--image-size', default=None)
+    parser.add_argument('--error-rate', type=float, default=None)
+    parser.add_argument('--response-format', default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    upstream = app = None
+    with tempfile.TemporaryDirectory(prefix='s2i-bench-') as work_dir:
+        try:
+            print("🚀 启动模拟 DMX API 和应用...")
+            upstream = harness.start_fake_upstream(args.upstream_port, upstream_args(args))
+            app = harness.start_app(args.app_port, upstream_url, work_dir, env_overrides)
+
+            print(f"📤 上传 {args.requests} 段录音，并发 {args.concurrency}")
+            results, wall_seconds = run_load(app_url, fixtures, args.requests, args.concurrency)
+
+            report = summarize(results, wall_seconds)
+            report['stages'] = harness.fetch_stage_metrics(app_url)
+            report['peak_rss_mb'] = harness.peak_rss_mb(app.pid)
+            report['upstream'] = requests.get(f"{upstream_url}/stats", timeout=10).json()
+            report['config'] = {'concurrency': args.concurrency, 'env': env_overrides,
+                                'upstream_args': upstream_args(args)}
+        finally:
+            harness.stop_process(app)
+            harness.stop_process(upstream)
+
+    print("=" * 60)
+    print(f"✅ 完成 {report['statuses'].get('done', 0)}/{report['requests']}，结果分布: {report['statuses']}")
+    print(f"⏱️ 总耗时 {report['wall_seconds']:.2f} 秒，吞吐量 {report['throughput_per_minute']:.2f} 次/分钟")
+    print(f"⏱️ 端到端 p50 {harness.format_seconds(report['latency']['p50'])}s，"
+          f"p95 {harness.format_seconds(report['latency']['p95'])}s，"
+          f"p99 {harness.format_seconds(report['latency']['p99'])}s")
+    if report['peak_rss_mb'] is not None:
+        print(f"💾 应用峰值内存: {report['peak_rss_mb']:.1f} MB")
+    print(f"🛰️ 上游请求数: {report['upstream']}")
+    print("-" * 60)
+    harness.print_stage_table(report['stages'])
+    print("=" * 60)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📝 结果已写入: {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
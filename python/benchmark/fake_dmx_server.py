@@ -0,0 +1,208 @@
+"""
+本地模拟 DMX API（基准测试用）
+实现语音识别和文生图两个接口，延迟、图片大小、错误率、响应格式都可以配置，
+不访问 dmxapi.com 就能测量整条流程：
+- POST /v1/audio/transcriptions：按音频内容哈希从提示词列表中选一条返回（相同录音得到相同文字）
+- POST /v1/images/generations：返回图片地址（url）或 base64 图片（b64_json）
+- GET  /cdn/{name}：url 格式对应的图片下载地址
+- GET  /stats：各接口收到的请求数和注入的错误数
+- POST /control/script：下发回放脚本（benchmark/replay.py 使用），之后的请求按到达顺序依次使用脚本中的
+  识别结果和延迟，用完后恢复按参数随机
+
+用法（在 python 目录下）：
+    python benchmark/fake_dmx_server.py --port 9100 --tti-latency lognormal:8,0.3 --image-size 2304x1728
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import random
+import threading
+from collections import deque
+
+from PIL import Image
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+# 默认的识别结果（按音频哈希选取）
+DEFAULT_PROMPTS = (
+    "一只黑色的小狗和老奶奶在公园散步",
+    "夕阳下的海边灯塔",
+    "宇航员在月球上骑自行车",
+    "下雪的森林里有一座小木屋",
+    "一只戴着帽子的橘猫在看书",
+)
+
+
+class LatencyDistribution:
+    """
+    延迟分布（秒）
+
+    格式：
+    - "0.5"：固定 0.5 秒
+    - "uniform:1,3"：1~3 秒均匀分布
+    - "normal:8,2"：均值 8、标准差 2 的正态分布（截断到 0 以上）
+    - "lognormal:8,0.3"：中位数 8、对数标准差 0.3 的对数正态分布（长尾，接近真实接口）
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(':')
+        if not params:
+            kind, params = 'fixed', kind
+        self.kind = kind
+        self.params = [float(value) for value in params.split(',')]
+        if self.kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rng.uniform(self.params[0], self.params[1])
+        if self.kind == 'normal':
+            return max(0.0, rng.gauss(self.params[0], self.params[1]))
+        return self.params[0] * rng.lognormvariate(0.0, self.params[1])
+
+
+def make_image_bytes(width: int, height: int, quality: int) -> bytes:
+    """生成一张 JPEG（低分辨率随机噪声放大，压缩后的大小接近真实照片）"""
+    small = (max(1, width // 8), max(1, height // 8))
+    noise = Image.frombytes('RGB', small, os.urandom(small[0] * small[1] * 3))
+    image = noise.resize((width, height), Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def create_app(args) -> FastAPI:
+    """根据命令行参数创建模拟服务"""
+    rng = random.Random(args.seed)
+    stt_latency = LatencyDistribution(args.stt_latency)
+    tti_latency = LatencyDistribution(args.tti_latency)
+    cdn_latency = LatencyDistribution(args.cdn_latency)
+    prompts = args.prompts or list(DEFAULT_PROMPTS)
+
+    width, height = (int(value) for value in args.image_size.lower().split('x'))
+    image_bytes = make_image_bytes(width, height, args.image_quality)
+    image_b64 = base64.b64encode(image_bytes).decode('ascii')
+    print(f"🖼️ 模拟图片: {width}x{height}，{len(image_bytes)} 字节")
+
+    lock = threading.Lock()
+    counters = {'stt': 0, 'tti': 0, 'cdn': 0, 'errors': 0, 'scripted': 0}
+    # 回放脚本：{"stt": [{"text", "latency"}, ...], "tti": [{"latency"}, ...]}，按请求到达顺序依次取用
+    script = {'stt': deque(), 'tti': deque()}
+
+    def count(name: str):
+        with lock:
+            counters[name] += 1
+
+    def next_scripted(kind: str) -> dict:
+        """取出下一条脚本（没有时返回空 dict）"""
+        with lock:
+            if not script[kind]:
+                return {}
+            counters['scripted'] += 1
+            return script[kind].popleft()
+
+    def should_fail() -> bool:
+        if args.error_rate and rng.random() < args.error_rate:
+            count('errors')
+            return True
+        return False
+
+    def paced(data: bytes, media_type: str):
+        """按 --bandwidth-mbps 限速分块发送（未设置时一次发送）"""
+        if not args.bandwidth_mbps:
+            return Response(content=data, media_type=media_type)
+        chunk_size = 65536
+        delay = chunk_size * 8 / (args.bandwidth_mbps * 1_000_000)
+
+        async def chunks():
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+                await asyncio.sleep(delay)
+
+        return StreamingResponse(chunks(), media_type=media_type, headers={'Content-Length': str(len(data))})
+
+    app = FastAPI()
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions(file: UploadFile = File(...), model: str = Form("whisper-1")):
+        count('stt')
+        audio = await file.read()
+        entry = next_scripted('stt')
+        latency = entry.get('latency')
+        await asyncio.sleep(stt_latency.sample(rng) if latency is None else latency)
+        if should_fail():
+            return JSONResponse({"error": {"message": "injected error"}}, status_code=500)
+        if entry.get('text') is not None:
+            # 脚本中的空文字用来回放识别失败
+            return {"text": entry['text']}
+        index = int(hashlib.sha256(audio).hexdigest(), 16) % len(prompts)
+        return {"text": prompts[index]}
+
+    @app.post("/v1/images/generations")
+    async def generations(request: Request):
+        count('tti')
+        body = await request.json()
+        latency = next_scripted('tti').get('latency')
+        await asyncio.sleep(tti_latency.sample(rng) if latency is None else latency)
+        if should_fail():
+            return JSONResponse({"error": {"message": "injected error"}}, status_code=500)
+        response_format = args.response_format
+        if response_format == 'request':
+            response_format = body.get('response_format') or 'url'
+        if response_format == 'b64_json':
+            return paced(f'{{"data": [{{"b64_json": "{image_b64}"}}]}}'.encode('ascii'), 'application/json')
+        return {"data": [{"url": f"{str(request.base_url).rstrip('/')}/cdn/{counters['tti']}.jpg"}]}
+
+    @app.get("/cdn/{name}")
+    async def cdn(name: str):
+        count('cdn')
+        await asyncio.sleep(cdn_latency.sample(rng))
+        return paced(image_bytes, 'image/jpeg')
+
+    @app.post("/control/script")
+    async def control_script(request: Request):
+        """下发回放脚本（替换尚未用完的脚本），条目中 latency 为空时按延迟分布随机、text 为空时按音频哈希选取"""
+        body = await request.json()
+        with lock:
+            script['stt'] = deque(body.get('stt') or [])
+            script['tti'] = deque(body.get('tti') or [])
+        return {"stt": len(script['stt']), "tti": len(script['tti'])}
+
+    @app.get("/stats")
+    async def stats():
+        with lock:
+            return {**counters, 'script_remaining': {kind: len(entries) for kind, entries in script.items()}}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="本地模拟 DMX API（基准测试用）")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--stt-latency', default='lognormal:1.2,0.3', help='语音识别延迟分布（秒）')
+    parser.add_argument('--tti-latency', default='lognormal:8,0.3', help='文生图延迟分布（秒）')
+    parser.add_argument('--cdn-latency', default='0.2', help='图片下载首字节延迟分布（秒）')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='图片下载带宽（Mbit/s），0 表示不限速')
+    parser.add_argument('--image-size', default='2304x1728', help='返回的图片尺寸')
+    parser.add_argument('--image-quality', type=int, default=90, help='返回的图片 JPEG 质量')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入 500 错误的概率（0~1）')
+    parser.add_argument('--response-format', default='request', choices=('request', 'url', 'b64_json'),
+                        help='响应格式：request 按请求参数，url / b64_json 强制使用该格式')
+    parser.add_argument('--prompt', dest='prompts', action='append', help='识别结果（可多次指定）')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    return parser
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = build_parser().parse_args()
+    print(f"🚀 模拟 DMX API 启动中 (端口 {args.port})...")
+    uvicorn.run(create_app(args), host=args.host, port=args.port, access_log=False)
@@ -0,0 +1,210 @@
+"""
+基准测试公共工具
+- 启动模拟 DMX API 和指向它的应用实例（子进程，历史记录和缓存写入临时目录）
+- 上传录音并等待生成任务完成
+- 读取进程峰值内存、解析 /metrics、计算分位数
+"""
+import io
+import math
+import os
+import re
+import subprocess
+import sys
+import time
+import wave
+
+import requests
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(PYTHON_DIR, 'benchmark')
+
+# /metrics 中 summary 分位数的行：name{stage="stt",quantile="0.5"} 1.23
+_QUANTILE_LINE_RE = re.compile(r'^\w+_stage_latency_seconds\{stage="([^"]+)",quantile="([^"]+)"\} (\S+)$')
+_COUNT_LINE_RE = re.compile(r'^\w+_stage_latency_seconds_count\{stage="([^"]+)"\} (\S+)$')
+
+
+def percentile(values: list, q: float) -> float:
+    """最近邻分位数，没有数据时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def make_wav_fixture(seconds: float = 1.5, frequency: float = 440.0, sample_rate: int = 16000) -> bytes:
+    """生成一段正弦波 WAV（没有录音样本时使用；模拟 DMX API 不关心音频内容）"""
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        sample = int(12000 * math.sin(2 * math.pi * frequency * i / sample_rate))
+        frames += sample.to_bytes(2, 'little', signed=True)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    """轮询 url 直到返回 200（子进程提前退出或超时时抛出 RuntimeError）"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程已退出（返回码 {process.returncode}）: {url}")
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+def start_fake_upstream(port: int, extra_args: list = ()) -> subprocess.Popen:
+    """启动模拟 DMX API（参数见 fake_dmx_server.py）"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARK_DIR, 'fake_dmx_server.py'), '--port', str(port), *extra_args],
+        cwd=PYTHON_DIR
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/stats", process)
+    return process
+
+
+def start_app(port: int, upstream_url: str, work_dir: str, env_overrides: dict = None) -> subprocess.Popen:
+    """
+    启动 demo7.py 的 FastAPI 应用（不挂载 Gradio 界面），上游接口指向模拟 DMX API
+
+    Args:
+        port: 应用端口
+        upstream_url: 模拟 DMX API 地址（如 http://127.0.0.1:9100）
+        work_dir: 历史记录和缓存使用的临时目录
+        env_overrides: 额外的环境变量（如 JOB_WORKERS、TTI_CACHE_ENABLED）
+    """
+    env = dict(os.environ)
+    env.update({
+        'DMX_API_KEY': 'benchmark',
+        'STT_URL': f"{upstream_url}/v1/audio/transcriptions",
+        'TTI_URL': f"{upstream_url}/v1/images/generations",
+        'HISTORY_DIR': os.path.join(work_dir, 'history'),
+        'TTI_CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'AUDIO_ARCHIVE': 'false',
+        # 默认关闭各级缓存，每次上传都走完整流程
+        'TTI_CACHE_ENABLED': 'false',
+        'STT_CACHE_SIZE': '0',
+        'SEMANTIC_CACHE_ENABLED': 'false',
+        'MAX_HISTORY': '100000',
+    })
+    env.update(env_overrides or {})
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'demo7:app', '--host', '127.0.0.1', '--port', str(port),
+         '--no-access-log'],
+        cwd=PYTHON_DIR,
+        env=env
+    )
+    wait_until_ready(f"http://127.0.0.1:{port}/latest", process, timeout=120)
+    return process
+
+
+def stop_process(process: subprocess.Popen):
+    """结束子进程"""
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def upload_and_wait(app_url: str, audio: bytes, filename: str = 'audio.webm', timeout: float = 300,
+                    poll_interval: float = 0.1) -> dict:
+    """
+    上传一段录音到 /vad_upload，并轮询 /jobs/{job_id} 直到任务结束
+
+    Returns:
+        dict: {"status": "done" / "failed" / "rejected" / "error" / "timeout", "latency": 上传到任务结束的秒数,
+               "record_id": 新记录ID}
+    """
+    start = time.perf_counter()
+    try:
+        response = requests.post(
+            f"{app_url}/vad_upload",
+            files={'file': (filename, audio, 'audio/webm')},
+            timeout=30
+        )
+    except requests.RequestException as e:
+        return {'status': 'error', 'latency': time.perf_counter() - start, 'error': str(e)}
+    if response.status_code == 429:
+        return {'status': 'rejected', 'latency': time.perf_counter() - start}
+    try:
+        data = response.json()
+    except ValueError:
+        return {'status': 'error', 'latency': time.perf_counter() - start,
+                'error': f"HTTP {response.status_code}: {response.text[:200]}"}
+    if data.get('status') != 'ok':
+        return {'status': 'error', 'latency': time.perf_counter() - start, 'error': data.get('msg')}
+
+    job_url = f"{app_url}/jobs/{data['job_id']}"
+    deadline = start + timeout
+    while time.perf_counter() < deadline:
+        # 轮询失败（应用崩溃、连接被重置、返回的不是 JSON）记为 error，不中断整个压测
+        try:
+            job = requests.get(job_url, timeout=10).json()
+        except (requests.RequestException, ValueError) as e:
+            return {'status': 'error', 'latency': time.perf_counter() - start, 'error': str(e)}
+        if job.get('job_status') in ('done', 'failed'):
+            return {
+                'status': job['job_status'],
+                'latency': time.perf_counter() - start,
+                'record_id': job.get('record_id'),
+                'error': job.get('error'),
+            }
+        time.sleep(poll_interval)
+    return {'status': 'timeout', 'latency': time.perf_counter() - start}
+
+
+def peak_rss_mb(pid: int) -> float:
+    """进程的峰值常驻内存（MB，读取 /proc/{pid}/status 的 VmHWM，仅 Linux），无法读取时返回None"""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def fetch_stage_metrics(app_url: str) -> dict:
+    """
+    读取应用 /metrics 中各阶段的分位数
+
+    Returns:
+        dict: {阶段名: {"count": 次数, "p50": 秒, "p95": 秒, "p99": 秒}}
+    """
+    stages = {}
+    text = requests.get(f"{app_url}/metrics", timeout=10).text
+    for line in text.splitlines():
+        match = _QUANTILE_LINE_RE.match(line)
+        if match:
+            stage, quantile, value = match.groups()
+            stages.setdefault(stage, {})[f"p{int(float(quantile) * 100)}"] = float(value)
+            continue
+        match = _COUNT_LINE_RE.match(line)
+        if match:
+            stages.setdefault(match.group(1), {})['count'] = int(float(match.group(2)))
+    return stages
+
+
+def format_seconds(value) -> str:
+    return '-' if value is None or value != value else f"{value:.3f}"
+
+
+def print_stage_table(stages: dict):
+    """打印各阶段耗时表"""
+    print(f"{'阶段':<14}{'次数':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, info in stages.items():
+        print(f"{stage:<14}{info.get('count', 0):>8}"
+              f"{format_seconds(info.get('p50')):>10}{format_seconds(info.get('p95')):>10}"
+              f"{format_seconds(info.get('p99')):>10}")
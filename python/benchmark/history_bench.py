@@ -0,0 +1,268 @@
+"""
+HistoryManager 微基准测试
+在临时目录中按不同的记录数（默认 50 / 1k / 10k / 100k）和存储引擎（json / sqlite）构造历史记录，
+测量每次请求都会用到的操作，输出方式参照 pytest-benchmark（每项多轮计时，给出 min / mean / median / stddev / OPS）：
+- load：创建 HistoryManager（JSON 解析快照和追加日志 / 打开 SQLite），同时用 tracemalloc 记录 Python 对象的
+  内存峰值和常驻量（不含 SQLite 自身的页缓存）
+- refresh：无变化时的同步（/get_latest_image 每次轮询都会调用）
+- latest：get_latest_record
+- get_record_by_id、get_current_index、get_record：随机记录的查找
+- adjacent：上一张/下一张（get_adjacent_record）
+- page：/history 的第一页和最后一页（get_page）
+- add_record：保存一张小图片并追加记录（包含 JSON 引擎每 HISTORY_COMPACT_EVERY 条一次的合并）
+另外记录每种规模的存储文件大小
+
+用法（在 python 目录下，只需要 Pillow 和 python-dotenv）：
+    python benchmark/history_bench.py
+    python benchmark/history_bench.py --sizes 50,1000,10000 --backends sqlite --json after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+
+# 导入 config 之前指向临时目录（config 导入时会创建 HISTORY_DIR，history_manager 导入时会创建全局实例）
+_WORK_DIR = tempfile.mkdtemp(prefix='s2i-history-bench-')
+os.environ['HISTORY_DIR'] = os.path.join(_WORK_DIR, 'default')
+os.environ['SEMANTIC_CACHE_ENABLED'] = 'false'
+
+from PIL import Image  # noqa: E402
+
+import config  # noqa: E402
+from history_manager import HistoryManager  # noqa: E402
+
+DEFAULT_SIZES = '50,1000,10000,100000'
+
+# 生成记录用的提示词（长度接近真实的识别结果）
+SAMPLE_PROMPTS = (
+    "一只黑色的小狗和老奶奶在公园散步",
+    "请帮我画一个霸王龙在吃鱼",
+    "夕阳下的海边灯塔",
+    "两只小猫在打架",
+    "下雪的森林里有一座小木屋",
+)
+
+
+def measure(fn, min_rounds: int = 5, max_rounds: int = 10000, min_time: float = 0.2) -> dict:
+    """
+    多轮计时（先预热一次），至少 min_rounds 轮、累计至少 min_time 秒，最多 max_rounds 轮
+
+    Returns:
+        dict: {"rounds", "min", "max", "mean", "median", "stddev", "ops"}（秒）
+    """
+    fn()
+    timings = []
+    total = 0.0
+    while len(timings) < max_rounds and (len(timings) < min_rounds or total < min_time):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        total += elapsed
+    mean = statistics.fmean(timings)
+    return {
+        'rounds': len(timings),
+        'min': min(timings),
+        'max': max(timings),
+        'mean': mean,
+        'median': statistics.median(timings),
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'ops': 1 / mean if mean else 0.0,
+    }
+
+
+def make_records(count: int, image_path: str) -> list:
+    """生成 count 条与真实记录字段相同的历史记录（ID 按时间递增，都早于当前时间）"""
+    base_id = int(time.time() * 1000) - count * 1000
+    records = []
+    for i in range(count):
+        record_id = base_id + i * 1000
+        records.append({
+            'id': record_id,
+            'text': f"{SAMPLE_PROMPTS[i % len(SAMPLE_PROMPTS)]} {i}",
+            'image_path': image_path,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record_id / 1000)),
+            'image_size': [2304, 1728],
+            'renditions': {'960': image_path, '1440': image_path},
+        })
+    return records
+
+
+def make_image_bytes() -> bytes:
+    """add_record 使用的小图片（小于 RENDITION_SIZES，不生成缩小版本，只测量记录本身的开销）"""
+    buffer = BytesIO()
+    Image.new('RGB', (64, 48), (200, 120, 40)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def storage_bytes(history_dir: str) -> int:
+    """历史记录存储文件的总大小（不含图片）"""
+    total = 0
+    for name in ('history.json', 'history.jsonl', 'history.db', 'history.db-wal'):
+        path = os.path.join(history_dir, name)
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def create_manager(backend: str) -> HistoryManager:
+    manager = HistoryManager(backend)
+    manager._rendition_executor.shutdown(wait=False)
+    manager.thumbnails._executor.shutdown(wait=False)
+    return manager
+
+
+def run_case(backend: str, size: int, args) -> dict:
+    """在独立的临时目录中测量一种存储引擎和记录数"""
+    history_dir = os.path.join(_WORK_DIR, f"{backend}_{size}")
+    os.makedirs(history_dir)
+    config.HISTORY_DIR = history_dir
+    config.THUMBNAIL_DIR = os.path.join(history_dir, 'thumbnails')
+    # 上限设为本次规模，添加记录时按真实情况裁剪最旧的记录
+    config.MAX_HISTORY = size
+
+    image_path = os.path.join(history_dir, 'sample.png')
+    with open(image_path, 'wb') as f:
+        f.write(make_image_bytes())
+    records = make_records(size, image_path)
+    create_manager(backend).storage.replace_all(records)
+    del records
+    gc.collect()
+
+    result = {'backend': backend, 'size': size, 'benchmarks': {}}
+    benchmarks = result['benchmarks']
+    slow = size >= 10000
+
+    # 冷启动加载和内存占用
+    tracemalloc.start()
+    manager = create_manager(backend)
+    result['memory_current_bytes'], result['memory_peak_bytes'] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmarks['load'] = measure(lambda: create_manager(backend), min_rounds=3 if slow else 5)
+
+    rng = random.Random(args.seed)
+    ids = [record['id'] for record in manager.get_history()]
+    sample_ids = [rng.choice(ids) for _ in range(1024)]
+    sample_positions = [rng.randrange(size) for _ in range(1024)]
+
+    def cycling(values):
+        state = {'i': 0}
+
+        def next_value():
+            state['i'] = (state['i'] + 1) % len(values)
+            return values[state['i']]
+        return next_value
+
+    next_id = cycling(sample_ids)
+    next_position = cycling(sample_positions)
+    next_step = cycling([-1, 1])
+    oldest_cursor = ids[min(len(ids) - 1, 50)]
+
+    benchmarks['refresh'] = measure(manager.refresh)
+    benchmarks['latest'] = measure(manager.get_latest_record)
+    benchmarks['get_record_by_id'] = measure(lambda: manager.get_record_by_id(next_id()))
+    benchmarks['get_current_index'] = measure(lambda: manager.get_current_index(next_id()))
+    benchmarks['get_record'] = measure(lambda: manager.get_record(next_position()))
+    benchmarks['adjacent'] = measure(lambda: manager.get_adjacent_record(next_id(), next_step()))
+    benchmarks['page_first'] = measure(lambda: manager.get_page(None, 50))
+    benchmarks['page_last'] = measure(lambda: manager.get_page(oldest_cursor, 50))
+    result['storage_bytes'] = storage_bytes(history_dir)
+
+    # 最后测量添加记录（会改变记录内容）；轮数覆盖至少一次 JSON 合并
+    image_bytes = make_image_bytes()
+
+    benchmarks['add_record'] = measure(lambda: manager.add_record(image_bytes, SAMPLE_PROMPTS[0]),
+                                       min_rounds=args.add_rounds, max_rounds=args.add_rounds)
+    result['storage_bytes_after_add'] = storage_bytes(history_dir)
+
+    del manager
+    gc.collect()
+    shutil.rmtree(history_dir, ignore_errors=True)
+    return result
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def format_bytes(value: int) -> str:
+    if value >= 1024 * 1024:
+        return f"{value / 1024 / 1024:.1f}MB"
+    return f"{value / 1024:.1f}KB"
+
+
+def print_results(results: list, baseline: dict = None):
+    """按 pytest-benchmark 的样式输出，指定基线时附加 mean 的变化倍数"""
+    header = (f"{'Name (backend-size)':<36}{'Min':>12}{'Max':>12}{'Mean':>12}{'StdDev':>12}"
+              f"{'Median':>12}{'OPS':>12}{'Rounds':>8}")
+    if baseline:
+        header += f"{'vs base':>10}"
+    print("-" * len(header))
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        case = f"{result['backend']}-{result['size']}"
+        for name, stats in result['benchmarks'].items():
+            line = (f"{name + ' (' + case + ')':<36}{format_time(stats['min']):>12}{format_time(stats['max']):>12}"
+                    f"{format_time(stats['mean']):>12}{format_time(stats['stddev']):>12}"
+                    f"{format_time(stats['median']):>12}{stats['ops']:>12.1f}{stats['rounds']:>8}")
+            base = (baseline or {}).get(case, {}).get('benchmarks', {}).get(name)
+            if base:
+                line += f"{stats['mean'] / base['mean']:>9.2f}x"
+            print(line)
+        print(f"{'':<4}存储文件 {format_bytes(result['storage_bytes'])}"
+              f"（添加后 {format_bytes(result['storage_bytes_after_add'])}），"
+              f"加载内存常驻 {format_bytes(result['memory_current_bytes'])}、峰值 {format_bytes(result['memory_peak_bytes'])}")
+    print("-" * len(header))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HistoryManager 微基准测试（临时目录）")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='逗号分隔的记录数')
+    parser.add_argument('--backends', default='json,sqlite', help='逗号分隔的存储引擎')
+    parser.add_argument('--add-rounds', type=int, default=200, help='add_record 的轮数（应不少于 HISTORY_COMPACT_EVERY）')
+    parser.add_argument('--seed', type=int, default=0, help='随机查找使用的随机数种子')
+    parser.add_argument('--json', dest='json_path', default=None, help='把结果写入 JSON 文件')
+    parser.add_argument('--compare', default=None, help='与之前 --json 保存的结果比较')
+    args = parser.parse_args()
+
+    sizes = [int(value) for value in args.sizes.split(',') if value.strip()]
+    backends = [value.strip() for value in args.backends.split(',') if value.strip()]
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = {f"{r['backend']}-{r['size']}": r for r in json.load(f)['results']}
+
+    results = []
+    try:
+        for backend in backends:
+            for size in sizes:
+                print(f"⏱️ 测量 {backend} 引擎，{size} 条记录...")
+                results.append(run_case(backend, size, args))
+    finally:
+        shutil.rmtree(_WORK_DIR, ignore_errors=True)
+
+    print_results(results, baseline)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'compact_every': config.HISTORY_COMPACT_EVERY, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"📝 结果已写入: {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+回放真实会话的负载
+把控制台日志（如 错误记录.md）或流程事件日志（history/pipeline_events.jsonl）转换为负载轨迹，
+再按原始的上传间隔（或 N 倍速）向应用上传录音。上游使用本地模拟 DMX API，按轨迹中的识别结果和
+上游耗时依次响应，得到和现场一样的突发负载（如 10 秒内连续三次上传），用来调整 JOB_QUEUE_SIZE、JOB_WORKERS
+
+轨迹文件（JSONL，每行一次上传）：
+    {"offset": 距第一次上传的秒数, "prompt": 识别结果, "stt_seconds": 语音识别耗时, "tti_seconds": 文生图耗时,
+     "stt_error": 识别失败的提示文字, "reached_tti": 是否调用了文生图, "status": 原始结果}
+耗时为空时由模拟 DMX API 按延迟分布随机。控制台日志中的文生图耗时包含图片下载，事件日志使用上游请求本身的耗时。
+识别失败（stt_errors.is_stt_error）的上传回放时让模拟 DMX API 返回空文字，应用同样按识别失败结束，不调用文生图
+
+用法（在 python 目录下）：
+    # 转换为轨迹文件（可以手动编辑后再回放）
+    python benchmark/replay.py convert ../错误记录.md -o trace.jsonl
+    python benchmark/replay.py convert history/pipeline_events.jsonl -o trace.jsonl
+    # 启动模拟 DMX API 和应用，按 2 倍速回放（也可以直接传日志文件）
+    python benchmark/replay.py run trace.jsonl --speed 2 --env JOB_WORKERS=1 --env JOB_QUEUE_SIZE=2
+    # 回放到已经运行的实例（该实例的 STT_URL/TTI_URL 需要指向 --upstream-url 的模拟 DMX API）
+    python benchmark/replay.py run trace.jsonl --app-url http://127.0.0.1:7860 --upstream-url http://127.0.0.1:9100
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+import harness
+
+sys.path.insert(0, harness.PYTHON_DIR)
+from stt_errors import is_stt_error  # noqa: E402
+
+# 控制台日志：录音文件名中的上传时间（毫秒）、识别结果、各阶段耗时
+_UPLOAD_RE = re.compile(r'vad_(\d{13})\.\w+')
+_TRANSCRIPT_RE = re.compile(r'✅ 识别成功: (.*)$')
+_TTI_START_RE = re.compile(r'🎨 开始生成图片')
+_STT_SECONDS_RE = re.compile(r'⏱️ 音频转文字耗时: ([\d.]+) 秒')
+_TTI_SECONDS_RE = re.compile(r'⏱️ 文字转图片耗时: ([\d.]+) 秒')
+
+# 统计突发程度的时间窗口（秒）
+BURST_WINDOW = 10.0
+
+
+def _assign(uploads: list, key: str, value, ready=None):
+    """把值分配给最早一个 key 还为空的上传（ready 为附加条件）"""
+    for upload in uploads:
+        if upload[key] is None and (ready is None or ready(upload)):
+            upload[key] = value
+            return
+
+
+def parse_console_log(path: str) -> list:
+    """
+    从控制台日志还原上传轨迹
+
+    上传时间取自录音文件名 vad_<毫秒时间戳>。多个流程交错输出时日志里没有归属信息，
+    识别结果和耗时按先进先出分配给最早一个还没有对应值的上传（与任务队列的处理顺序一致）
+
+    识别结果是识别失败的提示文字时记为识别失败：旧版本会把它当作提示词去生成图片，这次文生图的耗时
+    仍然分配给它（保持后续上传的对应关系），但回放时不调用文生图
+    """
+    uploads = []
+    seen = set()
+    previous_line = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            match = _UPLOAD_RE.search(line)
+            if match:
+                if match.group(1) not in seen:
+                    seen.add(match.group(1))
+                    uploads.append({'timestamp': int(match.group(1)) / 1000, 'transcript': None,
+                                    'stt_seconds': None, 'tti_started': None, 'tti_seconds': None})
+            elif _TRANSCRIPT_RE.search(line) and line != previous_line:
+                # 识别结果会连续打印两次，只取一次；识别结果在语音识别耗时之前输出
+                _assign(uploads, 'transcript', _TRANSCRIPT_RE.search(line).group(1).strip(),
+                        ready=lambda upload: upload['stt_seconds'] is None)
+            elif _STT_SECONDS_RE.search(line):
+                _assign(uploads, 'stt_seconds', float(_STT_SECONDS_RE.search(line).group(1)))
+            elif _TTI_START_RE.search(line):
+                _assign(uploads, 'tti_started', True, ready=lambda upload: upload['transcript'] is not None)
+            elif _TTI_SECONDS_RE.search(line):
+                _assign(uploads, 'tti_seconds', float(_TTI_SECONDS_RE.search(line).group(1)),
+                        ready=lambda upload: upload['tti_started'])
+            previous_line = line
+
+    for upload in uploads:
+        transcript = upload.pop('transcript')
+        tti_started = upload.pop('tti_started')
+        if is_stt_error(transcript):
+            upload.update(prompt=None, stt_error=transcript, reached_tti=False, tti_seconds=None, status='failed')
+            continue
+        upload['prompt'] = transcript
+        upload['stt_error'] = None
+        upload['reached_tti'] = bool(tti_started)
+        upload['status'] = 'done' if upload['tti_seconds'] is not None else 'failed'
+    return _to_trace(uploads)
+
+
+def parse_event_log(events: list) -> list:
+    """从流程事件日志（pipeline_events.py）还原上传轨迹，包括被队列拒绝的上传"""
+    uploads = []
+    for event in events:
+        if event.get('event') != 'job' or event.get('received_at') is None:
+            continue
+        stages = event.get('stages') or {}
+        stt_error = event.get('stt_error')
+        if stt_error is None and is_stt_error(event.get('transcript')):
+            # 旧版本把识别失败的提示文字当作识别结果记录
+            stt_error = event['transcript']
+        prompt = None if stt_error else event.get('transcript')
+        uploads.append({
+            'timestamp': event['received_at'],
+            # 回放时由模拟 DMX API 返回原始识别结果，应用再按当前规则清洗为提示词
+            'prompt': prompt,
+            'stt_seconds': stages.get('stt_request', stages.get('stt')),
+            'tti_seconds': None if stt_error else stages.get('tti_request'),
+            'stt_error': stt_error,
+            # 识别成功的任务才会调用文生图（被队列拒绝的上传没有识别结果）
+            'reached_tti': bool(prompt),
+            'status': event.get('status'),
+        })
+    return _to_trace(uploads)
+
+
+def _to_trace(uploads: list) -> list:
+    uploads = sorted(uploads, key=lambda upload: upload['timestamp'])
+    if not uploads:
+        return []
+    first = uploads[0]['timestamp']
+    return [
+        {
+            'offset': round(upload['timestamp'] - first, 3),
+            'prompt': upload['prompt'],
+            'stt_seconds': upload['stt_seconds'],
+            'tti_seconds': upload['tti_seconds'],
+            'stt_error': upload['stt_error'],
+            'reached_tti': upload['reached_tti'],
+            'status': upload['status'],
+        }
+        for upload in uploads
+    ]
+
+
+def _read_jsonl(path: str) -> list:
+    """读取 JSONL（第一行不是 JSON 时返回None；跳过写了一半的行）"""
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                if not items:
+                    return None
+    return items
+
+
+def load_trace(path: str) -> list:
+    """读取轨迹文件、流程事件日志或控制台日志（按内容自动识别）"""
+    items = _read_jsonl(path)
+    if items is None:
+        return parse_console_log(path)
+    if items and 'offset' in items[0]:
+        return sorted(items, key=lambda entry: entry['offset'])
+    return parse_event_log(items)
+
+
+def peak_burst(offsets: list, window: float = BURST_WINDOW) -> int:
+    """任意 window 秒内的最多上传次数"""
+    peak = 0
+    start = 0
+    for end, offset in enumerate(offsets):
+        while offset - offsets[start] > window:
+            start += 1
+        peak = max(peak, end - start + 1)
+    return peak
+
+
+def build_script(trace: list, latency_scale: float = 1.0) -> dict:
+    """
+    生成下发给模拟 DMX API 的回放脚本（/control/script）
+
+    模拟服务按请求到达顺序取用脚本：语音识别每次上传一条；文生图只为原始会话中调用了文生图的上传各写一条，
+    和回放时实际到达的文生图请求一一对应。识别失败的上传让模拟服务返回空文字，应用按识别失败结束
+    """
+    def scaled(seconds):
+        return None if seconds is None else seconds / latency_scale
+
+    stt = []
+    tti = []
+    for entry in trace:
+        item = {'latency': scaled(entry.get('stt_seconds'))}
+        if entry.get('stt_error'):
+            item['text'] = ''
+        elif entry.get('prompt'):
+            item['text'] = entry['prompt']
+        # 手动编写的轨迹没有 reached_tti 时，按是否有识别结果判断
+        if entry.get('reached_tti', bool(entry.get('prompt'))) and not entry.get('stt_error'):
+            tti.append({'latency': scaled(entry.get('tti_seconds'))})
+        stt.append(item)
+    return {'stt': stt, 'tti': tti}
+
+
+def load_fixtures(pattern: str, count: int) -> list:
+    """
+    每次上传使用的录音（共 count 段）
+
+    没有指定样本时按序号生成不同频率的正弦波 WAV，避免应用的语音识别缓存把不同的上传合并为一次
+    """
+    paths = sorted(glob.glob(pattern)) if pattern else []
+    if paths:
+        fixtures = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                fixtures.append((os.path.basename(path), f.read()))
+        return [fixtures[i % len(fixtures)] for i in range(count)]
+    return [(f"replay_{i}.wav", harness.make_wav_fixture(frequency=300.0 + 5 * i)) for i in range(count)]
+
+
+def replay(app_url: str, trace: list, fixtures: list, speed: float) -> tuple:
+    """
+    按轨迹的时间间隔（除以 speed）上传录音，每次上传在独立线程中等待任务结束（开环负载，不因应用变慢而推迟上传）
+
+    Returns:
+        tuple: (每次上传的结果, 回放总耗时秒数, 同时未完成的上传数峰值)
+    """
+    results = [None] * len(trace)
+    lock = threading.Lock()
+    in_flight = {'current': 0, 'peak': 0}
+
+    def upload(index: int):
+        name, audio = fixtures[index]
+        with lock:
+            in_flight['current'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['current'])
+        result = harness.upload_and_wait(app_url, audio, name)
+        result['offset'] = trace[index]['offset']
+        result['prompt'] = trace[index].get('prompt')
+        with lock:
+            in_flight['current'] -= 1
+            results[index] = result
+            print(f"  [{index + 1}/{len(trace)}] +{result['offset']:.1f}s {result['status']} "
+                  f"{result['latency']:.2f}s {result['prompt'] or ''}")
+
+    threads = []
+    start = time.perf_counter()
+    for index, entry in enumerate(trace):
+        delay = start + entry['offset'] / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=upload, args=(index,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start, in_flight['peak']
+
+
+def summarize(trace: list, results: list, wall_seconds: float, peak_in_flight: int, speed: float) -> dict:
+    latencies = [r['latency'] for r in results if r['status'] == 'done']
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    offsets = [entry['offset'] / speed for entry in trace]
+    return {
+        'uploads': len(results),
+        'statuses': statuses,
+        'speed': speed,
+        'trace_seconds': offsets[-1] if offsets else 0.0,
+        'peak_burst': peak_burst(offsets),
+        'peak_in_flight': peak_in_flight,
+        'wall_seconds': wall_seconds,
+        'latency': {f"p{int(q * 100)}": harness.percentile(latencies, q) for q in (0.5, 0.95, 0.99)},
+        'results': results,
+    }
+
+
+def print_report(report: dict):
+    print("=" * 60)
+    print(f"✅ 完成 {report['statuses'].get('done', 0)}/{report['uploads']}，结果分布: {report['statuses']}")
+    print(f"📈 {report['speed']}× 回放：轨迹时长 {report['trace_seconds']:.1f} 秒，"
+          f"{BURST_WINDOW:.0f} 秒内最多 {report['peak_burst']} 次上传，同时未完成最多 {report['peak_in_flight']} 次")
+    print(f"⏱️ 总耗时 {report['wall_seconds']:.2f} 秒，端到端 p50 {harness.format_seconds(report['latency']['p50'])}s，"
+          f"p95 {harness.format_seconds(report['latency']['p95'])}s，"
+          f"p99 {harness.format_seconds(report['latency']['p99'])}s")
+    if report.get('peak_rss_mb') is not None:
+        print(f"💾 应用峰值内存: {report['peak_rss_mb']:.1f} MB")
+    if report.get('upstream'):
+        print(f"🛰️ 上游请求数: {report['upstream']}")
+    print("-" * 60)
+    harness.print_stage_table(report['stages'])
+    print("=" * 60)
+
+
+def write_trace(trace: list, path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in trace:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def cmd_convert(args):
+    trace = load_trace(args.log)
+    write_trace(trace, args.output)
+    offsets = [entry['offset'] for entry in trace]
+    print(f"✅ 已转换 {len(trace)} 次上传，时长 {offsets[-1] if offsets else 0:.1f} 秒，"
+          f"{BURST_WINDOW:.0f} 秒内最多 {peak_burst(offsets)} 次: {args.output}")
+
+
+def cmd_run(args):
+    trace = load_trace(args.trace)
+    if args.limit:
+        trace = trace[:args.limit]
+    if not trace:
+        print("❌ 轨迹为空")
+        return
+    fixtures = load_fixtures(args.fixtures, len(trace))
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    upstream_url = args.upstream_url or f"http://127.0.0.1:{args.upstream_port}"
+    app_url = args.app_url or f"http://127.0.0.1:{args.app_port}"
+    latency_scale = args.speed if args.scale_upstream else 1.0
+
+    upstream = app = None
+    with tempfile.TemporaryDirectory(prefix='s2i-replay-') as work_dir:
+        try:
+            if not args.upstream_url:
+                print("🚀 启动模拟 DMX API...")
+                upstream = harness.start_fake_upstream(args.upstream_port, args.upstream_args)
+            if not args.app_url:
+                print("🚀 启动应用...")
+                app = harness.start_app(args.app_port, upstream_url, work_dir, env_overrides)
+            if args.app_url and not args.upstream_url:
+                print("⚠️ 未指定 --upstream-url，上游按模拟 DMX API 的默认参数随机响应")
+            else:
+                requests.post(f"{upstream_url}/control/script",
+                              json=build_script(trace, latency_scale), timeout=10).raise_for_status()
+
+            print(f"📤 按 {args.speed}× 速度回放 {len(trace)} 次上传")
+            results, wall_seconds, peak_in_flight = replay(app_url, trace, fixtures, args.speed)
+
+            report = summarize(trace, results, wall_seconds, peak_in_flight, args.speed)
+            report['stages'] = harness.fetch_stage_metrics(app_url)
+            report['peak_rss_mb'] = harness.peak_rss_mb(app.pid) if app else None
+            if not (args.app_url and not args.upstream_url):
+                report['upstream'] = requests.get(f"{upstream_url}/stats", timeout=10).json()
+            report['config'] = {'trace': args.trace, 'env': env_overrides, 'scale_upstream': args.scale_upstream}
+        finally:
+            harness.stop_process(app)
+            harness.stop_process(upstream)
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📝 结果已写入: {args.json_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把控制台日志或流程事件日志回放为负载（本地模拟 DMX API）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert = subparsers.add_parser('convert', help='把日志转换为轨迹文件')
+    convert.add_argument('log', help='控制台日志或流程事件日志（pipeline_events.jsonl）')
+    convert.add_argument('-o', '--output', default='trace.jsonl', help='输出的轨迹文件')
+    convert.set_defaults(func=cmd_convert)
+
+    run = subparsers.add_parser('run', help='回放轨迹（也可以直接传日志文件）')
+    run.add_argument('trace', help='轨迹文件、控制台日志或流程事件日志')
+    run.add_argument('--speed', type=float, default=1.0, help='回放速度倍数（2 表示上传间隔缩短一半）')
+    run.add_argument('--scale-upstream', action='store_true', help='上游耗时也按 --speed 缩短')
+    run.add_argument('--limit', type=int, default=0, help='只回放前 N 次上传')
+    run.add_argument('--fixtures', default=None, help='录音样本（glob），默认每次上传生成不同的正弦波 WAV')
+    run.add_argument('--app-url', default=None, help='回放到已经运行的实例，不启动应用')
+    run.add_argument('--upstream-url', default=None, help='已经运行的模拟 DMX API，不启动模拟服务')
+    run.add_argument('--app-port', type=int, default=9200)
+    run.add_argument('--upstream-port', type=int, default=9100)
+    run.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                     help='传给应用的环境变量（如 JOB_WORKERS=1、JOB_QUEUE_SIZE=2），可多次指定')
+    run.add_argument('--upstream-arg', dest='upstream_args', action='append', default=[], metavar='ARG',
+                     help='原样传给 fake_dmx_server.py 的参数（如 --upstream-arg=--bandwidth-mbps=20），可多次指定')
+    run.add_argument('--json', dest='json_path', default=None, help='把结果写入 JSON 文件')
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,63 @@ TTI_URL = os.getenv('TTI_URL', 'https://www.dmxapi.com/v1/images/generations')
 GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', 'https://www.dmxapi.com')
 GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-3-pro-image-preview')  # 或 'gemini-2.5-flash-image'
 
+# HTTP 连接池配置（API 主机和图片 CDN 各自独立一个连接池）
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))  # 每个主机最多保留的空闲连接数
+HTTP_POOL_IDLE_TIMEOUT = float(os.getenv('HTTP_POOL_IDLE_TIMEOUT', '60'))  # 空闲超过该秒数后重建连接池
+
+# 生成任务队列配置
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '8'))  # 排队中的任务上限，超出返回 429
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))  # 同时执行的生成流程数量
+
+# 文生图响应格式："url"（再从 CDN 下载）、"b64_json"（随响应返回）或 "auto"（按最近的耗时自动选择）
+TTI_RESPONSE_FORMAT = os.getenv('TTI_RESPONSE_FORMAT', 'auto')
+TTI_FORMAT_WINDOW = int(os.getenv('TTI_FORMAT_WINDOW', '10'))  # auto 模式参与比较的最近耗时样本数
+
+# 语音识别结果缓存（按音频内容哈希，重复上传的相同录音直接返回上次的识别结果）
+STT_CACHE_SIZE = int(os.getenv('STT_CACHE_SIZE', '64'))  # 最多缓存的识别结果数量，0 表示禁用
+STT_CACHE_TTL = float(os.getenv('STT_CACHE_TTL', '600'))  # 缓存有效时间（秒），0 表示不过期
+
+# 已编码图片缓存（/get_latest_image 轮询使用）
+IMAGE_CACHE_SIZE = int(os.getenv('IMAGE_CACHE_SIZE', '4'))  # 最多缓存的图片数量
+
+# 已解码图片缓存（上一张/下一张直接从内存返回）
+DECODED_IMAGE_CACHE_MB = float(os.getenv('DECODED_IMAGE_CACHE_MB', '64'))  # 解码后图片占用内存上限（MB），0 表示不预取
+PREFETCH_RADIUS = int(os.getenv('PREFETCH_RADIUS', '2'))  # 预取当前记录前后各多少条记录
+
+# 显示尺寸图片（保存记录时一次性生成，显示时按屏幕尺寸选择，不再把原图发给浏览器）
+RENDITION_SIZES = os.getenv('RENDITION_SIZES', '960,1440')  # 逗号分隔的长边尺寸（像素），留空表示不生成
+RENDITION_FORMAT = os.getenv('RENDITION_FORMAT', 'webp')  # "webp" 或 "jpeg"
+RENDITION_QUALITY = int(os.getenv('RENDITION_QUALITY', '85'))  # 编码质量（1~100）
+RENDITION_WORKERS = int(os.getenv('RENDITION_WORKERS', '1'))  # 后台生成显示尺寸图片的线程数（与缩略图线程池分开）
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '192'))  # 历史记录缩略图长边尺寸（像素）
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))  # 后台生成缩略图的线程数
+
+# 是否把上传的录音归档到 audio 目录（后台写入，不影响处理速度）
+AUDIO_ARCHIVE = os.getenv('AUDIO_ARCHIVE', 'true').lower() in ('1', 'true', 'yes')
+
+# 提示词 → 图片缓存（相同的提示词直接返回已生成的图片，不再调用上游接口）
+TTI_CACHE_ENABLED = os.getenv('TTI_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+TTI_CACHE_DIR = os.getenv('TTI_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'tti'))
+TTI_CACHE_MAX_ENTRIES = int(os.getenv('TTI_CACHE_MAX_ENTRIES', '500'))  # 最多缓存的图片数量
+TTI_CACHE_MAX_MB = float(os.getenv('TTI_CACHE_MAX_MB', '500'))  # 缓存目录大小上限（MB）
+TTI_CACHE_TTL_HOURS = float(os.getenv('TTI_CACHE_TTL_HOURS', '0'))  # 缓存过期时间（小时），0 表示不过期
+TTI_CACHE_HIT_POLICY = os.getenv('TTI_CACHE_HIT_POLICY', 'always')  # "always" 总是命中；"recent" 只命中最近生成的图片
+TTI_CACHE_RECENT_MINUTES = float(os.getenv('TTI_CACHE_RECENT_MINUTES', '30'))  # hit_policy="recent" 时的有效时间（分钟）
+
+# 语义近似提示词缓存（可选，需要 numpy）：与历史提示词的相似度达到阈值时直接复用那张图片
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.8'))  # 余弦相似度阈值（0~1）
+
 # 应用配置
-HISTORY_DIR = os.path.join(os.path.dirname(__file__), 'history')
-MAX_HISTORY = 50  # 最多保存50条历史记录
+HISTORY_DIR = os.getenv('HISTORY_DIR', os.path.join(os.path.dirname(__file__), 'history'))  # 基准测试等场景可指向临时目录
+DOWNLOAD_DIR = os.path.join(HISTORY_DIR, 'downloads')  # 图片流式下载的临时目录
+THUMBNAIL_DIR = os.path.join(HISTORY_DIR, 'thumbnails')  # 历史记录缩略图目录
+PIPELINE_EVENT_LOG = os.getenv('PIPELINE_EVENT_LOG', os.path.join(HISTORY_DIR, 'pipeline_events.jsonl'))  # 流程事件日志（JSONL），留空表示不写入
+IMAGE_DOWNLOAD_MAX_MB = float(os.getenv('IMAGE_DOWNLOAD_MAX_MB', '50'))  # 单张图片下载大小上限（MB）
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', '65536'))  # 下载分块大小（字节）
+MAX_HISTORY = int(os.getenv('MAX_HISTORY', '50'))  # 最多保存的历史记录条数
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'json')  # 历史记录存储引擎: "json" 或 "sqlite"
+HISTORY_COMPACT_EVERY = int(os.getenv('HISTORY_COMPACT_EVERY', '100'))  # 追加日志达到该条数后合并到 history.json
 
 # 确保历史记录目录存在
 os.makedirs(HISTORY_DIR, exist_ok=True)
@@ -0,0 +1,129 @@
+"""
+已解码图片缓存
+按记录ID缓存解码好的 PIL 图片，并在后台预取当前记录前后几条记录的图片，
+上一张/下一张直接从内存返回，不再每次切换都从（SD 卡等慢速）存储读取并解码
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """解码后图片占用的内存（字节，按每个通道 1 字节估算）"""
+    return image.width * image.height * len(image.getbands())
+
+
+class DecodedImageCache:
+    """按内存预算淘汰的 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int, workers: int = 1):
+        """
+        Args:
+            max_bytes: 缓存图片占用内存的上限（字节）
+            workers: 后台预取线程数
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 记录ID -> (图片路径, 解码后的图片, 占用字节数)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # 正在预取的记录ID
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-prefetch')
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def _lookup(self, record_id: int, image_path: str) -> Image.Image:
+        entry = self._entries.get(record_id)
+        if entry is None or entry[0] != image_path:
+            return None
+        self._entries.move_to_end(record_id)
+        return entry[1]
+
+    def _store(self, record_id: int, image_path: str, image: Image.Image, keep=()):
+        """写入缓存，按 LRU 顺序淘汰旧图片腾出空间（不淘汰 keep 中的记录，腾不出空间时放弃写入）"""
+        size = image_nbytes(image)
+        with self._lock:
+            old = self._entries.pop(record_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+            for victim in [key for key in self._entries if key not in keep]:
+                if self._bytes + size <= self.max_bytes:
+                    break
+                self._bytes -= self._entries.pop(victim)[2]
+            if self._bytes + size > self.max_bytes:
+                return
+            self._entries[record_id] = (image_path, image, size)
+            self._bytes += size
+
+    @staticmethod
+    def _decode(image_path: str) -> Image.Image:
+        image = Image.open(image_path)
+        image.load()
+        return image
+
+    def get(self, record_id: int, image_path: str) -> Image.Image:
+        """
+        获取解码好的图片（未命中时同步解码并写入缓存）
+
+        Raises:
+            OSError: 图片文件不存在或无法解码
+        """
+        with self._lock:
+            image = self._lookup(record_id, image_path)
+            if image is not None:
+                self.hits += 1
+                return image
+            self.misses += 1
+        image = self._decode(image_path)
+        self._store(record_id, image_path, image)
+        return image
+
+    def prefetch(self, items: list, keep=()):
+        """
+        在后台解码并缓存图片（按给定顺序，已缓存或正在预取的跳过）
+
+        内存不够时只淘汰这批之外的旧图片，不会为了远处的记录淘汰近处的记录和当前记录
+
+        Args:
+            items: [(记录ID, 图片路径), ...]，离当前记录越近越靠前
+            keep: 不淘汰的记录ID（如当前显示的记录）
+        """
+        if self.max_bytes <= 0:
+            return
+        keep = set(keep) | {record_id for record_id, _ in items}
+        with self._lock:
+            items = [
+                (record_id, image_path) for record_id, image_path in items
+                if record_id not in self._pending and self._lookup(record_id, image_path) is None
+            ]
+            self._pending.update(record_id for record_id, _ in items)
+        for record_id, image_path in items:
+            self._executor.submit(self._prefetch_one, record_id, image_path, keep)
+
+    def _prefetch_one(self, record_id: int, image_path: str, keep: set):
+        try:
+            self._store(record_id, image_path, self._decode(image_path), keep)
+            self.prefetched += 1
+        except Exception as e:
+            print(f"⚠️ 预取图片失败（记录 {record_id}）: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(record_id)
+
+    def stats(self) -> dict:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'prefetched': self.prefetched,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
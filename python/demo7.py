@@ -8,12 +8,29 @@ import os
 import time
 import shutil
 import json
+import mimetypes
 import requests
 from fastapi import FastAPI, Request, UploadFile, File
-from starlette.responses import JSONResponse
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import tempfile
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from doubao_service import doubao_service
+from prompt_normalizer import clean_prompt
+from stt_errors import is_stt_error
+from async_doubao_service import async_doubao_service, HTTPX_AVAILABLE
 from history_manager import history_manager
+from job_queue import JobQueue, QueueFullError, current_job_id
+from event_bus import event_bus
+from audio_decode import AUDIO_DECODE_AVAILABLE, decode_to_wav_bytes
+from image_cache import EncodedImageCache
+from decoded_image_cache import DecodedImageCache
+from metrics import metrics
+from pipeline_events import pipeline_events
+from renditions import select_rendition
+import config
 
 
 # ========== 显示配置参数 ==========
@@ -47,20 +64,131 @@ def get_image_size():
     
     return 900, 900  # 默认值
 
+
+def get_display_path(record: dict, size: int = None) -> str:
+    """
+    选择记录在当前显示尺寸下使用的图片文件（预生成的缩小版本，没有合适的版本时为原图）
+    
+    不等待后台生成：新记录的缩小版本还没生成完时返回原图。需要缩小版本的调用方先等待生成结束——
+    异步接口调用 wait_renditions_async（不阻塞事件循环），同步的 Gradio 回调和后台线程调用
+    history_manager.wait_renditions
+    
+    Args:
+        record: 历史记录
+        size: 显示区域边长（像素），默认按 DISPLAY_CONFIG 计算
+    """
+    if size:
+        return select_rendition(record, size, size)
+    height, width = get_image_size()
+    return select_rendition(record, width, height)
+
+
+async def wait_renditions_async(record: dict, timeout: float = 10):
+    """等待记录的显示尺寸图片在后台生成完（异步版本，不阻塞事件循环）"""
+    future = history_manager.pending_renditions(record['id'])
+    if future is not None:
+        await asyncio.wait([asyncio.wrap_future(future)], timeout=timeout)
+
+
+def open_display_image(record: dict, wait: bool = True) -> Image.Image:
+    """
+    获取记录在当前显示尺寸下使用的图片（已解码，优先从内存缓存读取）
+    
+    默认会同步等待缩小版本生成完，只在 Gradio 回调或线程池中调用，不要在事件循环中直接调用；
+    调用方已经等待过时传 wait=False
+    """
+    if wait:
+        history_manager.wait_renditions(record['id'])
+    return decoded_image_cache.get(record['id'], get_display_path(record))
+
+
+def prefetch_neighbours(record_id: int):
+    """
+    在后台预取当前记录前后各 PREFETCH_RADIUS 条记录的图片，上一张/下一张直接从内存返回
+    
+    查找相邻记录、等待缩小版本和选择图片路径都在预取线程中进行，可以在事件循环中直接调用
+    """
+    prefetch_planner.submit(_prefetch_neighbours, record_id)
+
+
+def _prefetch_neighbours(record_id: int):
+    try:
+        items = []
+        for distance in range(1, config.PREFETCH_RADIUS + 1):
+            for step in (-distance, distance):
+                record = history_manager.get_adjacent_record(record_id, step)
+                if record is not None:
+                    history_manager.wait_renditions(record['id'])
+                    items.append((record['id'], get_display_path(record)))
+        decoded_image_cache.prefetch(items, keep=(record_id,))
+    except Exception as e:
+        print(f"⚠️ 预取相邻记录失败（记录 {record_id}）: {e}")
+
 # 目录配置
 BASE_DIR = os.path.dirname(__file__)
 AUDIO_DIR = os.path.join(BASE_DIR, "audio")
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+
+def make_audio_path(suffix: str, prefix: str = "temp_") -> str:
+    """
+    在 audio 目录下创建一个唯一的空文件并返回路径
+    
+    同时执行的任务（JOB_WORKERS > 1）在同一毫秒内也不会得到相同的文件名而互相覆盖
+    """
+    with tempfile.NamedTemporaryFile(dir=AUDIO_DIR, prefix=prefix, suffix=suffix, delete=False) as f:
+        return f.name
+
 # 全局状态
 current_image = None
 current_text = ""
 current_record_id = None
 
 
+def publish_progress(value: float, desc: str):
+    """推送流程进度事件（SSE）"""
+    event_bus.publish("progress", {
+        "job_id": current_job_id.get(),
+        "progress": value,
+        "stage": desc
+    })
+
+
+def make_download_progress(start: float = 0.7, end: float = 0.9):
+    """
+    创建图片下载进度回调（按 10% 步进推送进度事件，不为每个数据块都推送）
+    
+    Args:
+        start: 下载开始时的整体进度
+        end: 下载完成时的整体进度
+    """
+    last_step = [-1]
+    
+    def callback(downloaded: int, total: int):
+        if not total:
+            return
+        step = min(int(downloaded * 10 / total), 10)
+        if step != last_step[0]:
+            last_step[0] = step
+            publish_progress(start + (end - start) * step / 10, "图片下载中")
+    
+    return callback
+
+
+def publish_record_ready(record: dict):
+    """推送新图片就绪事件（SSE）"""
+    event_bus.publish("record", {
+        "job_id": current_job_id.get(),
+        "record_id": record['id'],
+        "text": record['text'],
+        "timestamp": record['timestamp'],
+        "image_url": f"/images/{record['id']}"
+    })
+
+
 def process_audio_and_generate(audio, progress=gr.Progress()):
     """
-    处理音频并自动生成图片（完整流程）
+    处理音频并自动生成图片（Gradio 回调）
     
     Args:
         audio: Gradio Audio组件返回的音频数据
@@ -69,16 +197,37 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
     Returns:
         gr.update: 使用 gr.update() 保持当前图片，只在成功时更新
     """
+    record = generate_record_from_audio(audio, progress)
+    if record is None:
+        # 使用 gr.update() 保持当前图片
+        return gr.update(value=current_image) if current_image else None
+    # 成功时返回新图片（显示尺寸的缩小版本，不发送原图）
+    history_manager.wait_renditions(record['id'])
+    return gr.update(value=get_display_path(record))
+
+
+def generate_record_from_audio(audio, progress=None, filename: str = "audio.webm"):
+    """
+    处理音频并自动生成图片（完整流程，同步版本）
+    
+    Args:
+        audio: Gradio Audio组件返回的音频数据（文件路径或 (采样率, 数据)），
+               或上传的原始音频字节（全程在内存中识别，不写入 audio 目录）
+        progress: Gradio进度条对象，为None时只推送进度事件
+        filename: audio 为字节时的原始文件名（用于判断格式）
+        
+    Returns:
+        dict: 新增的历史记录，失败返回None
+    """
     global current_image, current_text, current_record_id
     
     if audio is None:
         print("⚠️ 未检测到音频数据")
-        # 使用 gr.update() 保持当前图片
-        return gr.update(value=current_image) if current_image else None
+        return None
     
     try:
-        # 记录总开始时间
-        total_start_time = time.time()
+        # 记录总开始时间（单调时钟，不受系统时间调整影响）
+        total_start_time = time.perf_counter()
         # 初始化时间统计变量
         stt_duration = 0.0
         tti_duration = 0.0
@@ -87,14 +236,19 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
         if progress:
             progress(0.1, desc="开始生成")
         progress_status = "开始生成"
+        publish_progress(0.1, "开始生成")
         print("=" * 60)
         print("🚀 开始处理流程")
         print("=" * 60)
         
         audio_path = None
+        in_memory = isinstance(audio, (bytes, bytearray))
+        upload_start_time = time.perf_counter()
         
         # 处理音频数据
-        if isinstance(audio, str):
+        if in_memory:
+            print(f"📁 音频数据: {len(audio)} 字节（内存）")
+        elif isinstance(audio, str):
             if os.path.exists(audio):
                 audio_abs = os.path.abspath(audio)
                 audio_dir_abs = os.path.abspath(AUDIO_DIR)
@@ -118,8 +272,8 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
         elif isinstance(audio, tuple):
             sample_rate, audio_data = audio
             # 先保存为临时 wav 文件，然后转换为 webm
-            temp_wav_path = os.path.join(AUDIO_DIR, f"temp_{int(time.time() * 1000)}.wav")
-            audio_path = os.path.join(AUDIO_DIR, f"audio_{int(time.time() * 1000)}.webm")
+            temp_wav_path = make_audio_path(".wav")
+            audio_path = make_audio_path(".webm", prefix="audio_")
             print(f"📁 保存音频到: {audio_path}")
             print(f"📊 采样率: {sample_rate}, 数据形状: {audio_data.shape if hasattr(audio_data, 'shape') else 'N/A'}")
             
@@ -147,7 +301,7 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
                     print(f"❌ 音频保存失败: {e}")
                     import traceback
                     traceback.print_exc()
-                    return gr.update(value=current_image) if current_image else None
+                    return None
             
             # 尝试转换为 webm 格式
             try:
@@ -174,71 +328,85 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
                 except (subprocess.CalledProcessError, FileNotFoundError):
                     # 如果无法转换为 webm，直接使用 wav 文件
                     print("⚠️ 无法转换为 webm，使用 wav 格式")
-                    audio_path = temp_wav_path
-                    # 重命名为 webm（虽然实际是 wav，但 API 应该能处理）
-                    webm_path = audio_path.replace('.wav', '.webm')
-                    shutil.move(audio_path, webm_path)
-                    audio_path = webm_path
+                    # 移动到已创建的 webm 文件名（虽然实际是 wav，但 API 应该能处理）
+                    shutil.move(temp_wav_path, audio_path)
             except Exception as e:
                 # 如果转换失败，使用 wav 文件
                 print(f"⚠️ 转换为 webm 失败: {e}，使用 wav 格式")
-                audio_path = temp_wav_path
-                # 重命名为 webm（虽然实际是 wav，但 API 应该能处理）
-                webm_path = audio_path.replace('.wav', '.webm')
-                if os.path.exists(audio_path):
-                    shutil.move(audio_path, webm_path)
-                    audio_path = webm_path
+                # 移动到已创建的 webm 文件名（虽然实际是 wav，但 API 应该能处理）
+                if os.path.exists(temp_wav_path):
+                    shutil.move(temp_wav_path, audio_path)
         else:
             print(f"❌ 不支持的音频格式: {type(audio)}")
-            return gr.update(value=current_image) if current_image else None
+            return None
         
-        if not audio_path or not os.path.exists(audio_path):
+        if not in_memory and (not audio_path or not os.path.exists(audio_path)):
             print("❌ 音频文件不存在")
-            return gr.update(value=current_image) if current_image else None
+            return None
+        metrics.observe("upload_save", time.perf_counter() - upload_start_time)
         
         # ========== 阶段2: 音频转文字 ==========
         if progress:
             progress(0.3, desc="音频处理中")
         progress_status = "音频处理中"
+        publish_progress(0.3, "音频处理中")
         print("-" * 60)
         print("🎤 开始语音识别")
-        print(f"📁 音频文件: {audio_path}")
+        if not in_memory:
+            print(f"📁 音频文件: {audio_path}")
         
         # 如果音频文件是 webm 格式，需要转换为 wav（Whisper API 需要）
-        actual_audio_path = audio_path
+        actual_audio_path = audio if in_memory else audio_path
         temp_wav_path = None
+        temp_webm_path = None
         
-        if audio_path.lower().endswith('.webm'):
+        if (filename if in_memory else audio_path).lower().endswith('.webm'):
             print("🔄 检测到 webm 格式，转换为 wav 格式以适配 Whisper API...")
+            transcode_start_time = time.perf_counter()
             conversion_success = False
-            temp_wav_path = os.path.join(AUDIO_DIR, f"temp_{int(time.time() * 1000)}.wav")
             
-            # 方法1：优先尝试直接使用 ffmpeg（最直接的方法）
-            try:
-                import subprocess
-                # 使用 ffmpeg 转换：webm -> wav (16kHz, 单声道, PCM 16位)
-                result = subprocess.run([
-                    "ffmpeg", "-i", audio_path, "-acodec", "pcm_s16le",
-                    "-ar", "16000", "-ac", "1", temp_wav_path, "-y"
-                ], check=True, capture_output=True, timeout=30)
-                actual_audio_path = temp_wav_path
-                conversion_success = True
-                print("✅ 使用 ffmpeg 转换为 wav 成功")
-            except FileNotFoundError:
-                # ffmpeg 未找到，尝试使用 pydub（pydub 也需要 ffmpeg，但可能路径不同）
+            # 方法0：优先在进程内解码（PyAV + NumPy 重采样），不启动子进程、不写临时文件
+            if AUDIO_DECODE_AVAILABLE:
                 try:
-                    from pydub import AudioSegment
-                    audio_segment = AudioSegment.from_file(audio_path, format="webm")
-                    audio_segment.export(temp_wav_path, format="wav")
+                    actual_audio_path = decode_to_wav_bytes(BytesIO(audio) if in_memory else audio_path)
+                    filename = "audio.wav"
+                    conversion_success = True
+                    print("✅ 进程内解码为 16kHz wav 成功")
+                except Exception as e:
+                    print(f"⚠️ 进程内解码失败: {e}，回退到 ffmpeg")
+            
+            # 方法1：使用 ffmpeg 子进程转换
+            if not conversion_success:
+                if in_memory:
+                    # ffmpeg 需要文件，内存中的上传数据先写入临时文件（识别后删除）
+                    audio_path = temp_webm_path = make_audio_path(".webm")
+                    _write_audio_file(audio_path, audio)
+                temp_wav_path = make_audio_path(".wav")
+                try:
+                    import subprocess
+                    # 使用 ffmpeg 转换：webm -> wav (16kHz, 单声道, PCM 16位)
+                    result = subprocess.run([
+                        "ffmpeg", "-i", audio_path, "-acodec", "pcm_s16le",
+                        "-ar", "16000", "-ac", "1", temp_wav_path, "-y"
+                    ], check=True, capture_output=True, timeout=30)
                     actual_audio_path = temp_wav_path
                     conversion_success = True
-                    print("✅ 使用 pydub 转换为 wav 成功")
-                except (ImportError, Exception) as e:
-                    print(f"⚠️ pydub 转换失败: {e}")
+                    print("✅ 使用 ffmpeg 转换为 wav 成功")
+                except FileNotFoundError:
+                    # ffmpeg 未找到，尝试使用 pydub（pydub 也需要 ffmpeg，但可能路径不同）
+                    try:
+                        from pydub import AudioSegment
+                        audio_segment = AudioSegment.from_file(audio_path, format="webm")
+                        audio_segment.export(temp_wav_path, format="wav")
+                        actual_audio_path = temp_wav_path
+                        conversion_success = True
+                        print("✅ 使用 pydub 转换为 wav 成功")
+                    except (ImportError, Exception) as e:
+                        print(f"⚠️ pydub 转换失败: {e}")
+                        conversion_success = False
+                except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                    print(f"⚠️ ffmpeg 转换失败: {e}")
                     conversion_success = False
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-                print(f"⚠️ ffmpeg 转换失败: {e}")
-                conversion_success = False
             
             # 如果转换失败，给出清晰的错误提示
             if not conversion_success:
@@ -254,110 +422,145 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
                 )
                 print(error_msg)
                 # 仍然尝试使用原始文件（可能失败）
+            metrics.observe("transcode", time.perf_counter() - transcode_start_time)
         
         # 开始计时：音频转文字
-        stt_start_time = time.time()
+        stt_start_time = time.perf_counter()
         try:
-            recognized_text = doubao_service.audio_to_text(actual_audio_path)
-            stt_end_time = time.time()
+            recognized_text = doubao_service.audio_to_text(actual_audio_path, filename=filename)
+            stt_end_time = time.perf_counter()
             stt_duration = stt_end_time - stt_start_time
+            metrics.observe("stt", stt_duration)
             
             print(f"✅ 识别成功: {recognized_text}")
             print(f"⏱️ 音频转文字耗时: {stt_duration:.2f} 秒")
             
             if not recognized_text or not recognized_text.strip():
                 print("❌ 识别结果为空")
-                return gr.update(value=current_image) if current_image else None
+                return None
+            if is_stt_error(recognized_text):
+                print(f"❌ {recognized_text}，不生成图片")
+                return None
             
-            current_text = recognized_text.strip()
+            # 繁转简、去掉语气词和首尾标点，作为发送给上游的提示词
+            # （只用局部变量：队列的多个工作线程同时运行，全局的 current_text 随时可能被其他任务改写）
+            prompt = clean_prompt(recognized_text)
+            pipeline_events.annotate(transcript=recognized_text, prompt=prompt)
             
         except Exception as e:
-            stt_end_time = time.time()
+            stt_end_time = time.perf_counter()
             stt_duration = stt_end_time - stt_start_time
+            metrics.observe("stt", stt_duration)
             print(f"❌ 语音识别错误: {e}")
             print(f"⏱️ 音频转文字耗时: {stt_duration:.2f} 秒（失败）")
             import traceback
             traceback.print_exc()
-            return gr.update(value=current_image) if current_image else None
+            return None
         finally:
-            # 清理临时 wav 文件
-            if temp_wav_path and os.path.exists(temp_wav_path):
-                try:
-                    os.remove(temp_wav_path)
-                    print(f"🗑️ 已清理临时文件: {temp_wav_path}")
-                except Exception as e:
-                    print(f"⚠️ 清理临时文件失败: {e}")
+            # 清理临时 wav / webm 文件
+            for temp_path in (temp_wav_path, temp_webm_path):
+                if temp_path and os.path.exists(temp_path):
+                    try:
+                        os.remove(temp_path)
+                        print(f"🗑️ 已清理临时文件: {temp_path}")
+                    except Exception as e:
+                        print(f"⚠️ 清理临时文件失败: {e}")
         
         # ========== 阶段3: 文本生成完毕 ==========
         if progress:
             progress(0.5, desc="文本生成完毕")
         progress_status = "文本生成完毕"
+        publish_progress(0.5, "文本生成完毕")
         print("-" * 60)
-        print(f"📝 识别文字: {current_text}")
+        print(f"📝 识别文字: {prompt}")
         
         # ========== 阶段4: 文字转图片 ==========
         if progress:
             progress(0.6, desc="文本处理中")
         progress_status = "文本处理中"
+        publish_progress(0.6, "文本处理中")
         print("-" * 60)
         print("🎨 开始生成图片")
-        print(f"📝 提示词: {current_text}")
+        print(f"📝 提示词: {prompt}")
         
         # 开始计时：文字转图片
-        tti_start_time = time.time()
+        tti_start_time = time.perf_counter()
         try:
-            image, recognized_text = doubao_service.text_to_image(
-                current_text,
-                use_gemini=False,
-                aspect_ratio="1:1",
-                image_size="1K"
-            )
-            tti_end_time = time.time()
+            # 先查语义近似缓存（与历史提示词足够相似时直接复用历史图片）
+            similar = history_manager.find_similar_image(prompt)
+            if similar is not None:
+                image, _ = similar
+            else:
+                image, _ = doubao_service.text_to_image(
+                    prompt,
+                    use_gemini=False,
+                    aspect_ratio="1:1",
+                    image_size="1K",
+                    progress_callback=make_download_progress()
+                )
+            tti_end_time = time.perf_counter()
             tti_duration = tti_end_time - tti_start_time
+            metrics.observe("tti", tti_duration)
             
             print(f"✅ 图片生成成功")
             print(f"🖼️ 图片尺寸: {image.size if image else 'N/A'}")
             print(f"⏱️ 文字转图片耗时: {tti_duration:.2f} 秒")
             
         except Exception as e:
-            tti_end_time = time.time()
+            tti_end_time = time.perf_counter()
             tti_duration = tti_end_time - tti_start_time
+            metrics.observe("tti", tti_duration)
             print(f"❌ 图片生成错误: {e}")
             print(f"⏱️ 文字转图片耗时: {tti_duration:.2f} 秒（失败）")
             import traceback
             traceback.print_exc()
-            return gr.update(value=current_image) if current_image else None
+            return None
         
         # ========== 阶段5: 保存到历史记录 ==========
         if progress:
             progress(0.9, desc="图片生成完毕")
         progress_status = "图片生成完毕"
+        publish_progress(0.9, "图片生成完毕")
         print("-" * 60)
         print("💾 保存到历史记录")
         
         try:
-            record = history_manager.add_record(image, recognized_text)
-            current_image = image
-            current_text = recognized_text
+            with metrics.span("history_save"):
+                record = history_manager.add_record(image, prompt)
+            print(f"✅ 保存成功，记录ID: {record['id']}")
+            # 先通知前端，前端请求图片时缩小版本在后台生成
+            with metrics.span("notify"):
+                publish_record_ready(record)
+            # 等待缩小版本生成单独计时，不算进解码耗时
+            with metrics.span("rendition_wait"):
+                history_manager.wait_renditions(record['id'])
+            with metrics.span("decode"):
+                display_image = open_display_image(record, wait=False)
+            # 保存成功后再一起更新显示用的全局状态
+            current_image = display_image
+            current_text = prompt
             current_record_id = record['id']
-            print(f"✅ 保存成功，记录ID: {current_record_id}")
+            prefetch_neighbours(record['id'])
         except Exception as e:
             print(f"⚠️ 保存历史记录失败: {e}")
             import traceback
             traceback.print_exc()
+            return None
         
         # ========== 完成 ==========
         if progress:
             progress(1.0, desc="完成")
+        publish_progress(1.0, "完成")
         
         # 计算总耗时
-        total_end_time = time.time()
+        total_end_time = time.perf_counter()
         total_duration = total_end_time - total_start_time
+        metrics.observe("total", total_duration)
         
         print("=" * 60)
         print("✅ 流程完成！")
-        print(f"📝 文字: {recognized_text}")
-        print(f"🖼️ 图片ID: {current_record_id}")
+        print(f"📝 文字: {prompt}")
+        print(f"🖼️ 图片ID: {record['id']}")
         print("-" * 60)
         print("⏱️ 时间统计:")
         print(f"   - 音频转文字: {stt_duration:.2f} 秒")
@@ -365,13 +568,13 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
         print(f"   - 总耗时: {total_duration:.2f} 秒")
         print("=" * 60)
         
-        # 成功时返回新图片
-        return gr.update(value=image)
+        return record
         
     except Exception as e:
         # 计算总耗时（即使失败）
-        total_end_time = time.time()
+        total_end_time = time.perf_counter()
         total_duration = total_end_time - total_start_time
+        metrics.observe("total", total_duration)
         
         error_msg = f"❌ 处理失败: {str(e)}"
         print(error_msg)
@@ -393,7 +596,7 @@ def process_audio_and_generate(audio, progress=gr.Progress()):
         print("=" * 60)
         
         # 保持当前图片不变，使用 gr.update() 避免清空
-        return gr.update(value=current_image) if current_image else None
+        return None
 
 
 def get_previous_image():
@@ -404,19 +607,20 @@ def get_previous_image():
         print("⚠️ 没有当前图片")
         return None
     
-    current_idx = history_manager.get_current_index(current_record_id)
-    if current_idx <= 0:
+    # 键集分页：直接按当前记录ID取上一条，不需要先计算下标
+    prev_record = history_manager.get_adjacent_record(current_record_id, -1)
+    if prev_record is None:
         print("⚠️ 已经是第一张")
         return current_image
     
-    prev_record = history_manager.get_record(current_idx - 1)
     if prev_record:
         try:
-            image = Image.open(prev_record['image_path'])
+            image = open_display_image(prev_record)
             current_image = image
             current_text = prev_record['text']
             current_record_id = prev_record['id']
             print(f"📸 切换到上一张: {prev_record['text']}")
+            prefetch_neighbours(current_record_id)
             return image
         except Exception as e:
             print(f"❌ 加载失败: {e}")
@@ -433,21 +637,19 @@ def get_next_image():
         print("⚠️ 没有当前图片")
         return None
     
-    current_idx = history_manager.get_current_index(current_record_id)
-    history = history_manager.get_history()
-    
-    if current_idx >= len(history) - 1:
+    next_record = history_manager.get_adjacent_record(current_record_id, 1)
+    if next_record is None:
         print("⚠️ 已经是最后一张")
         return current_image
     
-    next_record = history_manager.get_record(current_idx + 1)
     if next_record:
         try:
-            image = Image.open(next_record['image_path'])
+            image = open_display_image(next_record)
             current_image = image
             current_text = next_record['text']
             current_record_id = next_record['id']
             print(f"📸 切换到下一张: {next_record['text']}")
+            prefetch_neighbours(current_record_id)
             return image
         except Exception as e:
             print(f"❌ 加载失败: {e}")
@@ -460,14 +662,14 @@ def init_app():
     """初始化应用，加载最后一张历史记录"""
     global current_image, current_text, current_record_id
     
-    history = history_manager.get_history()
-    if history:
-        last_record = history[-1]
+    last_record = history_manager.get_latest_record()
+    if last_record:
         try:
-            current_image = Image.open(last_record['image_path'])
+            current_image = open_display_image(last_record)
             current_text = last_record['text']
             current_record_id = last_record['id']
             print(f"📸 加载历史记录: {last_record['text']}")
+            prefetch_neighbours(current_record_id)
             return current_image
         except Exception as e:
             print(f"⚠️ 加载历史记录失败: {e}")
@@ -476,47 +678,317 @@ def init_app():
     return None
 
 
+async def _convert_webm_to_wav_async(audio_path: str):
+    """
+    使用 ffmpeg 子进程（asyncio）将 webm 转换为 wav，不阻塞事件循环
+    
+    Returns:
+        str: 转换后的 wav 路径，失败返回 None
+    """
+    temp_wav_path = make_audio_path(".wav")
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-i", audio_path, "-acodec", "pcm_s16le",
+            "-ar", "16000", "-ac", "1", temp_wav_path, "-y",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        returncode = await asyncio.wait_for(proc.wait(), timeout=30)
+        if returncode == 0:
+            print("✅ 使用 ffmpeg 转换为 wav 成功")
+            return temp_wav_path
+        print(f"⚠️ ffmpeg 转换失败，返回码: {returncode}")
+    except FileNotFoundError:
+        print("⚠️ 未找到 ffmpeg，尝试直接使用 webm 文件（可能失败）")
+    except asyncio.TimeoutError:
+        print("⚠️ ffmpeg 转换超时")
+        proc.kill()
+    if os.path.exists(temp_wav_path):
+        os.remove(temp_wav_path)
+    return None
+
+
+def _write_audio_file(path: str, data: bytes):
+    """把音频数据写入文件（在线程池中执行）"""
+    try:
+        with open(path, "wb") as f:
+            f.write(data)
+    except Exception as e:
+        print(f"⚠️ 写入音频文件失败: {e}")
+
+
+async def process_audio_and_generate_async(audio, filename: str = "audio.webm"):
+    """
+    处理音频并自动生成图片（asyncio 版本，运行在 uvicorn 事件循环上）
+    
+    Args:
+        audio: 音频文件路径（webm/wav），或上传的原始音频字节（全程在内存中处理）
+        filename: audio 为字节时的原始文件名（用于判断格式）
+        
+    Returns:
+        dict: 新增的历史记录，识别失败返回None
+    """
+    global current_image, current_text, current_record_id
+    
+    total_start_time = time.perf_counter()
+    publish_progress(0.1, "开始生成")
+    print("=" * 60)
+    print("🚀 开始处理流程（异步）")
+    print("=" * 60)
+    
+    # ========== 阶段1: 音频转文字 ==========
+    publish_progress(0.3, "音频处理中")
+    loop = asyncio.get_running_loop()
+    in_memory = isinstance(audio, (bytes, bytearray))
+    source_name = filename if in_memory else audio
+    actual_audio = audio
+    temp_files = []
+    if source_name.lower().endswith('.webm'):
+        print("🔄 检测到 webm 格式，转换为 wav 格式以适配 Whisper API...")
+        transcode_start_time = time.perf_counter()
+        if AUDIO_DECODE_AVAILABLE:
+            # 进程内解码是 CPU 操作，放到线程池执行，避免阻塞事件循环
+            try:
+                source = BytesIO(audio) if in_memory else audio
+                actual_audio = await loop.run_in_executor(None, decode_to_wav_bytes, source)
+                filename = "audio.wav"
+                print("✅ 进程内解码为 16kHz wav 成功")
+            except Exception as e:
+                print(f"⚠️ 进程内解码失败: {e}，回退到 ffmpeg")
+        if actual_audio is audio:
+            # 回退：ffmpeg 需要文件，内存中的上传数据先写入临时文件
+            audio_path = audio
+            if in_memory:
+                audio_path = make_audio_path(".webm")
+                await loop.run_in_executor(None, _write_audio_file, audio_path, audio)
+                temp_files.append(audio_path)
+            temp_wav_path = await _convert_webm_to_wav_async(audio_path)
+            if temp_wav_path:
+                actual_audio = temp_wav_path
+                temp_files.append(temp_wav_path)
+        metrics.observe("transcode", time.perf_counter() - transcode_start_time)
+    
+    stt_start_time = time.perf_counter()
+    try:
+        recognized_text = await async_doubao_service.audio_to_text(actual_audio, filename=filename)
+    finally:
+        for temp_path in temp_files:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                    print(f"🗑️ 已清理临时文件: {temp_path}")
+                except Exception as e:
+                    print(f"⚠️ 清理临时文件失败: {e}")
+    stt_duration = time.perf_counter() - stt_start_time
+    metrics.observe("stt", stt_duration)
+    print(f"⏱️ 音频转文字耗时: {stt_duration:.2f} 秒")
+    
+    if not recognized_text or not recognized_text.strip():
+        print("❌ 识别结果为空")
+        return None
+    if is_stt_error(recognized_text):
+        # 识别失败的提示文字不能当作提示词去生成图片，任务按失败结束
+        print(f"❌ {recognized_text}，不生成图片")
+        pipeline_events.annotate(stt_error=recognized_text)
+        return None
+    # 繁转简、去掉语气词和首尾标点，作为发送给上游的提示词
+    # （只用局部变量：等待上游时其他任务可能改写全局的 current_text）
+    prompt = clean_prompt(recognized_text)
+    pipeline_events.annotate(transcript=recognized_text, prompt=prompt)
+    print(f"📝 提示词: {prompt}")
+    publish_progress(0.5, "文本生成完毕")
+    
+    # ========== 阶段2: 文字转图片 ==========
+    publish_progress(0.6, "文本处理中")
+    print("-" * 60)
+    print("🎨 开始生成图片")
+    tti_start_time = time.perf_counter()
+    # 先查语义近似缓存（与历史提示词足够相似时直接复用历史图片）
+    similar = await loop.run_in_executor(None, history_manager.find_similar_image, prompt)
+    if similar is not None:
+        image, _ = similar
+    else:
+        image, _ = await async_doubao_service.text_to_image(
+            prompt, progress_callback=make_download_progress()
+        )
+    tti_duration = time.perf_counter() - tti_start_time
+    metrics.observe("tti", tti_duration)
+    print(f"🖼️ 图片尺寸: {image.size if image else 'N/A'}")
+    print(f"⏱️ 文字转图片耗时: {tti_duration:.2f} 秒")
+    
+    # ========== 阶段3: 保存到历史记录 ==========
+    # 图片编码和写盘是 CPU/磁盘操作，放到默认线程池执行，避免阻塞事件循环
+    publish_progress(0.9, "图片生成完毕")
+    print("-" * 60)
+    print("💾 保存到历史记录")
+    loop = asyncio.get_running_loop()
+    with metrics.span("history_save"):
+        record = await loop.run_in_executor(None, history_manager.add_record, image, prompt)
+    # 先通知前端，前端请求图片时缩小版本在后台生成
+    with metrics.span("notify"):
+        publish_record_ready(record)
+    # 等待缩小版本生成单独计时，不算进解码耗时
+    with metrics.span("rendition_wait"):
+        await wait_renditions_async(record)
+    with metrics.span("decode"):
+        display_image = await loop.run_in_executor(None, open_display_image, record, False)
+    # 保存成功后再一起更新显示用的全局状态
+    current_image = display_image
+    current_text = prompt
+    current_record_id = record['id']
+    prefetch_neighbours(record['id'])
+    publish_progress(1.0, "完成")
+    
+    total_duration = time.perf_counter() - total_start_time
+    metrics.observe("total", total_duration)
+    print("=" * 60)
+    print("✅ 流程完成！")
+    print(f"📝 文字: {prompt}")
+    print(f"🖼️ 图片ID: {record['id']}")
+    print("-" * 60)
+    print("⏱️ 时间统计:")
+    print(f"   - 音频转文字: {stt_duration:.2f} 秒")
+    print(f"   - 文字转图片: {tti_duration:.2f} 秒")
+    print(f"   - 总耗时: {total_duration:.2f} 秒")
+    print("=" * 60)
+    return record
+
+
+async def run_generation_job(payload: dict):
+    """
+    任务队列的处理函数：执行一次完整的生成流程，并把本次任务写入流程事件日志
+    
+    Args:
+        payload: {"audio": 上传的音频字节, "filename": 文件名, "received_at": 接收时间（Unix 秒）}
+        
+    Returns:
+        dict: 任务结果（包含新图片的记录ID）
+    """
+    event = pipeline_events.begin(
+        job_id=current_job_id.get(),
+        received_at=payload.get("received_at"),
+        audio_bytes=len(payload["audio"]),
+        started_at=time.time(),
+        status="failed",
+    )
+    event['stages'] = metrics.collect_stages()
+    try:
+        result = await _run_generation_pipeline(payload)
+        event.update(status="done", record_id=result["record_id"])
+        return result
+    except Exception as e:
+        event['error'] = str(e)
+        raise
+    finally:
+        event['finished_at'] = time.time()
+        pipeline_events.write(event)
+
+
+async def _run_generation_pipeline(payload: dict):
+    """按是否安装 httpx 选择异步或同步流程，返回 {"record_id": 新记录ID}"""
+    if HTTPX_AVAILABLE:
+        record = await process_audio_and_generate_async(payload["audio"], payload["filename"])
+        if record is None:
+            raise ValueError("语音识别失败，未生成图片")
+        record_id = record['id']
+    else:
+        # 没有 httpx 时在线程池中运行同步流程（并发数仍由工作协程数量限制）
+        # 复制上下文，让工作线程中的进度事件也能带上任务ID
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        record = await loop.run_in_executor(
+            None, context.run, generate_record_from_audio, payload["audio"], None, payload["filename"]
+        )
+        if record is None:
+            raise ValueError("生成失败，未生成新图片")
+        record_id = record['id']
+    print("✅ VAD 音频处理完成（后台）")
+    return {"record_id": record_id}
+
+
+def job_summary(job: dict) -> dict:
+    """任务信息的对外表示（/jobs 接口和 SSE 事件共用）"""
+    return {
+        "job_id": job['id'],
+        "job_status": job['status'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "error": job['error'],
+        "record_id": job['result']['record_id'] if job['result'] else None,
+    }
+
+
+# 生成任务队列（有界，超出上限的上传直接拒绝），任务状态变化时推送 SSE 事件
+job_queue = JobQueue(
+    run_generation_job,
+    max_size=config.JOB_QUEUE_SIZE,
+    num_workers=config.JOB_WORKERS,
+    on_update=lambda job: event_bus.publish("job", job_summary(job))
+)
+
+
+# 最新图片的已编码数据缓存（轮询同一张图片时不再重复编码）
+encoded_image_cache = EncodedImageCache(max_entries=config.IMAGE_CACHE_SIZE)
+
+# 已解码图片缓存（上一张/下一张从内存返回，相邻记录在后台预取）
+decoded_image_cache = DecodedImageCache(max_bytes=int(config.DECODED_IMAGE_CACHE_MB * 1024 * 1024))
+# 查找需要预取的相邻记录（可能要等待缩小版本生成），不占用事件循环
+prefetch_planner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch-plan')
+
+
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def start_job_queue():
+    """应用启动时启动任务队列的工作协程，并绑定事件总线"""
+    event_bus.bind(asyncio.get_running_loop())
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_async_clients():
+    """应用退出时停止任务队列并关闭异步 HTTP 客户端"""
+    await job_queue.stop()
+    await async_doubao_service.aclose()
+
+
 @app.post("/vad_upload")
 async def vad_upload(file: UploadFile = File(...)):
     """
-    接收前端 VAD 录音（webm/wav），保存临时文件，复用现有处理逻辑
+    接收前端 VAD 录音（webm/wav），音频数据直接在内存中交给处理流程，不写临时文件
     """
     try:
         print("🛰️ /vad_upload 收到请求")
         suffix = ".webm"
-        filename = f"vad_{int(time.time() * 1000)}{suffix}"
-        temp_path = os.path.join(AUDIO_DIR, filename)
-        # 保存文件
-        with open(temp_path, "wb") as f:
+        received_at = time.time()
+        filename = f"vad_{int(received_at * 1000)}{suffix}"
+        with metrics.span("upload_save"):
             content = await file.read()
-            f.write(content)
-        print(f"💾 VAD 音频已保存: {temp_path}")
+        print(f"📥 VAD 音频已接收: {len(content)} 字节")
         
-        # ✅ 异步处理：在后台执行，不阻塞 HTTP 响应
-        import threading
-        
-        def process_in_background():
-            """在后台线程中处理音频"""
-            try:
-                process_audio_and_generate(temp_path, progress=None)
-                print("✅ VAD 音频处理完成（后台）")
-            except Exception as e:
-                print(f"❌ 后台处理失败: {e}")
-                import traceback
-                traceback.print_exc()
+        # ✅ 提交到任务队列，由工作协程在后台处理，不阻塞 HTTP 响应
+        try:
+            job = job_queue.submit({"audio": content, "filename": filename, "received_at": received_at})
+        except QueueFullError as e:
+            print(f"⚠️ {e}，拒绝本次上传")
+            pipeline_events.write({
+                "event": "job", "received_at": received_at, "audio_bytes": len(content), "status": "rejected"
+            })
+            return JSONResponse({"status": "busy", "msg": str(e)}, status_code=429)
         
-        # 启动后台线程处理
-        thread = threading.Thread(target=process_in_background, daemon=True)
-        thread.start()
-        print("🚀 已启动后台处理线程，立即返回响应")
+        # 可选：在线程池中把音频归档到 audio 目录（不在关键路径上，不等待完成）
+        if config.AUDIO_ARCHIVE:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(None, _write_audio_file, os.path.join(AUDIO_DIR, filename), content)
+        print(f"🚀 已提交生成任务: {job['id']}，立即返回响应")
         
         # 立即返回响应，不等待处理完成
         global current_record_id
         return {
             "status": "ok",
+            "job_id": job['id'],
             "record_id": current_record_id,  # 返回旧的 record_id，前端通过轮询检测新图片
             "timestamp": int(time.time() * 1000)
         }
@@ -527,6 +999,21 @@ async def vad_upload(file: UploadFile = File(...)):
         return JSONResponse({"status": "error", "msg": str(e)}, status_code=500)
 
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    查询生成任务状态（queued / running / done / failed）
+    """
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return JSONResponse({"status": "error", "msg": "任务不存在"}, status_code=404)
+    
+    result = {"status": "ok", **job_summary(job)}
+    if job['status'] == 'queued':
+        result["position"] = job_queue.position(job_id)
+    return result
+
+
 @app.get("/get_latest_image")
 async def get_latest_image():
     """
@@ -534,36 +1021,33 @@ async def get_latest_image():
     返回图片的 base64 编码，方便前端直接显示
     """
     try:
-        import base64
-        from io import BytesIO
+        # ✅ 增量同步历史记录（快照被手动修改时才完整重新加载，否则只读取新追加的日志）
+        last_record = history_manager.get_latest_record()
         
-        # ✅ 重新加载历史记录（确保获取手动修改后的最新数据）
-        history_manager.history = history_manager._load_history()
-        history = history_manager.get_history()
-        
-        if history:
-            last_record = history[-1]
+        if last_record:
             record_id = last_record['id']
             
-            # 从文件读取图片（确保获取最新图片）
+            # 从缓存读取已编码的图片（按记录ID和文件修改时间缓存，未变化时不重复编码）
+            # 发送显示尺寸的缩小版本，不发送原图
             try:
-                image = Image.open(last_record['image_path'])
-                
-                # 将图片转换为 base64
-                buffer = BytesIO()
-                image.save(buffer, format='PNG')
-                img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                await wait_renditions_async(last_record)
+                display_path = get_display_path(last_record)
+                # 未命中时要读取文件并 base64 编码（几 MB），放到默认线程池执行，避免阻塞事件循环
+                loop = asyncio.get_running_loop()
+                encoded = await loop.run_in_executor(None, encoded_image_cache.get, last_record, display_path)
                 
-                # 更新全局变量（保持同步）
+                # 更新全局变量（保持同步，记录未变化时无需重新打开图片）
                 global current_image, current_text, current_record_id
-                current_image = image
+                if current_record_id != record_id or current_image is None:
+                    current_image = Image.open(display_path)
+                    prefetch_neighbours(record_id)
                 current_text = last_record['text']
                 current_record_id = record_id
                 
                 return {
                     "status": "ok",
                     "record_id": record_id,
-                    "image_data": f"data:image/png;base64,{img_base64}",
+                    "image_data": encoded['data_url'],
                     "text": last_record['text']
                 }
             except Exception as e:
@@ -578,6 +1062,175 @@ async def get_latest_image():
         return {"status": "error", "msg": str(e)}
 
 
+def _record_etag(record: dict, image_path: str = None) -> str:
+    """记录的 ETag（记录ID + 图片文件名 + 文件修改时间）"""
+    if record is None:
+        return '"none"'
+    image_path = image_path or record['image_path']
+    try:
+        mtime = os.stat(image_path).st_mtime_ns
+    except OSError:
+        mtime = 0
+    if image_path == record['image_path']:
+        return f'"{record["id"]}-{mtime}"'
+    return f'"{record["id"]}-{os.path.basename(image_path)}-{mtime}"'
+
+
+@app.get("/latest")
+async def get_latest(request: Request):
+    """
+    获取最新图片的元数据（不含图片数据），支持 ETag / If-None-Match
+    记录未变化时返回 304，轮询只需几百字节；图片本身通过 image_url 单独获取
+    """
+    last_record = history_manager.get_latest_record()
+    etag = _record_etag(last_record)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    if last_record is None:
+        return JSONResponse({"status": "no_image"}, headers=headers)
+    
+    return JSONResponse({
+        "status": "ok",
+        "record_id": last_record['id'],
+        "text": last_record['text'],
+        "timestamp": last_record['timestamp'],
+        "image_url": f"/images/{last_record['id']}"
+    }, headers=headers)
+
+
+@app.get("/images/{record_id}")
+async def get_image(record_id: int, request: Request, size: int = None):
+    """
+    按记录ID获取图片文件（可被浏览器缓存）
+    
+    默认返回适合 DISPLAY_CONFIG 显示尺寸的缩小版本；
+    ?size=N 返回适合 N×N 显示区域的版本，?size=0 返回原图
+    """
+    record = history_manager.get_record_by_id(record_id)
+    if record is None:
+        return JSONResponse({"status": "error", "msg": "记录不存在"}, status_code=404)
+    
+    if size != 0:
+        await wait_renditions_async(record)
+    image_path = record['image_path'] if size == 0 else get_display_path(record, size)
+    
+    # 缩小版本还没生成完（等待超时）时临时返回原图：不能让浏览器把原图当作这个地址缓存一天，
+    # 改为每次都向服务器确认，缩小版本生成后 ETag 变化，浏览器会取到新的图片
+    fallback = size != 0 and image_path == record['image_path'] and any(
+        not os.path.exists(path) for path in (record.get('renditions') or {}).values()
+    )
+    
+    # 先比较 ETag（只 stat 文件），未变化时不读取图片
+    etag = _record_etag(record, image_path)
+    headers = {"ETag": etag, "Cache-Control": "no-cache" if fallback else "public, max-age=86400"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if not os.path.exists(image_path):
+        print(f"❌ 图片文件不存在: {image_path}")
+        return JSONResponse({"status": "error", "msg": "图片文件不存在"}, status_code=404)
+    # 原样发送文件字节（FileResponse 在线程池中分块读取，不阻塞事件循环，也不生成 base64）
+    return FileResponse(image_path, media_type=mimetypes.guess_type(image_path)[0] or 'image/png', headers=headers)
+
+
+# /history 每页最多返回的记录数
+HISTORY_PAGE_MAX = 200
+
+
+@app.get("/history")
+async def get_history_page(cursor: int = None, limit: int = 50):
+    """
+    分页获取历史记录（从新到旧），供历史画廊使用
+    
+    返回记录元数据和缩略图地址；本页缺少的缩略图立即提交到后台生成，
+    请求 /thumbnails/{record_id} 时尚未生成完的会等待生成结束
+    """
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    loop = asyncio.get_running_loop()
+    records, next_cursor = await loop.run_in_executor(None, history_manager.get_page, cursor, limit)
+    
+    items = []
+    for record in records:
+        ready = history_manager.thumbnails.ensure(record).done()
+        items.append({
+            "record_id": record['id'],
+            "text": record['text'],
+            "timestamp": record['timestamp'],
+            "image_url": f"/images/{record['id']}",
+            "thumbnail_url": f"/thumbnails/{record['id']}",
+            "thumbnail_ready": ready
+        })
+    return {"status": "ok", "records": items, "next_cursor": next_cursor}
+
+
+@app.get("/thumbnails/{record_id}")
+async def get_thumbnail(record_id: int):
+    """
+    按记录ID获取缩略图（首次请求时后台生成并缓存到磁盘，可被浏览器缓存）
+    """
+    record = history_manager.get_record_by_id(record_id)
+    if record is None:
+        return JSONResponse({"status": "error", "msg": "记录不存在"}, status_code=404)
+    
+    try:
+        path = await asyncio.wrap_future(history_manager.thumbnails.ensure(record))
+    except Exception as e:
+        return JSONResponse({"status": "error", "msg": f"生成缩略图失败: {str(e)}"}, status_code=404)
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=86400"})
+
+
+@app.get("/events")
+async def events():
+    """
+    Server-Sent Events 推送通道
+    事件类型：progress（流程进度）、record（新图片就绪）、job（任务状态变化）
+    """
+    return StreamingResponse(
+        event_bus.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """
+    获取各缓存的命中统计
+    """
+    return {
+        "status": "ok",
+        "encoded_image": encoded_image_cache.stats(),
+        "decoded_image": decoded_image_cache.stats(),
+        "prompt_image": doubao_service.prompt_cache.stats(),
+        "stt": doubao_service.stt_cache.stats(),
+        "semantic": history_manager.prompt_index.stats() if history_manager.prompt_index is not None else {"enabled": False},
+        "thumbnail": history_manager.thumbnails.stats()
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    导出流程各阶段耗时（Prometheus 文本格式）
+    """
+    return Response(content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/tti_stats")
+async def get_tti_stats():
+    """
+    获取文生图响应格式选择情况（各格式的平均耗时、估算节省的时间）、连接池复用统计和并发请求合并统计
+    """
+    return {
+        "status": "ok",
+        "response_format": doubao_service.response_format.stats(),
+        "http": doubao_service.get_http_stats(),
+        "single_flight": doubao_service.tti_flight.stats()
+    }
+
+
 # 创建Gradio界面（全屏图片显示）
 # 获取图片显示尺寸
 img_height, img_width = get_image_size()
@@ -809,6 +1462,7 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
       }
       
       this.stop();
+      this.serverRatio = 0;
 
       var radius = 70;
       var circumference = 2 * Math.PI * radius;
@@ -936,7 +1590,8 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
       if (!this.isActive) return;
       
       var elapsed = Date.now() - this.startTime;
-      var ratio = Math.min(elapsed / this.maxDuration, 0.99);
+      // 取时间估算和服务端推送进度（SSE progress 事件）中较大的值
+      var ratio = Math.min(Math.max(elapsed / this.maxDuration, this.serverRatio || 0), 0.99);
       var percent = Math.floor(ratio * 100);
 
       var radius = 70;
@@ -1081,8 +1736,10 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
               console.log('[VAD] 上传成功，启动进度条');
               window.progressUI.start();
             }
-            // 开始轮询检查新图片
-            if (window.checkForNewImage) {
+            // ✅ 推送通道已连接时等待 SSE 事件，不再轮询
+            if (window.eventsConnected) {
+              console.log('[VAD] 推送通道已连接，等待新图片事件');
+            } else if (window.checkForNewImage) {
               console.log('[VAD] 开始检查新图片，上次ID:', lastRecordId);
               // ✅ 保存当前轮询ID
               var checkIntervalId = window.checkForNewImage(uploadStartTime, lastRecordId);
@@ -1166,41 +1823,32 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
       checkCount++;
       console.log('[Image] 检查第', checkCount, '次，上次ID:', lastRecordId);
       
-      fetch('/get_latest_image')
+      // ✅ 只请求元数据，带上 ETag；记录未变化时服务端返回 304（无响应体）
+      fetch('/latest', {
+        cache: 'no-store',
+        headers: window.latestETag ? { 'If-None-Match': window.latestETag } : {}
+      })
         .then(function (response) {
+          if (response.status === 304) {
+            return { status: 'not_modified' };
+          }
           if (!response.ok) {
             throw new Error('HTTP ' + response.status);
           }
+          window.latestETag = response.headers.get('ETag');
           return response.json();
         })
         .then(function (data) {
           console.log('[Image] API 返回:', data.status, '记录ID:', data.record_id);
           
-          if (data.status === 'ok' && data.record_id && data.image_data) {
+          if (data.status === 'not_modified') {
+            console.log('[Image] 记录未变化（304），继续等待...');
+          } else if (data.status === 'ok' && data.record_id && data.image_url) {
             // 如果图片ID变化了，说明有新图片生成
             if (!lastRecordId || data.record_id !== lastRecordId) {
               console.log('[Image] ✅ 检测到新图片！ID:', data.record_id, '（上次:', lastRecordId, '）');
               clearInterval(checkIntervalId);
-              
-              // ✅ 检测到新图片，释放生成锁
-              window.vadState.isGenerating = false;
-              window.vadState.currentCheckIntervalId = null;
-              console.log('[VAD] 🔓 图片生成完成，释放生成锁');
-              
-              // ✅ 更新全局状态，记录当前图片ID，避免下次误判
-              window.vadState.lastRecordId = data.record_id;
-              
-              // 进度条完成
-              if (window.progressUI) {
-                window.progressUI.complete();
-              }
-              
-              // 更新图片显示（使用 base64 图片数据）
-              if (window.updateImageDisplay) {
-                window.updateImageDisplay(data.image_data);
-              } else {
-                console.error('[Image] updateImageDisplay 函数不存在');
-              }
+              window.handleNewRecord(data);
               return;
             } else {
               console.log('[Image] 图片ID未变化，继续等待...');
@@ -1241,6 +1889,88 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
     return checkIntervalId;
   };
 
+  // 新图片就绪（轮询检测到或 SSE 推送）
+  window.handleNewRecord = function (data) {
+    if (data.record_id === window.vadState.lastRecordId) {
+      return;
+    }
+    
+    // ✅ 取消轮询（如果存在）
+    if (window.vadState.currentCheckIntervalId) {
+      clearInterval(window.vadState.currentCheckIntervalId);
+    }
+    
+    // ✅ 检测到新图片，释放生成锁
+    window.vadState.isGenerating = false;
+    window.vadState.currentCheckIntervalId = null;
+    console.log('[VAD] 🔓 图片生成完成，释放生成锁');
+    
+    // ✅ 更新全局状态，记录当前图片ID，避免下次误判
+    window.vadState.lastRecordId = data.record_id;
+    
+    // 进度条完成
+    if (window.progressUI) {
+      window.progressUI.complete();
+    }
+    
+    // 更新图片显示（使用可缓存的图片 URL）
+    if (window.updateImageDisplay) {
+      window.updateImageDisplay(data.image_url);
+    } else {
+      console.error('[Image] updateImageDisplay 函数不存在');
+    }
+  };
+
+  // ================================
+  // SSE 推送通道：进度、新图片、任务状态
+  // ================================
+  window.eventsConnected = false;
+  window.connectEvents = function () {
+    if (!window.EventSource) {
+      console.log('[Events] 浏览器不支持 EventSource，使用轮询');
+      return;
+    }
+    
+    var source = new EventSource('/events');
+    source.onopen = function () {
+      window.eventsConnected = true;
+      console.log('[Events] ✅ 推送通道已连接');
+    };
+    source.onerror = function () {
+      // 断开后浏览器会自动重连，期间回退到轮询
+      window.eventsConnected = false;
+      console.warn('[Events] 推送通道断开，等待重连');
+    };
+    
+    source.addEventListener('progress', function (e) {
+      var data = JSON.parse(e.data);
+      console.log('[Events] 进度:', data.stage, data.progress);
+      if (window.progressUI && window.progressUI.isActive) {
+        window.progressUI.serverRatio = data.progress;
+      }
+    });
+    
+    source.addEventListener('record', function (e) {
+      var data = JSON.parse(e.data);
+      console.log('[Events] ✅ 新图片就绪，ID:', data.record_id);
+      window.handleNewRecord(data);
+    });
+    
+    source.addEventListener('job', function (e) {
+      var data = JSON.parse(e.data);
+      console.log('[Events] 任务状态:', data.job_id, data.job_status);
+      // 任务失败且没有轮询在运行时，释放生成锁
+      if (data.job_status === 'failed' && !window.vadState.currentCheckIntervalId) {
+        window.vadState.isGenerating = false;
+        console.log('[VAD] 🔓 生成任务失败，释放生成锁');
+        if (window.progressUI) {
+          window.progressUI.stop();
+        }
+      }
+    });
+  };
+  window.connectEvents();
+
   // 更新图片显示
   window.updateImageDisplay = function (imageData) {
     console.log('[Image] 开始更新图片显示，数据长度:', imageData ? imageData.length : 0);
@@ -1274,7 +2004,7 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
         try {
           if (element.tagName === 'IMG') {
             console.log('[Image] 更新 IMG 元素，当前 src:', element.src.substring(0, 50));
-            element.src = imageData; // 直接使用 base64 数据
+            element.src = imageData; // 图片 URL 或 base64 数据
             element.style.display = 'block';
             updated = true;
           } else if (element.tagName === 'CANVAS') {
@@ -1328,7 +2058,7 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
     
     // 备用方案：如果3秒后图片还没更新，强制刷新页面
     setTimeout(function () {
-      var currentImages = document.querySelectorAll('img[src*="data:image"]');
+      var currentImages = document.querySelectorAll('img');
       var hasNewImage = false;
       currentImages.forEach(function (img) {
         if (img.src === imageData || img.src.indexOf(imageData.substring(0, 50)) >= 0) {
@@ -1345,8 +2075,9 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
 
   // 初始化：获取当前记录ID
   function initRecordId() {
-    fetch('/get_latest_image')
+    fetch('/latest', { cache: 'no-store' })
       .then(function (response) {
+        window.latestETag = response.headers.get('ETag');
         return response.json();
       })
       .then(function (data) {
@@ -1512,18 +2243,19 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
       e.stopPropagation();
       console.log('[Refresh] 点击刷新按钮，获取最新图片...');
       
-      // 调用 API 获取最新图片
-      fetch('/get_latest_image')
+      // 调用 API 获取最新图片元数据（手动刷新不带 ETag，总是拿到完整元数据）
+      fetch('/latest', { cache: 'no-store' })
         .then(function (response) {
           if (!response.ok) {
             throw new Error('HTTP ' + response.status);
           }
+          window.latestETag = response.headers.get('ETag');
           return response.json();
         })
         .then(function (data) {
           console.log('[Refresh] API 返回:', data.status);
           
-          if (data.status === 'ok' && data.record_id && data.image_data) {
+          if (data.status === 'ok' && data.record_id && data.image_url) {
             console.log('[Refresh] ✅ 获取到最新图片，ID:', data.record_id);
             
             // 更新全局状态
@@ -1533,7 +2265,7 @@ with gr.Blocks(title="语音魔法画板", css=custom_css, theme=gr.themes.Monoc
             
             // 更新图片显示
             if (window.updateImageDisplay) {
-              window.updateImageDisplay(data.image_data);
+              window.updateImageDisplay(data.image_url);
               console.log('[Refresh] ✅ 图片已更新');
             } else {
               console.error('[Refresh] updateImageDisplay 函数不存在');
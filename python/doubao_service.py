@@ -2,11 +2,21 @@
 豆包大模型API服务
 实现文字转图片和音频转文字功能
 """
+import os
+import time
 import requests
 import base64
 from io import BytesIO
 from PIL import Image
 import config
+from http_pool import PooledSession
+from prompt_cache import PromptImageCache
+from stt_cache import TranscriptCache
+from image_download import StreamingDownload, Base64JsonDecoder, cleanup_downloads, duplicate_image
+from response_format import ResponseFormatSelector
+from metrics import metrics
+from single_flight import SingleFlight
+from stt_errors import STT_ERROR_PREFIX
 
 # 尝试导入 Gemini SDK（可选）
 try:
@@ -21,6 +31,10 @@ except ImportError:
 class DoubaoService:
     """豆包API服务类"""
     
+    # Doubao 文生图模型和尺寸（同步/异步版本共用，也是提示词缓存键的一部分）
+    DOUBAO_MODEL = "doubao-seedream-4-0-250828"
+    DOUBAO_SIZE = "2K"
+    
     def __init__(self):
         self.api_key = config.DOUBAO_API_KEY
         self.base_url = config.DOUBAO_API_BASE_URL
@@ -30,6 +44,31 @@ class DoubaoService:
         self.gemini_model = config.GEMINI_MODEL
         self.has_api_key = bool(self.api_key)
         
+        # 持久连接池：API 主机（STT/TTI）和图片 CDN 分开，避免互相挤占连接
+        self.api_http = PooledSession('api', config.HTTP_POOL_SIZE, config.HTTP_POOL_IDLE_TIMEOUT)
+        self.cdn_http = PooledSession('cdn', config.HTTP_POOL_SIZE, config.HTTP_POOL_IDLE_TIMEOUT)
+        
+        # 语音识别结果缓存（所有调用 audio_to_text 的入口共用）
+        self.stt_cache = TranscriptCache(config.STT_CACHE_SIZE, config.STT_CACHE_TTL)
+        
+        # 提示词 → 图片磁盘缓存（Doubao 和 Gemini 共用，模型名是缓存键的一部分）
+        self.prompt_cache = PromptImageCache(
+            config.TTI_CACHE_DIR,
+            max_entries=config.TTI_CACHE_MAX_ENTRIES,
+            max_bytes=int(config.TTI_CACHE_MAX_MB * 1024 * 1024),
+            ttl_seconds=config.TTI_CACHE_TTL_HOURS * 3600,
+            hit_policy=config.TTI_CACHE_HIT_POLICY,
+            recent_seconds=config.TTI_CACHE_RECENT_MINUTES * 60,
+            enabled=config.TTI_CACHE_ENABLED,
+        )
+        cleanup_downloads()
+        
+        # 文生图响应格式（url / b64_json）选择，同步/异步版本共用
+        self.response_format = ResponseFormatSelector(config.TTI_RESPONSE_FORMAT, config.TTI_FORMAT_WINDOW)
+        
+        # 相同提示词和参数的并发文生图请求只调用一次上游，同步/异步版本共用（键与提示词缓存相同）
+        self.tti_flight = SingleFlight(share=self.share_generated_image, stage="tti_coalesced")
+        
         # 初始化 Gemini 客户端（如果可用）
         self.gemini_client = None
         if GEMINI_AVAILABLE and self.has_api_key:
@@ -50,12 +89,13 @@ class DoubaoService:
         else:
             print("⚠️  未检测到API密钥，将使用模拟模式")
     
-    def audio_to_text(self, audio_file_path: str):
+    def audio_to_text(self, audio_file_path, filename: str = "audio.wav"):
         """
         音频转文字
         
         Args:
-            audio_file_path: 音频文件路径
+            audio_file_path: 音频文件路径，或内存中的音频数据（bytes、文件对象或字节块迭代器）
+            filename: 音频数据不是文件路径时上传使用的文件名（用于服务端识别格式）
             
         Returns:
             str: 识别的文字
@@ -70,37 +110,37 @@ class DoubaoService:
             
             # 调试信息
             print(f"🔗 STT请求URL: {api_url}")
-            print(f"📁 音频文件: {audio_file_path}")
             
-            # 读取音频文件
-            with open(audio_file_path, 'rb') as audio_file:
-                # 按照网站示例格式：file 直接是文件对象，model 作为表单字段放在 files 中
-                files = {
-                    "file": audio_file,              # 音频文件二进制流
-                    "model": (None, "whisper-1"),   # 指定使用 Whisper-1 模型（表单字段格式）
-                }
-                
-                headers = {"Authorization": f"Bearer {self.api_key}"}
-                
-                # 发送请求（只使用 files 参数，不需要 data 参数）
-                response = requests.post(
-                    api_url,
-                    headers=headers,
-                    files=files,
-                    timeout=60
-                )
-                
-                response.raise_for_status()
-                result = response.json()
-                
-                # 根据API响应格式解析（返回 {"text": "..."}）
-                voice_text = result.get("text", "")
-                if voice_text:
-                    print(f"✅ 识别成功: {voice_text}")
-                    return voice_text
-                else:
-                    print(f"⚠️ API返回空文本: {result}")
-                    return "音频识别失败，未返回文本"
+            if not isinstance(audio_file_path, str):
+                # 内存中的音频数据（如进程内解码得到的 WAV、上传的原始数据），不经过磁盘
+                audio_data = self._read_audio_data(audio_file_path)
+                print(f"📁 音频数据: {len(audio_data)} 字节（内存）")
+            else:
+                print(f"📁 音频文件: {audio_file_path}")
+                # 读取音频文件（录音只有几百 KB，整体读入后计算哈希）
+                with open(audio_file_path, 'rb') as audio_file:
+                    audio_data = audio_file.read()
+                filename = os.path.basename(audio_file_path)
+            
+            # 相同的录音（浏览器重试、VAD 重复触发）直接返回上次的识别结果
+            cache_key = self.stt_cache.make_key(audio_data)
+            cached_text = self.lookup_cached_transcript(cache_key)
+            if cached_text is not None:
+                return cached_text
+            
+            response = self._post_audio(api_url, (filename, audio_data))
+            response.raise_for_status()
+            result = response.json()
+            
+            # 根据API响应格式解析（返回 {"text": "..."}）
+            voice_text = result.get("text", "")
+            if voice_text:
+                print(f"✅ 识别成功: {voice_text}")
+                self.stt_cache.put(cache_key, voice_text)
+                return voice_text
+            else:
+                print(f"⚠️ API返回空文本: {result}")
+                return f"{STT_ERROR_PREFIX}，未返回文本"
                 
         except requests.exceptions.HTTPError as e:
             error_detail = ""
@@ -116,15 +156,64 @@ class DoubaoService:
                 except:
                     error_detail = f" - {e.response.text}"
             print(f"❌ 音频转文字HTTP错误 ({e.response.status_code if e.response else 'N/A'}): {e}{error_detail}")
-            return "音频识别失败，请检查API密钥和网络连接"
+            return f"{STT_ERROR_PREFIX}，请检查API密钥和网络连接"
         except requests.exceptions.RequestException as e:
             print(f"❌ 音频转文字网络错误: {e}")
-            return "音频识别失败，网络连接错误"
+            return f"{STT_ERROR_PREFIX}，网络连接错误"
         except Exception as e:
             print(f"❌ 音频转文字错误: {e}")
             import traceback
             traceback.print_exc()
-            return f"音频识别失败: {str(e)}"
+            return f"{STT_ERROR_PREFIX}: {str(e)}"
+    
+    def lookup_cached_transcript(self, cache_key: str):
+        """
+        查询语音识别缓存
+        
+        Returns:
+            str: 命中时返回识别文字，未命中返回None
+        """
+        cached_text = self.stt_cache.get(cache_key)
+        if cached_text is not None:
+            print(f"⚡ 语音识别缓存命中，跳过识别: {cached_text}")
+        return cached_text
+    
+    @staticmethod
+    def _read_audio_data(audio) -> bytes:
+        """把 bytes / 文件对象 / 字节块迭代器统一转换为 bytes"""
+        if isinstance(audio, (bytes, bytearray)):
+            return bytes(audio)
+        if hasattr(audio, 'read'):
+            return audio.read()
+        return b"".join(audio)
+    
+    def _post_audio(self, api_url: str, audio_file):
+        """
+        发送语音识别请求
+        
+        Args:
+            api_url: STT 接口地址
+            audio_file: (文件名, 数据) 元组
+            
+        Returns:
+            requests.Response: 接口响应
+        """
+        # 按照网站示例格式：file 直接是文件对象，model 作为表单字段放在 files 中
+        files = {
+            "file": audio_file,              # 音频文件二进制流
+            "model": (None, "whisper-1"),   # 指定使用 Whisper-1 模型（表单字段格式）
+        }
+        
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        
+        # 发送请求（只使用 files 参数，不需要 data 参数）
+        with metrics.span("stt_request"):
+            return self.api_http.post(
+                api_url,
+                headers=headers,
+                files=files,
+                timeout=60
+            )
     
     def text_to_image_gemini(self, text: str, aspect_ratio: str = "1:1", image_size: str = "1K"):
         """
@@ -149,6 +238,11 @@ class DoubaoService:
             print("⚠️ Gemini 客户端未初始化，回退到 Doubao 模型")
             return self.text_to_image(text, use_gemini=False)
         
+        cache_key = self.prompt_cache.make_key(text, self.gemini_model, image_size, aspect_ratio)
+        cached = self.lookup_cached_image(cache_key, text)
+        if cached is not None:
+            return cached
+        
         try:
             print(f"🎨 使用 Gemini 模型生成图片")
             print(f"📝 提示词: {text[:50]}..." if len(text) > 50 else f"📝 提示词: {text}")
@@ -193,7 +287,7 @@ class DoubaoService:
                     if image.mode != 'RGB':
                         image = image.convert('RGB')
                     
-                    return image, text
+                    return self.store_cached_image(cache_key, image, text, self.gemini_model)
             
             # 如果没有找到图片，返回错误
             raise ValueError("Gemini API 响应中未找到图片数据")
@@ -206,7 +300,8 @@ class DoubaoService:
             print("🔄 回退到 Doubao 模型")
             return self.text_to_image(text, use_gemini=False)
     
-    def text_to_image(self, text: str, use_gemini: bool = False, aspect_ratio: str = "1:1", image_size: str = "1K"):
+    def text_to_image(self, text: str, use_gemini: bool = False, aspect_ratio: str = "1:1", image_size: str = "1K",
+                      progress_callback=None):
         """
         文字生成图片
         
@@ -215,6 +310,7 @@ class DoubaoService:
             use_gemini: 是否使用 Gemini 模型，默认 False（使用 Doubao）
             aspect_ratio: 图片宽高比（仅 Gemini 使用）
             image_size: 图片尺寸（仅 Gemini 使用）
+            progress_callback: 图片下载进度回调 callback(已下载字节数, 总字节数或None)
             
         Returns:
             (PIL.Image, str): 生成的图片对象和原始文字
@@ -227,6 +323,22 @@ class DoubaoService:
             # 模拟模式：返回占位图片
             return self._mock_text_to_image(text)
         
+        cache_key = self.prompt_cache.make_key(text, self.DOUBAO_MODEL, self.DOUBAO_SIZE)
+        cached = self.lookup_cached_image(cache_key, text)
+        if cached is not None:
+            return cached
+        
+        # 相同提示词正在生成时等待那次的结果（各自得到一份图片副本），不重复调用上游
+        image, _ = self.tti_flight.do(cache_key, self._generate_doubao_image, text, cache_key, progress_callback)
+        return image, text
+    
+    def _generate_doubao_image(self, text: str, cache_key: str, progress_callback=None):
+        """
+        调用 Doubao 文生图接口生成图片（失败时返回占位图片）
+        
+        Returns:
+            (PIL.Image, str): 生成的图片对象和原始文字
+        """
         try:
             # 使用配置的TTI_URL，确保使用正确的DMX API端点（与tttest.py保持一致）
             # 默认使用 https://www.dmxapi.com/v1/images/generations
@@ -234,11 +346,11 @@ class DoubaoService:
             
             # 构建请求参数（根据DMX API格式，与tttest.py保持一致）
             request_data = {
-                "model": "doubao-seedream-4-0-250828",  # 使用4.0模型
+                "model": self.DOUBAO_MODEL,  # 使用4.0模型
                 "prompt": text,
-                "size": "2K",  # 支持 "1K", "2K", "4K" 或具体像素值如 "2048x2048"
+                "size": self.DOUBAO_SIZE,  # 支持 "1K", "2K", "4K" 或具体像素值如 "2048x2048"
                 "stream": False,
-                "response_format": "url",  # 或 "b64_json"
+                "response_format": self.response_format.choose(),  # "url" 或 "b64_json"
                 "watermark": False
             }
             
@@ -254,60 +366,69 @@ class DoubaoService:
             print(f"🤖 使用模型: {request_data['model']}")
             
             # 调用豆包文生图API（与tttest.py的请求方式保持一致）
-            response = requests.post(
+            # b64_json 格式流式读取响应体，边接收边解码图片
+            response_format = request_data["response_format"]
+            request_start = time.perf_counter()
+            response = self.api_http.post(
                 api_url,
                 headers=headers,
                 json=request_data,
-                timeout=120  # 图片生成可能需要更长时间
+                timeout=120,  # 图片生成可能需要更长时间
+                stream=(response_format == "b64_json")
             )
             
             response.raise_for_status()
-            data = response.json()
+            # 上游生成图片的耗时（到响应头到达为止）
+            metrics.observe("tti_request", time.perf_counter() - request_start)
             
             # 调试信息：输出响应状态
-            print(f"✅ API响应成功，状态码: {response.status_code}")
+            print(f"✅ API响应成功，状态码: {response.status_code}，响应格式: {response_format}")
+            
+            transfer_start = time.perf_counter()
+            if response_format == "b64_json":
+                with response:
+                    total = Base64JsonDecoder.estimate_size(response.headers.get('Content-Length'))
+                    with StreamingDownload(total, progress_callback=progress_callback) as download:
+                        decoder = Base64JsonDecoder(download)
+                        for chunk in response.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+                            decoder.feed(chunk)
+                        data = decoder.close()
+                image = decoder.open_image()
+                if image is not None:
+                    transfer_duration = time.perf_counter() - transfer_start
+                    self.response_format.record("b64_json", transfer_duration)
+                    metrics.observe("download", transfer_duration)
+                    print(f"✅ 图片解码成功，尺寸: {image.size}，{download.downloaded} 字节")
+                    return self.store_cached_image(cache_key, image, text, self.DOUBAO_MODEL)
+            else:
+                data = response.json()
             
             # 根据DMX API响应格式解析（与tttest.py的响应格式一致）
-            # 响应格式：{"data": [{"url": "..."}]} 或 {"data": [{"b64_json": "..."}]}
+            # 响应格式：{"data": [{"url": "..."}]} 或 {"data": [{"b64_json": "..."}]}，兼容直接返回 url/b64_json
             if 'data' in data and len(data['data']) > 0:
                 image_data_item = data['data'][0]
-                image_url = image_data_item.get('url', '')
-                image_b64 = image_data_item.get('b64_json', '')
-                
-                if image_b64:
-                    # 从base64解码图片
-                    print("📥 从base64数据解码图片")
-                    image_data = base64.b64decode(image_b64)
-                    image = Image.open(BytesIO(image_data))
-                    print(f"✅ 图片解码成功，尺寸: {image.size}")
-                    return image, text
-                elif image_url:
-                    # 从URL下载图片
-                    print(f"📥 从URL下载图片: {image_url[:80]}...")
-                    img_response = requests.get(image_url, timeout=30)
-                    img_response.raise_for_status()
-                    image = Image.open(BytesIO(img_response.content))
-                    print(f"✅ 图片下载成功，尺寸: {image.size}")
-                    return image, text
-                else:
-                    print(f"❌ API响应中未找到图片数据，响应内容: {data}")
-                    raise ValueError("API响应中未找到图片数据")
             else:
-                # 兼容其他可能的响应格式
-                image_url = data.get('url', '')
-                image_b64 = data.get('b64_json', '')
-                
-                if image_b64:
-                    image_data = base64.b64decode(image_b64)
-                    image = Image.open(BytesIO(image_data))
-                    return image, text
-                elif image_url:
-                    img_response = requests.get(image_url, timeout=30)
-                    img_response.raise_for_status()
-                    image = Image.open(BytesIO(img_response.content))
-                    return image, text
-                else:
-                    raise ValueError(f"API响应格式异常: {data}")
+                image_data_item = data
+            image_url = image_data_item.get('url', '')
+            image_b64 = image_data_item.get('b64_json', '')
+            
+            if image_b64:
+                # 从base64解码图片（请求 url 格式但接口仍返回了 base64）
+                print("📥 从base64数据解码图片")
+                image = Image.open(BytesIO(base64.b64decode(image_b64)))
+                print(f"✅ 图片解码成功，尺寸: {image.size}")
+                return self.store_cached_image(cache_key, image, text, self.DOUBAO_MODEL)
+            elif image_url:
+                # 从URL下载图片（流式写入下载目录）
+                download_start = time.perf_counter()
+                image = self.download_image(image_url, progress_callback)
+                download_duration = time.perf_counter() - download_start
+                self.response_format.record("url", download_duration)
+                metrics.observe("download", download_duration)
+                return self.store_cached_image(cache_key, image, text, self.DOUBAO_MODEL)
+            else:
+                print(f"❌ API响应中未找到图片数据，响应内容: {data}")
+                raise ValueError("API响应中未找到图片数据")
                 
         except requests.exceptions.HTTPError as e:
             error_detail = ""
@@ -340,6 +461,69 @@ class DoubaoService:
             traceback.print_exc()
             return self._mock_text_to_image(text)
     
+    def download_image(self, image_url: str, progress_callback=None) -> Image.Image:
+        """
+        流式下载图片（分块写入下载目录，内存占用与图片大小无关）
+        
+        Args:
+            image_url: 图片地址
+            progress_callback: 下载进度回调 callback(已下载字节数, 总字节数或None)
+            
+        Returns:
+            PIL.Image: 按需解码的图片（image.filename 为下载文件路径）
+        """
+        print(f"📥 从URL下载图片: {image_url[:80]}...")
+        with self.cdn_http.get(image_url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            total = int(response.headers.get('Content-Length') or 0) or None
+            with StreamingDownload(total, progress_callback=progress_callback) as download:
+                for chunk in response.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+                    download.write(chunk)
+        image = download.open_image()
+        print(f"✅ 图片下载成功，尺寸: {image.size}，{download.downloaded} 字节")
+        return image
+    
+    def lookup_cached_image(self, cache_key: str, text: str):
+        """
+        查询提示词缓存
+        
+        Returns:
+            (PIL.Image, str): 命中时返回缓存的图片和原始文字，未命中返回None
+        """
+        image = self.prompt_cache.get(cache_key)
+        if image is None:
+            return None
+        print(f"⚡ 提示词缓存命中，跳过图片生成: {text[:50]}")
+        return image, text
+    
+    def store_cached_image(self, cache_key: str, image: Image.Image, text: str, model: str):
+        """
+        把上游生成的图片写入提示词缓存（后台写入）
+        
+        Returns:
+            (PIL.Image, str): 原样返回图片和文字，便于直接 return
+        """
+        self.prompt_cache.put_async(cache_key, image, {'prompt': text, 'model': model})
+        return image, text
+    
+    @staticmethod
+    def share_generated_image(result):
+        """
+        把一次生成结果复制给合并等待的其他请求（各自保存到历史记录时不能共用同一个下载文件）
+        
+        Returns:
+            (PIL.Image, str): 图片副本和原始文字
+        """
+        image, text = result
+        return duplicate_image(image), text
+    
+    def get_http_stats(self) -> dict:
+        """获取各连接池的复用统计"""
+        return {
+            'api': self.api_http.stats(),
+            'cdn': self.cdn_http.stats(),
+        }
+    
     def _mock_text_to_image(self, text: str):
         """
         模拟图片生成（用于测试）
@@ -0,0 +1,104 @@
+"""
+事件推送
+把生成流程的进度和"新图片就绪"事件通过 Server-Sent Events 推送给浏览器，
+前端不再需要轮询
+"""
+import asyncio
+import json
+import threading
+
+
+def format_sse(event: str, data) -> str:
+    """格式化为一条 SSE 消息"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class EventBus:
+    """进程内事件总线（可以从任意线程发布，订阅者在事件循环中读取）"""
+
+    def __init__(self, max_queue: int = 100, heartbeat: float = 15.0):
+        """
+        Args:
+            max_queue: 每个订阅者最多缓存的事件数，超出后丢弃最旧的事件
+            heartbeat: 没有事件时发送心跳注释的间隔（秒），防止连接被代理断开
+        """
+        self.max_queue = max_queue
+        self.heartbeat = heartbeat
+        self._loop = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+        # 统计信息
+        self.published = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """绑定事件循环（应用启动时调用）"""
+        self._loop = loop
+
+    def subscribe(self) -> asyncio.Queue:
+        """新增订阅者（需要在事件循环中调用）"""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.discard(queue)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, data: dict):
+        """
+        发布事件（线程安全，工作线程中也可以调用）
+
+        Args:
+            event: 事件名称，如 "progress"、"record"、"job"
+            data: 事件数据（可 JSON 序列化）
+        """
+        if self._loop is None or not self._subscribers:
+            return
+        self.published += 1
+        message = format_sse(event, data)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._deliver(message)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, message)
+
+    def _deliver(self, message: str):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for queue in subscribers:
+            if queue.full():
+                # 慢速客户端：丢弃最旧的事件，不阻塞发布者
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def stream(self):
+        """
+        SSE 消息生成器（用于 StreamingResponse），客户端断开时自动取消订阅
+        """
+        queue = self.subscribe()
+        try:
+            # 告诉浏览器断线后 3 秒重连
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat)
+                    yield message
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+
+# 创建全局事件总线实例
+event_bus = EventBus()
@@ -1,67 +1,112 @@
 """
 历史记录管理器
 管理生成的图片历史记录
+
+存储引擎由 config.HISTORY_BACKEND 选择（见 history_storage.py）：
+- json：history.json 快照 + history.jsonl 追加日志（默认）
+- sqlite：history.db（WAL 模式，按 id 建索引）；history.json 作为导入/导出格式
 """
 import os
 import json
 import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from datetime import datetime
 from PIL import Image
 import config
+from history_storage import JsonHistoryStorage, SqliteHistoryStorage
+from semantic_cache import PromptVectorIndex, SEMANTIC_CACHE_AVAILABLE
+from image_download import is_download_file, detect_image_extension
+from renditions import generate_renditions, plan_renditions
+from thumbnails import ThumbnailStore
+from metrics import metrics
 
 
 class HistoryManager:
     """历史记录管理类"""
     
-    def __init__(self):
+    def __init__(self, backend: str = None):
         self.history_dir = config.HISTORY_DIR
         self.max_history = config.MAX_HISTORY
+        self.backend = backend or config.HISTORY_BACKEND
         self.history_file = os.path.join(self.history_dir, 'history.json')
-        self.history = self._load_history()
+        self.storage = self._create_storage()
+        self.prompt_index = self._create_prompt_index()
+        self.thumbnails = ThumbnailStore(config.THUMBNAIL_DIR, config.THUMBNAIL_SIZE, config.THUMBNAIL_WORKERS)
+        # 新记录的显示尺寸图片用单独的线程池生成，不排在历史画廊的缩略图任务后面
+        self._rendition_executor = ThreadPoolExecutor(max_workers=config.RENDITION_WORKERS, thread_name_prefix='rendition')
+        # 记录ID -> 正在后台生成显示尺寸图片的 Future
+        self._rendition_jobs = {}
+        self._rendition_lock = threading.Lock()
+        # 上一个分配的记录ID（见 _next_record_id）
+        self._id_lock = threading.Lock()
+        latest = self.storage.latest()
+        self._last_id = latest['id'] if latest else 0
     
-    def _load_history(self) -> list:
-        """加载历史记录"""
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"⚠️ 加载历史记录失败: {e}")
-                return []
-        return []
+    def _create_prompt_index(self):
+        """创建语义近似提示词索引（未启用或缺少 numpy 时返回None）"""
+        if not config.SEMANTIC_CACHE_ENABLED:
+            return None
+        if not SEMANTIC_CACHE_AVAILABLE:
+            print("⚠️ 语义近似缓存需要 numpy，已禁用")
+            return None
+        index = PromptVectorIndex(config.SEMANTIC_CACHE_THRESHOLD, max_entries=self.max_history)
+        index.rebuild(self.storage.all())
+        print(f"🧭 语义近似缓存已启用，索引 {len(index)} 条历史提示词")
+        return index
     
-    def _save_history(self):
-        """保存历史记录"""
-        try:
-            # 限制历史记录数量
-            limited_history = self.history[-self.max_history:]
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(limited_history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"⚠️ 保存历史记录失败: {e}")
+    def _create_storage(self):
+        """根据配置创建存储引擎"""
+        if self.backend == 'sqlite':
+            db_path = os.path.join(self.history_dir, 'history.db')
+            storage = SqliteHistoryStorage(db_path, self.max_history)
+            # 首次使用 SQLite（数据库文件刚创建）时，从已有的 JSON 历史记录导入；
+            # 不能按记录数为 0 判断，否则清空历史后重启会把已删除的记录导入回来
+            if storage.created:
+                self._import_json_history(storage)
+            return storage
+        if self.backend != 'json':
+            print(f"⚠️ 未知的历史记录存储引擎: {self.backend}，使用 json")
+        return JsonHistoryStorage(self.history_dir, self.max_history, config.HISTORY_COMPACT_EVERY)
+    
+    def _import_json_history(self, storage: SqliteHistoryStorage):
+        """把 JSON 引擎的历史记录导入 SQLite，成功后把 JSON 文件改名为 *.imported（不会再次导入）"""
+        records = JsonHistoryStorage(self.history_dir, self.max_history).all()
+        if not records:
+            return
+        storage.replace_all(records)
+        print(f"📥 已从 JSON 导入 {len(records)} 条历史记录到 SQLite")
+        for name in ('history.json', 'history.jsonl'):
+            path = os.path.join(self.history_dir, name)
+            if os.path.exists(path):
+                try:
+                    os.replace(path, path + '.imported')
+                except OSError as e:
+                    print(f"⚠️ 重命名已导入的 {name} 失败: {e}")
     
-    def add_record(self, image: Image.Image, text: str) -> dict:
+    def add_record(self, image, text: str) -> dict:
         """
         添加新记录
         
+        上游返回的图片已经是编码好的格式（JPEG/PNG/WebP），直接原样写入，不再解码后重新编码为 PNG；
+        只有内存中的 PIL 图片（如模拟模式生成的占位图）才编码为 PNG。
+        显示尺寸的缩小版本（见 renditions.py）只在 renditions 字段中记录路径，由后台线程池生成，
+        需要显示时用 wait_renditions() 等待
+        
         Args:
-            image: PIL图片对象
+            image: 编码好的图片字节、从文件打开的 PIL 图片（如流式下载的结果），或内存中的 PIL 图片
             text: 文字描述
             
         Returns:
             dict: 新添加的记录
         """
         # 生成唯一ID
-        record_id = int(time.time() * 1000)
+        record_id = self._next_record_id()
         
-        # 保存图片
-        image_filename = f"{record_id}.png"
-        image_path = os.path.join(self.history_dir, image_filename)
-        # 确保图片是 RGB 模式
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        # 保存图片（不指定格式参数，让 PIL 自动识别）
-        image.save(image_path)
+        # 保存图片（扩展名按实际格式确定）
+        image_path = self._save_image(image, os.path.join(self.history_dir, str(record_id)))
         
         # 创建记录
         record = {
@@ -71,15 +116,179 @@ class HistoryManager:
             'timestamp': datetime.now().isoformat()
         }
         
+        # 规划显示尺寸的缩小版本（只读取文件头；失败时只使用原图）
+        try:
+            record['image_size'], record['renditions'] = plan_renditions(image_path)
+        except Exception as e:
+            print(f"⚠️ 读取图片尺寸失败: {e}")
+        
         # 添加到历史记录
-        self.history.append(record)
-        self._save_history()
+        try:
+            self.storage.append(record)
+        except Exception as e:
+            print(f"⚠️ 保存历史记录失败: {e}")
+        
+        # 增量更新语义索引
+        if self.prompt_index is not None:
+            self.prompt_index.add(record)
+        
+        # 在后台生成显示尺寸的缩小版本，不占用保存记录的时间
+        if record.get('renditions'):
+            self._submit_renditions(record)
         
         return record
     
+    def _next_record_id(self) -> int:
+        """
+        分配记录ID：毫秒时间戳，保证单调递增、不重复
+        
+        多个工作线程在同一毫秒内保存记录（或系统时钟回拨）时，在上一个ID的基础上加一；
+        ID 重复会让图片文件互相覆盖，SQLite 的 INSERT OR REPLACE 也会替换掉另一条记录
+        """
+        with self._id_lock:
+            self._last_id = max(self._last_id + 1, int(time.time() * 1000))
+            return self._last_id
+    
+    def _submit_renditions(self, record: dict):
+        """提交后台任务生成记录的显示尺寸图片"""
+        sizes = [int(size) for size in record['renditions']]
+        
+        def generate():
+            try:
+                with metrics.span("rendition"):
+                    generate_renditions(record['image_path'], sizes)
+            except Exception as e:
+                # 没有生成的版本不存在，select_rendition 会改用原图
+                print(f"⚠️ 生成显示尺寸图片失败（记录 {record['id']}）: {e}")
+            finally:
+                with self._rendition_lock:
+                    self._rendition_jobs.pop(record['id'], None)
+        
+        with self._rendition_lock:
+            self._rendition_jobs[record['id']] = self._rendition_executor.submit(generate)
+    
+    def pending_renditions(self, record_id: int):
+        """
+        获取记录正在后台生成显示尺寸图片的 Future
+        
+        Returns:
+            Future: 正在生成时返回，已生成完或没有需要生成的版本时返回None
+        """
+        with self._rendition_lock:
+            return self._rendition_jobs.get(record_id)
+    
+    def wait_renditions(self, record_id: int, timeout: float = 10):
+        """等待记录的显示尺寸图片生成完（同步；不在生成中时立即返回，超时后按原图处理）"""
+        future = self.pending_renditions(record_id)
+        if future is None:
+            return
+        try:
+            future.result(timeout=timeout)
+        except Exception as e:
+            print(f"⚠️ 等待显示尺寸图片超时: {e}")
+    
+    def _save_image(self, image, path_stem: str) -> str:
+        """
+        保存图片（先写临时文件再替换，读者不会看到写了一半的图片）
+        
+        Args:
+            image: 编码好的图片字节或 PIL 图片
+            path_stem: 不含扩展名的目标路径
+            
+        Returns:
+            str: 图片文件路径
+        """
+        if isinstance(image, (bytes, bytearray)):
+            extension = detect_image_extension(bytes(image[:16]))
+            if extension:
+                image_path = path_stem + extension
+                temp_path = image_path + '.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(image)
+                os.replace(temp_path, image_path)
+                return image_path
+            # 无法识别的格式：交给 PIL 解码后重新编码
+            image = Image.open(BytesIO(image))
+        
+        source_path = getattr(image, 'filename', '')
+        if source_path and os.path.exists(source_path):
+            with open(source_path, 'rb') as f:
+                extension = detect_image_extension(f.read(16))
+            if extension:
+                image_path = path_stem + extension
+                if is_download_file(source_path):
+                    # 流式下载的文件和历史记录在同一目录树下，直接改名
+                    try:
+                        os.replace(source_path, image_path)
+                        return image_path
+                    except OSError:
+                        # Windows 上文件仍被打开时不能改名，改为复制，下载文件留给 cleanup_downloads 清理
+                        pass
+                temp_path = image_path + '.tmp'
+                shutil.copyfile(source_path, temp_path)
+                os.replace(temp_path, image_path)
+                if is_download_file(source_path):
+                    try:
+                        os.remove(source_path)
+                    except OSError:
+                        pass
+                return image_path
+        
+        # 内存中的图片：编码为 PNG
+        image_path = path_stem + '.png'
+        temp_path = image_path + '.tmp'
+        # 确保图片是 RGB 模式
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(temp_path, format='PNG')
+        os.replace(temp_path, image_path)
+        return image_path
+    
+    def find_similar_image(self, text: str):
+        """
+        在历史记录中查找与提示词语义相近的图片（语义近似缓存）
+        
+        Args:
+            text: 提示词
+            
+        Returns:
+            (PIL.Image, str): 命中时返回历史图片和传入的提示词，未命中返回None
+        """
+        if self.prompt_index is None:
+            return None
+        record = self.prompt_index.lookup(text)
+        if record is None:
+            return None
+        try:
+            image = Image.open(record['image_path'])
+            image.load()
+        except OSError as e:
+            # 图片已被删除：从索引中移除，按未命中处理
+            print(f"⚠️ 语义缓存图片不可用: {e}")
+            self.prompt_index.discard(record['id'])
+            return None
+        return image, text
+    
+    def refresh(self):
+        """同步磁盘上的变化（其他进程写入或手动修改）"""
+        self.storage.refresh()
+    
     def get_history(self) -> list:
         """获取所有历史记录"""
-        return self.history
+        return self.storage.all()
+    
+    def get_count(self) -> int:
+        """获取历史记录数量"""
+        return self.storage.count()
+    
+    def get_latest_record(self) -> dict:
+        """
+        获取最新一条记录（会先同步磁盘上的变化）
+        
+        Returns:
+            dict: 最新记录，没有记录返回None
+        """
+        return self.storage.latest()
     
     def get_record(self, index: int) -> dict:
         """
@@ -91,16 +300,10 @@ class HistoryManager:
         Returns:
             dict: 记录信息，如果索引无效返回None
         """
-        if not self.history:
-            return None
-        
         if index < 0:
-            index = len(self.history) + index
-        
-        if 0 <= index < len(self.history):
-            return self.history[index]
+            index = self.storage.count() + index
         
-        return None
+        return self.storage.get_by_position(index)
     
     def get_current_index(self, record_id: int) -> int:
         """
@@ -112,19 +315,102 @@ class HistoryManager:
         Returns:
             int: 索引，如果未找到返回-1
         """
-        for i, record in enumerate(self.history):
-            if record['id'] == record_id:
-                return i
-        return -1
+        return self.storage.position_of(record_id)
+    
+    def get_record_by_id(self, record_id: int) -> dict:
+        """
+        根据记录ID获取记录
+        
+        Args:
+            record_id: 记录ID
+            
+        Returns:
+            dict: 记录信息，如果未找到返回None
+        """
+        index = self.storage.position_of(record_id)
+        if index < 0:
+            return None
+        return self.storage.get_by_position(index)
+    
+    def get_adjacent_record(self, record_id: int, step: int) -> dict:
+        """
+        获取相邻记录（上一张 step=-1，下一张 step=1）
+        
+        Args:
+            record_id: 当前记录ID
+            step: 偏移量
+            
+        Returns:
+            dict: 相邻记录，不存在返回None
+        """
+        return self.storage.adjacent(record_id, step)
+    
+    def get_page(self, cursor: int = None, limit: int = 50) -> tuple:
+        """
+        分页获取历史记录（从新到旧，键集分页，不加载全部记录）
+        
+        Args:
+            cursor: 上一页返回的游标（该页最后一条记录的ID），None 表示从最新一条开始
+            limit: 每页条数
+            
+        Returns:
+            (list, int): 本页记录和下一页的游标，没有更多记录时游标为None
+        """
+        records = self.storage.page(cursor, limit + 1)
+        if len(records) > limit:
+            return records[:limit], records[limit - 1]['id']
+        return records, None
+    
+    def export_json(self, path: str = None) -> str:
+        """
+        导出历史记录为 JSON 文件（与 history.json 格式相同）
+        
+        Args:
+            path: 导出路径，默认导出到 history.json
+            
+        Returns:
+            str: 导出文件路径
+        """
+        path = path or self.history_file
+        if isinstance(self.storage, JsonHistoryStorage) and os.path.abspath(path) == os.path.abspath(self.history_file):
+            # JSON 引擎导出到自身快照：直接合并追加日志，避免快照和日志重复
+            self.storage.replace_all(self.get_history())
+            return path
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.get_history(), f, ensure_ascii=False, indent=2)
+        return path
+    
+    def import_json(self, path: str = None) -> int:
+        """
+        从 JSON 文件导入历史记录（替换现有记录）
+        
+        Args:
+            path: JSON 文件路径，默认从 history.json 导入
+            
+        Returns:
+            int: 导入的记录数
+        """
+        path = path or self.history_file
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        self.storage.replace_all(records)
+        if self.prompt_index is not None:
+            self.prompt_index.rebuild(records)
+        # 之后分配的ID不能与导入的记录重复
+        with self._id_lock:
+            self._last_id = max([self._last_id] + [record['id'] for record in records])
+        return len(records)
     
     def clear_history(self):
         """清空历史记录"""
-        self.history = []
-        self._save_history()
+        self.storage.replace_all([])
+        if self.prompt_index is not None:
+            self.prompt_index.clear()
+        self.thumbnails.clear()
         
         # 删除所有图片文件
         for filename in os.listdir(self.history_dir):
-            if filename.endswith('.png'):
+            if filename.endswith(('.png', '.jpg', '.webp', '.gif')):
                 try:
                     os.remove(os.path.join(self.history_dir, filename))
                 except Exception as e:
@@ -133,4 +419,3 @@ class HistoryManager:
 
 # 创建全局历史管理器实例
 history_manager = HistoryManager()
-
@@ -0,0 +1,379 @@
+"""
+历史记录存储引擎
+- JsonHistoryStorage：history.json 快照 + history.jsonl 追加日志
+- SqliteHistoryStorage：SQLite（WAL 模式），按 id 建索引，支持多进程并发读取
+
+两种引擎提供相同的方法，由 HistoryManager 根据 config.HISTORY_BACKEND 选择。
+记录按插入顺序排列，"位置"指记录在该顺序中的下标（从 0 开始）。
+"""
+import os
+import json
+import sqlite3
+import threading
+
+
+class JsonHistoryStorage:
+    """JSON 快照 + 追加日志存储"""
+
+    def __init__(self, history_dir: str, max_history: int, compact_every: int = 100):
+        self.max_history = max_history
+        self.compact_every = compact_every
+        self.history_file = os.path.join(history_dir, 'history.json')
+        self.journal_file = os.path.join(history_dir, 'history.jsonl')
+        self._lock = threading.RLock()
+        # 快照文件签名 (mtime, size) 和已读取的日志字节数，用于增量刷新
+        self._snapshot_sig = None
+        self._journal_offset = 0
+        self._journal_count = 0
+        self.history = self._load_history()
+
+    def _file_sig(self, path: str):
+        """获取文件签名，文件不存在返回None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load_snapshot(self) -> list:
+        """加载快照文件"""
+        if os.path.exists(self.history_file):
+            try:
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"⚠️ 加载历史记录失败: {e}")
+                return []
+        return []
+
+    def _read_journal(self, offset: int) -> tuple:
+        """
+        从指定字节位置读取追加日志
+
+        Returns:
+            (list, int): 新记录列表和读取后的字节位置（只消费完整的行）
+        """
+        records = []
+        if not os.path.exists(self.journal_file):
+            return records, 0
+        with open(self.journal_file, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # 最后一行可能还没写完，留到下次读取
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line.decode('utf-8')))
+            except Exception as e:
+                print(f"⚠️ 跳过损坏的历史日志行: {e}")
+        return records, offset + end
+
+    def _load_history(self) -> list:
+        """加载历史记录（快照 + 追加日志）"""
+        with self._lock:
+            self._snapshot_sig = self._file_sig(self.history_file)
+            history = self._load_snapshot()
+            records, self._journal_offset = self._read_journal(0)
+            self._journal_count = len(records)
+            history.extend(records)
+            return history[-self.max_history:]
+
+    def _trim(self):
+        """内存中只保留最新的 max_history 条记录（日志中多出的旧记录在下次合并时删除）"""
+        if len(self.history) > self.max_history:
+            self.history = self.history[-self.max_history:]
+
+    def refresh(self):
+        """
+        同步磁盘上的变化（其他进程写入或手动修改）
+
+        快照未变化时只读取日志中新追加的部分，不重新解析整个文件
+        """
+        with self._lock:
+            journal_sig = self._file_sig(self.journal_file)
+            journal_size = journal_sig[1] if journal_sig else 0
+            if self._file_sig(self.history_file) != self._snapshot_sig or journal_size < self._journal_offset:
+                # 快照被修改或日志被合并清空：完整重新加载
+                self.history = self._load_history()
+            elif journal_size > self._journal_offset:
+                records, self._journal_offset = self._read_journal(self._journal_offset)
+                self._journal_count += len(records)
+                self.history.extend(records)
+                self._trim()
+
+    def _save_history(self):
+        """保存历史记录快照，并清空追加日志"""
+        with self._lock:
+            try:
+                # 限制历史记录数量
+                limited_history = self.history[-self.max_history:]
+                # 先写临时文件再替换，避免读者看到写了一半的快照
+                temp_file = self.history_file + '.tmp'
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(limited_history, f, ensure_ascii=False, indent=2)
+                os.replace(temp_file, self.history_file)
+                with open(self.journal_file, 'w', encoding='utf-8'):
+                    pass
+                self.history = limited_history
+                self._snapshot_sig = self._file_sig(self.history_file)
+                self._journal_offset = 0
+                self._journal_count = 0
+            except Exception as e:
+                print(f"⚠️ 保存历史记录失败: {e}")
+
+    def append(self, record: dict):
+        """追加一条记录到日志（O(1) 写入），达到阈值时合并到快照"""
+        with self._lock:
+            # 先读入其他进程追加的记录，保证 offset 与文件内容一致
+            self.refresh()
+            try:
+                line = json.dumps(record, ensure_ascii=False) + '\n'
+                with open(self.journal_file, 'ab') as f:
+                    f.write(line.encode('utf-8'))
+                    self._journal_offset = f.tell()
+                self._journal_count += 1
+                self.history.append(record)
+                self._trim()
+            except Exception as e:
+                print(f"⚠️ 追加历史记录失败: {e}")
+                self.history.append(record)
+                self._save_history()
+                return
+            if self._journal_count >= self.compact_every:
+                self._save_history()
+
+    def replace_all(self, records: list):
+        """用给定的记录列表替换全部历史记录"""
+        with self._lock:
+            self.history = list(records)
+            self._save_history()
+
+    def all(self) -> list:
+        return self.history
+
+    def count(self) -> int:
+        return len(self.history)
+
+    def latest(self) -> dict:
+        self.refresh()
+        return self.history[-1] if self.history else None
+
+    def get_by_position(self, position: int) -> dict:
+        if 0 <= position < len(self.history):
+            return self.history[position]
+        return None
+
+    def position_of(self, record_id: int) -> int:
+        for i, record in enumerate(self.history):
+            if record['id'] == record_id:
+                return i
+        return -1
+
+    def adjacent(self, record_id: int, step: int) -> dict:
+        position = self.position_of(record_id)
+        if position < 0:
+            return None
+        return self.get_by_position(position + step)
+
+    def page(self, before_id: int, limit: int) -> list:
+        self.refresh()
+        end = len(self.history) if before_id is None else self.position_of(before_id)
+        if end < 0:
+            return []
+        return self.history[max(0, end - limit):end][::-1]
+
+
+class SqliteHistoryStorage:
+    """SQLite 存储（WAL 模式，支持 7860/7861 等多个进程同时读取）"""
+
+    # 已知字段存为独立列，其余字段（后续扩展）存入 extra JSON 列
+    COLUMNS = ('id', 'text', 'image_path', 'timestamp')
+
+    def __init__(self, db_path: str, max_history: int):
+        self.db_path = db_path
+        self.max_history = max_history
+        # sqlite3 连接不能跨线程共享，每个线程一个连接
+        self._local = threading.local()
+        # 数据库文件是否由本次打开新建（HistoryManager 只在新建时从 history.json 导入）
+        self.created = not os.path.exists(db_path)
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        # seq 是插入顺序（AUTOINCREMENT 保证单调递增、不复用），位置 = seq - 最小 seq
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id INTEGER NOT NULL UNIQUE,
+                text TEXT NOT NULL,
+                image_path TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                extra TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records(timestamp)')
+        # 元数据：记录数（与增删记录在同一事务中更新，不用每次 COUNT(*) 扫描全表）
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'count'").fetchone() is None:
+                # 旧版本创建的数据库没有记录数，统计一次
+                total = conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+                conn.execute("INSERT INTO meta (key, value) VALUES ('count', ?)", (total,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _to_record(self, row) -> dict:
+        if row is None:
+            return None
+        record = {column: row[column] for column in self.COLUMNS}
+        if row['extra']:
+            record.update(json.loads(row['extra']))
+        return record
+
+    def _to_row(self, record: dict) -> tuple:
+        extra = {k: v for k, v in record.items() if k not in self.COLUMNS}
+        return (
+            record['id'],
+            record.get('text', ''),
+            record.get('image_path', ''),
+            record.get('timestamp', ''),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    def _insert(self, conn: sqlite3.Connection, record: dict) -> int:
+        """插入记录（已有相同ID时替换），返回新增的记录数（0 或 1）"""
+        exists = conn.execute('SELECT 1 FROM records WHERE id = ?', (record['id'],)).fetchone() is not None
+        conn.execute(
+            'INSERT OR REPLACE INTO records (id, text, image_path, timestamp, extra) VALUES (?, ?, ?, ?, ?)',
+            self._to_row(record)
+        )
+        return 0 if exists else 1
+
+    def _stored_count(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM meta WHERE key = 'count'").fetchone()[0]
+
+    def _trim(self, conn: sqlite3.Connection, total: int):
+        """
+        只保留最新的 max_history 条记录，并把记录数写入 meta（调用方需在事务中）
+
+        按行数删除最旧的记录：替换已有ID会让 seq 出现空洞，不能按 seq 差值计算
+        """
+        excess = total - self.max_history
+        if excess > 0:
+            conn.execute('DELETE FROM records WHERE seq IN (SELECT seq FROM records ORDER BY seq LIMIT ?)', (excess,))
+            total = self.max_history
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'count'", (total,))
+
+    def _seq_range(self) -> tuple:
+        """
+        返回 (最小 seq, 最大 seq, 记录数)
+
+        MIN/MAX 走主键索引，记录数读取 meta，都是 O(log n)；放在同一条语句中，其他进程写入时也读到一致的快照
+        """
+        row = self._conn().execute(
+            "SELECT (SELECT MIN(seq) FROM records), (SELECT MAX(seq) FROM records), "
+            "(SELECT value FROM meta WHERE key = 'count')"
+        ).fetchone()
+        return row[0], row[1], row[2]
+
+    def refresh(self):
+        """每次查询都直接读取数据库，无需额外同步"""
+        pass
+
+    def append(self, record: dict):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            added = self._insert(conn, record)
+            self._trim(conn, self._stored_count(conn) + added)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def replace_all(self, records: list):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM records')
+            total = 0
+            for record in records:
+                total += self._insert(conn, record)
+            self._trim(conn, total)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def all(self) -> list:
+        rows = self._conn().execute('SELECT * FROM records ORDER BY seq').fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def count(self) -> int:
+        return self._stored_count(self._conn())
+
+    def latest(self) -> dict:
+        row = self._conn().execute('SELECT * FROM records ORDER BY seq DESC LIMIT 1').fetchone()
+        return self._to_record(row)
+
+    def get_by_position(self, position: int) -> dict:
+        min_seq, max_seq, total = self._seq_range()
+        if not total or not 0 <= position < total:
+            return None
+        conn = self._conn()
+        if max_seq - min_seq + 1 == total:
+            # seq 连续（只从最旧一端删除过），直接按主键定位
+            row = conn.execute('SELECT * FROM records WHERE seq = ?', (min_seq + position,)).fetchone()
+        else:
+            row = conn.execute('SELECT * FROM records ORDER BY seq LIMIT 1 OFFSET ?', (position,)).fetchone()
+        return self._to_record(row)
+
+    def position_of(self, record_id: int) -> int:
+        conn = self._conn()
+        row = conn.execute('SELECT seq FROM records WHERE id = ?', (record_id,)).fetchone()
+        if row is None:
+            return -1
+        min_seq, max_seq, total = self._seq_range()
+        if max_seq - min_seq + 1 == total:
+            return row['seq'] - min_seq
+        return conn.execute('SELECT COUNT(*) FROM records WHERE seq < ?', (row['seq'],)).fetchone()[0]
+
+    def adjacent(self, record_id: int, step: int) -> dict:
+        """键集分页：按 seq 取相邻记录，不依赖位置下标"""
+        conn = self._conn()
+        if step < 0:
+            sql = ('SELECT * FROM records WHERE seq < (SELECT seq FROM records WHERE id = ?) '
+                   'ORDER BY seq DESC LIMIT 1 OFFSET ?')
+        else:
+            sql = ('SELECT * FROM records WHERE seq > (SELECT seq FROM records WHERE id = ?) '
+                   'ORDER BY seq LIMIT 1 OFFSET ?')
+        row = conn.execute(sql, (record_id, abs(step) - 1)).fetchone()
+        return self._to_record(row)
+
+    def page(self, before_id: int, limit: int) -> list:
+        """键集分页：从新到旧取 before_id 之前的记录"""
+        conn = self._conn()
+        if before_id is None:
+            rows = conn.execute('SELECT * FROM records ORDER BY seq DESC LIMIT ?', (limit,)).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT * FROM records WHERE seq < (SELECT seq FROM records WHERE id = ?) '
+                'ORDER BY seq DESC LIMIT ?',
+                (before_id, limit)
+            ).fetchall()
+        return [self._to_record(row) for row in rows]
@@ -0,0 +1,135 @@
+"""
+HTTP 连接池
+为每个上游主机维护持久的 keep-alive 连接，避免每次请求都重新握手
+"""
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledSession:
+    """按上游主机划分的连接池（线程安全）"""
+
+    def __init__(self, name: str, pool_size: int = 10, idle_timeout: float = 60.0):
+        """
+        Args:
+            name: 连接池名称（用于日志和统计）
+            pool_size: 每个主机最多保留的空闲连接数
+            idle_timeout: 空闲超过该秒数后丢弃整个连接池（上游通常会先断开空闲连接）
+        """
+        self.name = name
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._session = None
+        self._last_used = 0.0
+        # 正在进行的请求数（不为0时不会因空闲而重建，避免关闭长请求正在使用的连接池）
+        self._in_flight = 0
+
+        # 统计信息
+        self.sessions_created = 0
+        self.sessions_expired = 0
+        # 已关闭连接池的累计值（当前连接池的值在 stats() 中实时读取）
+        self._closed_requests = 0
+        self._closed_connections = 0
+
+    def _new_session(self) -> requests.Session:
+        """创建带有限大小连接池的 Session"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self.sessions_created += 1
+        return session
+
+    def _pool_counters(self, session: requests.Session) -> tuple:
+        """读取 urllib3 连接池中的请求数和新建连接数"""
+        total_requests = 0
+        total_connections = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                total_requests += getattr(pool, 'num_requests', 0)
+                total_connections += getattr(pool, 'num_connections', 0)
+        return total_requests, total_connections
+
+    def _retire_session(self):
+        """关闭当前 Session，并把它的计数累加到历史值（调用方需持有锁）"""
+        if self._session is None:
+            return
+        req_count, conn_count = self._pool_counters(self._session)
+        self._closed_requests += req_count
+        self._closed_connections += conn_count
+        self._session.close()
+        self._session = None
+
+    def _acquire_session(self) -> requests.Session:
+        """获取可用 Session 并计入正在进行的请求，没有请求在进行且空闲过久则重建"""
+        with self._lock:
+            now = time.time()
+            if self._session is not None and self._in_flight == 0 and now - self._last_used > self.idle_timeout:
+                self._retire_session()
+                self.sessions_expired += 1
+            if self._session is None:
+                self._session = self._new_session()
+            self._in_flight += 1
+            self._last_used = now
+            return self._session
+
+    def _release_session(self):
+        """请求结束：空闲时间从请求结束时开始计算（如 120 秒的文生图请求）"""
+        with self._lock:
+            self._in_flight -= 1
+            self._last_used = time.time()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发送请求（参数与 requests.request 一致）"""
+        session = self._acquire_session()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            self._release_session()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """关闭连接池"""
+        with self._lock:
+            self._retire_session()
+
+    def stats(self) -> dict:
+        """
+        获取连接复用统计
+
+        Returns:
+            dict: 请求数、新建连接数和复用命中率
+        """
+        with self._lock:
+            total_requests = self._closed_requests
+            total_connections = self._closed_connections
+            if self._session is not None:
+                req_count, conn_count = self._pool_counters(self._session)
+                total_requests += req_count
+                total_connections += conn_count
+
+        reused = max(total_requests - total_connections, 0)
+        return {
+            'name': self.name,
+            'pool_size': self.pool_size,
+            'idle_timeout': self.idle_timeout,
+            'requests': total_requests,
+            'connections': total_connections,
+            'reused': reused,
+            'reuse_rate': reused / total_requests if total_requests else 0.0,
+            'sessions_created': self.sessions_created,
+            'sessions_expired': self.sessions_expired,
+            'in_flight': self._in_flight,
+        }
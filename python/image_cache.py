@@ -0,0 +1,86 @@
+"""
+已编码图片缓存
+按 (记录ID, 图片路径, 文件修改时间, 文件大小) 缓存图片文件的原始字节和 base64 data URL，
+轮询同一张图片时直接返回，不再重复解码和编码
+"""
+import base64
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+# 历史图片可能是上游原始格式（JPEG/WebP），部分 Python 版本的 mimetypes 不认识 .webp
+mimetypes.add_type('image/webp', '.webp')
+
+
+class EncodedImageCache:
+    """LRU 缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = 4):
+        """
+        Args:
+            max_entries: 最多缓存的图片数量
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, record: dict, image_path: str = None) -> dict:
+        """
+        获取记录对应图片的已编码数据
+
+        Args:
+            record: 历史记录（需要 id 和 image_path）
+            image_path: 要读取的图片文件（如显示尺寸的缩小版本），默认为记录的原图
+
+        Returns:
+            dict: {"bytes": 原始字节, "mime": MIME 类型, "data_url": base64 data URL}
+
+        Raises:
+            OSError: 图片文件不存在或无法读取
+        """
+        image_path = image_path or record['image_path']
+        stat = os.stat(image_path)
+        key = (record['id'], image_path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # 图片文件本身就是编码好的格式，直接读取字节，不经过 PIL 解码/重新编码
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        mime = mimetypes.guess_type(image_path)[0] or 'image/png'
+        entry = {
+            'bytes': data,
+            'mime': mime,
+            'data_url': f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}",
+        }
+
+        with self._lock:
+            # 同一记录的旧版本（文件被修改过）直接丢弃
+            for old_key in [k for k in self._entries if k[:2] == key[:2]]:
+                del self._entries[old_key]
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,247 @@
+"""
+流式图片下载
+把图片 URL 的响应分块写入历史记录目录下的 downloads/，不在内存中保留完整的响应内容，
+下载完成后返回按需解码的 PIL 图片（Image.open 只读取文件头，像素数据在第一次使用时才解码）
+
+接口直接返回 b64_json 时，Base64JsonDecoder 从响应流中增量解码图片字段，同样写入下载文件
+"""
+import base64
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from PIL import Image
+import config
+
+
+class DownloadTooLargeError(ValueError):
+    """下载内容超过大小上限"""
+    pass
+
+
+class StreamingDownload:
+    """
+    分块写入下载文件，限制大小并报告进度
+
+    用法（同步或异步的分块迭代都可以）：
+        with StreamingDownload(total) as download:
+            for chunk in response.iter_content(config.DOWNLOAD_CHUNK_SIZE):
+                download.write(chunk)
+        image = download.open_image()
+    """
+
+    def __init__(self, total: int = None, max_bytes: int = None, progress_callback=None):
+        """
+        Args:
+            total: 响应声明的总字节数（Content-Length），未知时为None
+            max_bytes: 大小上限（字节），默认 config.IMAGE_DOWNLOAD_MAX_MB
+            progress_callback: 进度回调 callback(已下载字节数, 总字节数或None)
+        """
+        self.total = total
+        self.max_bytes = max_bytes or int(config.IMAGE_DOWNLOAD_MAX_MB * 1024 * 1024)
+        self.progress_callback = progress_callback
+        self.downloaded = 0
+        self.path = os.path.join(config.DOWNLOAD_DIR, f"{uuid.uuid4().hex}.download")
+        self._file = None
+
+        if self.total and self.total > self.max_bytes:
+            raise DownloadTooLargeError(f"图片大小 {self.total} 字节超过上限 {self.max_bytes} 字节")
+
+    def __enter__(self):
+        os.makedirs(config.DOWNLOAD_DIR, exist_ok=True)
+        self._file = open(self.path, 'wb')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is not None:
+            # 下载失败：删除写了一半的文件
+            self.discard()
+        return False
+
+    def write(self, chunk: bytes):
+        """写入一块数据"""
+        self.downloaded += len(chunk)
+        if self.downloaded > self.max_bytes:
+            raise DownloadTooLargeError(f"图片大小超过上限 {self.max_bytes} 字节")
+        self._file.write(chunk)
+        if self.progress_callback:
+            try:
+                self.progress_callback(self.downloaded, self.total)
+            except Exception as e:
+                print(f"⚠️ 下载进度回调失败: {e}")
+
+    def open_image(self) -> Image.Image:
+        """打开下载好的图片（按需解码，image.filename 为下载文件路径）"""
+        try:
+            return Image.open(self.path)
+        except Exception:
+            self.discard()
+            raise
+
+    def discard(self):
+        """删除下载文件"""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class Base64JsonDecoder:
+    """
+    从 JSON 响应流中增量解码 "b64_json" 字段
+
+    base64 文本按 4 字符对齐分段解码后直接写入 StreamingDownload，
+    不在内存中保留完整的 JSON 文本、base64 字符串和解码后的图片字节；
+    其余字段（url、错误信息等）保留下来，结束时解析为 dict
+    """
+
+    MARKER = b'"b64_json"'
+    # 字段名之后到字符串开头的引号
+    _VALUE_START_RE = re.compile(rb'\s*:\s*"')
+    # 字段名之后还没收到完整的 ':"'
+    _VALUE_PARTIAL_RE = re.compile(rb'\s*(?::\s*)?$')
+    # JSON 转义：base64 中只可能出现 "\/"，换行转义 "\n"、"\r" 直接丢弃
+    _ESCAPE_RE = re.compile(rb'\\(.)', re.S)
+
+    def __init__(self, download: StreamingDownload):
+        self.download = download
+        self.found = False
+        self._state = 'search'  # search -> value -> tail；字段不是字符串时为 plain
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._pending = b''
+
+    def feed(self, chunk: bytes):
+        """输入一块响应数据"""
+        if self._state in ('search', 'plain'):
+            self._head += chunk
+            if self._state == 'plain':
+                return
+            index = self._head.find(self.MARKER)
+            if index < 0:
+                return
+            value_start = index + len(self.MARKER)
+            match = self._VALUE_START_RE.match(self._head, value_start)
+            if match is None:
+                if not self._VALUE_PARTIAL_RE.match(self._head, value_start):
+                    # 字段值不是字符串（如 null），按普通 JSON 处理
+                    self._state = 'plain'
+                return
+            chunk = bytes(self._head[match.end():])
+            del self._head[match.end():]
+            self._state = 'value'
+            self.found = True
+
+        if self._state == 'value':
+            end = chunk.find(b'"')
+            if end >= 0:
+                self._tail += chunk[end + 1:]
+                chunk = chunk[:end]
+                self._state = 'tail'
+            self._decode(chunk, final=self._state == 'tail')
+        elif self._state == 'tail':
+            self._tail += chunk
+
+    def _decode(self, text: bytes, final: bool = False):
+        text = self._pending + text
+        carry = b''
+        if b'\\' in text:
+            # 转义符可能被分块截断，留到下一块再处理
+            if not final and text.endswith(b'\\'):
+                text, carry = text[:-1], b'\\'
+            text = self._ESCAPE_RE.sub(lambda m: m.group(1) if m.group(1) == b'/' else b'', text)
+        usable = len(text) if final else len(text) // 4 * 4
+        if usable:
+            self.download.write(base64.b64decode(text[:usable]))
+        self._pending = text[usable:] + carry
+
+    @staticmethod
+    def estimate_size(content_length) -> int:
+        """根据响应体长度估算解码后的图片大小（base64 每 4 个字符对应 3 个字节），未知时返回None"""
+        return int(content_length) * 3 // 4 if content_length else None
+
+    def open_image(self) -> Image.Image:
+        """打开解码出的图片；响应中没有 b64_json 字段时删除下载文件并返回None"""
+        if not self.found:
+            self.download.discard()
+            return None
+        return self.download.open_image()
+
+    def close(self) -> dict:
+        """
+        结束解码
+
+        Returns:
+            dict: 响应 JSON（b64_json 字段的值替换为空字符串）
+        """
+        if self._state == 'value':
+            raise ValueError("响应在 b64_json 字段中途结束")
+        if self.found:
+            return json.loads(bytes(self._head) + b'"' + bytes(self._tail))
+        return json.loads(bytes(self._head))
+
+
+# 常见图片格式的文件头
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+)
+
+
+def detect_image_extension(header: bytes) -> str:
+    """
+    根据文件头识别图片格式
+
+    Args:
+        header: 图片数据的前 16 个字节
+
+    Returns:
+        str: 扩展名（如 ".jpg"），无法识别返回None
+    """
+    for signature, extension in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return '.webp'
+    return None
+
+
+def is_download_file(path: str) -> bool:
+    """判断文件是否是 StreamingDownload 写入的下载文件"""
+    if not path:
+        return False
+    return os.path.dirname(os.path.abspath(path)) == os.path.abspath(config.DOWNLOAD_DIR)
+
+
+def duplicate_image(image: Image.Image) -> Image.Image:
+    """
+    复制一份图片（多个流程共用一次生成结果时，各自保存到历史记录不能共用同一个下载文件）
+
+    从文件打开的图片复制原始字节为新的下载文件后按需打开，不解码也不重新编码；内存中的图片直接 copy()
+    """
+    source = getattr(image, 'filename', '')
+    if source and os.path.exists(source):
+        os.makedirs(config.DOWNLOAD_DIR, exist_ok=True)
+        path = os.path.join(config.DOWNLOAD_DIR, f"{uuid.uuid4().hex}.download")
+        shutil.copyfile(source, path)
+        return Image.open(path)
+    return image.copy()
+
+
+def cleanup_downloads(max_age: float = 3600):
+    """删除遗留的下载文件（进程异常退出时没有被清理的文件）"""
+    if not os.path.isdir(config.DOWNLOAD_DIR):
+        return
+    deadline = time.time() - max_age
+    for filename in os.listdir(config.DOWNLOAD_DIR):
+        path = os.path.join(config.DOWNLOAD_DIR, filename)
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+        except OSError:
+            pass
@@ -1,9 +1,10 @@
 """
 独立图片查看服务（端口 7861）
-- 主动推送方案：仅读取 current_display.json / history.json
+- 主动推送方案：仅读取 current_display.json / 历史记录
 - 7860 侧写入 current_display.json，并调用 /notify 推送
-- 7861 侧 /notify 将置脏位，定时器立即刷新
+- 7861 侧 /notify 通过 SSE（/events）通知浏览器，浏览器立即刷新
 """
+import asyncio
 import json
 import os
 from typing import Optional
@@ -11,19 +12,17 @@ from typing import Optional
 import gradio as gr
 from PIL import Image
 from fastapi import FastAPI
+from starlette.responses import StreamingResponse
 
-HISTORY_FILE = os.path.join(os.path.dirname(__file__), "history", "history.json")
-CURRENT_DISPLAY_FILE = os.path.join(os.path.dirname(__file__), "history", "current_display.json")
-
-# 脏位，用于通知触发刷新
-dirty_flag = {"need_refresh": True}
+from event_bus import event_bus
+from history_manager import history_manager
+from renditions import select_rendition
 
+CURRENT_DISPLAY_FILE = os.path.join(os.path.dirname(__file__), "history", "current_display.json")
 
-def load_history() -> list:
-    if not os.path.exists(HISTORY_FILE):
-        return []
-    with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+# 图片显示区域尺寸（像素），用于选择显示尺寸的缩小版本
+VIEWER_WIDTH = 1920
+VIEWER_HEIGHT = 700
 
 
 def load_current_display_id() -> Optional[int]:
@@ -38,67 +37,90 @@ def load_current_display_id() -> Optional[int]:
         return None
 
 
-def find_image_by_id(record_id: int, history: list):
-    for rec in history:
-        if rec.get("id") == record_id:
-            path = rec.get("image_path", "")
-            if path and os.path.exists(path):
-                return Image.open(path)
+def open_display_image(rec: dict):
+    """打开适合显示区域的图片（预生成的缩小版本，没有时为原图），文件不存在返回None"""
+    if not rec.get("image_path"):
+        return None
+    path = select_rendition(rec, VIEWER_WIDTH, VIEWER_HEIGHT)
+    if os.path.exists(path):
+        return Image.open(path)
+    return None
+
+
+def find_image_by_id(record_id: int):
+    rec = history_manager.get_record_by_id(record_id)
+    if rec:
+        return open_display_image(rec)
     return None
 
 
 def load_display_image():
     """读取 current_display_id 指向的图片；若无则用最新一条"""
     try:
-        history = load_history()
-        if not history:
+        # 同步 7860 进程写入的新记录
+        last = history_manager.get_latest_record()
+        if not last:
             return None
         current_id = load_current_display_id()
         if current_id:
-            img = find_image_by_id(current_id, history)
+            img = find_image_by_id(current_id)
             if img:
                 return img
         # fallback: 最新一条
-        last = history[-1]
-        path = last.get("image_path", "")
-        if path and os.path.exists(path):
-            return Image.open(path)
-        return None
+        return open_display_image(last)
     except Exception as e:
         print(f"⚠️ 加载展示图片失败: {e}")
         return None
 
 
+# 浏览器订阅 /events，收到 notify 事件后点击刷新按钮（不再定时轮询）
+events_js = """
+() => {
+  if (!window.EventSource) return;
+  var source = new EventSource('/events');
+  source.addEventListener('notify', function () {
+    var btn = document.querySelector('#refresh-btn');
+    if (btn) btn.click();
+  });
+}
+"""
+
 # Gradio 界面
 with gr.Blocks(title="图片查看") as demo:
     gr.Markdown("## 当前展示图片", elem_classes="title")
-    image_output = gr.Image(label="", type="pil", show_label=False, height=700)
-    refresh_btn = gr.Button("刷新", variant="primary")
+    image_output = gr.Image(label="", type="pil", show_label=False, height=VIEWER_HEIGHT)
+    refresh_btn = gr.Button("刷新", variant="primary", elem_id="refresh-btn")
 
     # 初始化加载
-    demo.load(fn=load_display_image, inputs=[], outputs=[image_output])
+    demo.load(fn=load_display_image, inputs=[], outputs=[image_output], js=events_js)
     refresh_btn.click(fn=load_display_image, inputs=[], outputs=[image_output])
 
-    # 定时刷新：若收到 notify 则刷新，否则保持
-    def conditional_refresh():
-        if dirty_flag.get("need_refresh"):
-            dirty_flag["need_refresh"] = False
-            return load_display_image()
-        return gr.update()
 
-    gr.Timer(1.0).tick(fn=conditional_refresh, inputs=[], outputs=[image_output])
+# FastAPI 包装以支持 /notify 和 /events
+api = FastAPI()
 
 
-# FastAPI 包装以支持 /notify
-api = FastAPI()
+@api.on_event("startup")
+async def bind_event_bus():
+    event_bus.bind(asyncio.get_running_loop())
 
 
 @api.post("/notify")
 def notify():
-    dirty_flag["need_refresh"] = True
+    event_bus.publish("notify", {})
     return {"status": "ok"}
 
 
+@api.get("/events")
+async def events():
+    """Server-Sent Events：7860 通知后推送刷新事件"""
+    return StreamingResponse(
+        event_bus.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # 将 Gradio 挂载到 FastAPI
 api = gr.mount_gradio_app(api, demo, path="/")
 
@@ -0,0 +1,175 @@
+"""
+生成任务队列
+有界队列 + 固定数量的工作协程，限制同时进行的生成流程数量
+"""
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+
+
+# 当前正在执行的任务ID（在 handler 内部可读取，用于给进度事件标记任务）
+current_job_id = contextvars.ContextVar('current_job_id', default=None)
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+    pass
+
+
+class JobQueue:
+    """有界生成任务队列"""
+
+    def __init__(self, handler, max_size: int = 8, num_workers: int = 2, max_finished: int = 200, on_update=None):
+        """
+        Args:
+            handler: 处理任务的协程函数，参数为任务负载，返回值保存为任务结果
+            max_size: 排队中的任务上限，超过后提交会被拒绝
+            num_workers: 工作协程数量（同时进行的生成流程数）
+            max_finished: 最多保留的已结束任务数量（用于状态查询）
+            on_update: 任务状态变化时的回调函数，参数为任务信息
+        """
+        self.handler = handler
+        self.on_update = on_update
+        self.max_size = max_size
+        self.num_workers = num_workers
+        self.max_finished = max_finished
+        self._queue = None
+        self._workers = []
+        self._jobs = OrderedDict()
+
+        # 统计信息
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self):
+        """启动工作协程（需要在事件循环中调用）"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        for i in range(self.num_workers):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        print(f"🧵 任务队列已启动: {self.num_workers} 个工作协程，队列上限 {self.max_size}")
+
+    async def stop(self):
+        """停止工作协程"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, payload) -> dict:
+        """
+        提交任务
+
+        Args:
+            payload: 传给 handler 的任务负载
+
+        Returns:
+            dict: 任务信息
+
+        Raises:
+            QueueFullError: 队列已满
+        """
+        if self._queue is None:
+            raise RuntimeError("任务队列尚未启动")
+
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+        try:
+            self._queue.put_nowait((job, payload))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"任务队列已满（上限 {self.max_size}）")
+
+        self._jobs[job['id']] = job
+        self.submitted += 1
+        self._trim_jobs()
+        self._notify(job)
+        return job
+
+    def get_job(self, job_id: str) -> dict:
+        """
+        根据任务ID获取任务信息
+
+        Returns:
+            dict: 任务信息，如果未找到返回None
+        """
+        return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> int:
+        """排队中任务的位置（从 1 开始），不在排队中返回 0"""
+        position = 0
+        for job in self._jobs.values():
+            if job['status'] == 'queued':
+                position += 1
+                if job['id'] == job_id:
+                    return position
+        return 0
+
+    def stats(self) -> dict:
+        """获取队列统计"""
+        return {
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'max_size': self.max_size,
+            'workers': self.num_workers,
+            'running': sum(1 for job in self._jobs.values() if job['status'] == 'running'),
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def _notify(self, job: dict):
+        """通知任务状态变化（回调异常不影响任务本身）"""
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(job)
+        except Exception as e:
+            print(f"⚠️ 任务状态回调失败: {e}")
+
+    def _trim_jobs(self):
+        """只保留最近的已结束任务，避免任务表无限增长"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('done', 'failed')]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job_id]
+
+    async def _worker(self, worker_index: int):
+        """工作协程：依次取出任务并执行"""
+        while True:
+            job, payload = await self._queue.get()
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            print(f"🧵 工作协程 {worker_index} 开始任务: {job['id']}")
+            self._notify(job)
+            current_job_id.set(job['id'])
+            try:
+                job['result'] = await self.handler(payload)
+                job['status'] = 'done'
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job['status'] = 'failed'
+                job['error'] = str(e)
+                self.failed += 1
+                print(f"❌ 任务失败 {job['id']}: {e}")
+                import traceback
+                traceback.print_exc()
+            finally:
+                current_job_id.set(None)
+                job['finished_at'] = time.time()
+                self._queue.task_done()
+                self._trim_jobs()
+                self._notify(job)
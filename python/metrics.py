@@ -0,0 +1,145 @@
+"""
+流程各阶段耗时统计
+用单调时钟（time.perf_counter）记录每个阶段的耗时，按阶段汇总为直方图和 p50/p95/p99，
+以 Prometheus 文本格式在 demo7.py 的 /metrics 接口导出
+
+用法：
+    with metrics.span("stt"):
+        text = doubao_service.audio_to_text(path)
+
+    start = time.perf_counter()
+    ...
+    metrics.observe("download", time.perf_counter() - start)
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 直方图桶的上界（秒），覆盖从毫秒级的本地操作到几十秒的文生图请求
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# 导出的分位数
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 当前上下文（一次生成任务）各阶段耗时的收集结果，由 collect_stages() 开启
+_stage_trace = contextvars.ContextVar('stage_trace', default=None)
+
+
+class StageHistogram:
+    """单个阶段的耗时直方图（累计桶计数 + 最近样本用于计算分位数）"""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """最近样本的分位数（最近邻取值），没有样本时返回None"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StageMetrics:
+    """各阶段耗时统计（线程安全）"""
+
+    def __init__(self, prefix: str = "speech_to_image"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        # 阶段名 -> StageHistogram（按首次出现的顺序）
+        self._stages = {}
+
+    def observe(self, stage: str, seconds: float):
+        """记录一次阶段耗时（秒）"""
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = StageHistogram()
+            histogram.observe(seconds)
+        trace = _stage_trace.get()
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + seconds
+
+    @staticmethod
+    def collect_stages() -> dict:
+        """
+        开始收集当前上下文（一次生成任务）中记录的阶段耗时，返回收集结果 {阶段名: 秒}（同名阶段累加）
+
+        线程池中记录的阶段需要用 contextvars.copy_context() 运行才能收集到
+        """
+        trace = {}
+        _stage_trace.set(trace)
+        return trace
+
+    @contextmanager
+    def span(self, stage: str):
+        """记录 with 块的耗时（块内抛出异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """
+        获取各阶段的汇总
+
+        Returns:
+            dict: {阶段名: {"count", "sum", "p50", "p95", "p99"}}
+        """
+        with self._lock:
+            return {
+                stage: {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    **{f"p{int(q * 100)}": histogram.quantile(q) for q in QUANTILES},
+                }
+                for stage, histogram in self._stages.items()
+            }
+
+    def render_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式（histogram：累计耗时分布；summary：最近样本的分位数）"""
+        histogram_name = f"{self.prefix}_stage_duration_seconds"
+        summary_name = f"{self.prefix}_stage_latency_seconds"
+        lines = [
+            f"# HELP {histogram_name} Duration of each pipeline stage.",
+            f"# TYPE {histogram_name} histogram",
+        ]
+        with self._lock:
+            stages = list(self._stages.items())
+            for stage, histogram in stages:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{histogram_name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{histogram_name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{histogram_name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{histogram_name}_count{{stage="{stage}"}} {histogram.count}')
+
+            lines.append(f"# HELP {summary_name} Recent quantiles of each pipeline stage duration.")
+            lines.append(f"# TYPE {summary_name} summary")
+            for stage, histogram in stages:
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    lines.append(f'{summary_name}{{stage="{stage}",quantile="{q}"}} {"NaN" if value is None else value}')
+                lines.append(f'{summary_name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{summary_name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+# 全局实例
+metrics = StageMetrics()
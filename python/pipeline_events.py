@@ -0,0 +1,67 @@
+"""
+生成流程的结构化事件日志（JSONL）
+每次上传写一行：接收时间、音频大小、识别文字和提示词、各阶段耗时、结果状态，
+供 benchmark/replay.py 转换为可回放的负载轨迹（控制台日志只能近似还原）
+
+一行示例：
+    {"event": "job", "job_id": "...", "received_at": 1766025855.594, "audio_bytes": 48213, "status": "done",
+     "transcript": "请帮我画一个霸王龙", "prompt": "请帮我画一个霸王龙", "record_id": 1766025874549,
+     "stages": {"transcode": 0.05, "stt": 3.26, "tti": 10.24, "history_save": 0.41}}
+被队列拒绝的上传记为 status="rejected"，没有阶段耗时；语音识别失败的任务记为 status="failed"，
+stt_error 为识别服务返回的提示文字（不会被当作提示词去生成图片）
+"""
+import contextvars
+import json
+import os
+import threading
+
+import config
+
+# 当前上下文（一次生成任务）的事件，由 begin() 开启
+_current_event = contextvars.ContextVar('pipeline_event', default=None)
+
+
+class PipelineEventLog:
+    """追加写入的 JSONL 事件日志（线程安全，path 为空时不写入）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def begin(self, **fields) -> dict:
+        """
+        开始记录当前上下文中的一次生成任务，返回事件 dict（流程中用 annotate() 补充字段）
+
+        线程池中的流程需要用 contextvars.copy_context() 运行才能补充到同一个事件
+        """
+        event = {'event': 'job', **fields}
+        _current_event.set(event)
+        return event
+
+    @staticmethod
+    def annotate(**fields):
+        """给当前上下文的事件补充字段（不在任务中时忽略）"""
+        event = _current_event.get()
+        if event is not None:
+            event.update(fields)
+
+    def write(self, event: dict):
+        """追加一行事件（写入失败只打印警告，不影响生成流程）"""
+        if not self.enabled:
+            return
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"⚠️ 写入流程事件日志失败: {e}")
+
+
+# 全局实例
+pipeline_events = PipelineEventLog(config.PIPELINE_EVENT_LOG)
@@ -0,0 +1,226 @@
+"""
+提示词 → 图片缓存
+按 (规范化提示词, 模型, 尺寸, 宽高比) 的哈希把生成结果保存在磁盘上，
+相同的提示词再次出现时直接返回已生成的图片，不再调用上游接口
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from prompt_normalizer import canonical_prompt
+
+
+class PromptImageCache:
+    """磁盘缓存（LRU + TTL 淘汰，线程安全）"""
+
+    def __init__(self, cache_dir: str, max_entries: int = 500, max_bytes: int = 500 * 1024 * 1024,
+                 ttl_seconds: float = 0, hit_policy: str = 'always', recent_seconds: float = 1800,
+                 enabled: bool = True):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_entries: 最多缓存的图片数量
+            max_bytes: 缓存总大小上限（字节）
+            ttl_seconds: 缓存过期时间（秒），0 表示不过期
+            hit_policy: 命中策略，"always" 总是命中；"recent" 只命中 recent_seconds 内生成的图片
+            recent_seconds: hit_policy="recent" 时的有效时间（秒）
+            enabled: 是否启用缓存
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hit_policy = hit_policy
+        self.recent_seconds = recent_seconds
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # key -> {"size", "created_at"}，按最近访问顺序排列（最旧的在前）
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        # 写入缓存在后台线程中完成，不占用生成流程的时间
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prompt-cache')
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def make_key(prompt: str, model: str, size: str = '', aspect_ratio: str = '') -> str:
+        """生成缓存键（内容寻址：相同输入得到相同的键）"""
+        raw = json.dumps([canonical_prompt(prompt), model, size, aspect_ratio], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _image_path(self, key: str) -> str:
+        # 内容可能是 PNG，也可能是上游原始格式（JPEG 等），PIL 按文件内容识别格式
+        return os.path.join(self.cache_dir, f"{key}.img")
+
+    def _temp_path(self, key: str) -> str:
+        return f"{self._image_path(key)}.{uuid.uuid4().hex[:8]}.tmp"
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        """启动时扫描缓存目录，按文件访问时间重建 LRU 顺序"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            key = filename[:-5]
+            try:
+                with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                stat = os.stat(self._image_path(key))
+            except (OSError, ValueError):
+                continue
+            entries.append((stat.st_mtime, key, stat.st_size, meta.get('created_at', stat.st_mtime)))
+        for _, key, size, created_at in sorted(entries):
+            self._index[key] = {'size': size, 'created_at': created_at}
+            self._total_bytes += size
+        if entries:
+            print(f"🗂️ 提示词图片缓存: 已加载 {len(entries)} 条")
+
+    def _remove(self, key: str):
+        """删除一条缓存（调用方需持有锁）"""
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry['size']
+        for path in (self._image_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        """按 TTL 和容量上限淘汰（调用方需持有锁）"""
+        if self.ttl_seconds:
+            deadline = time.time() - self.ttl_seconds
+            for key in [k for k, e in self._index.items() if e['created_at'] < deadline]:
+                self._remove(key)
+                self.evictions += 1
+        while self._index and (len(self._index) > self.max_entries or self._total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._index))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def get(self, key: str):
+        """
+        查询缓存
+
+        Returns:
+            PIL.Image: 缓存的图片，未命中返回None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._index.get(key)
+            now = time.time()
+            if entry is None:
+                self.misses += 1
+                return None
+            age = now - entry['created_at']
+            if (self.ttl_seconds and age > self.ttl_seconds) or \
+                    (self.hit_policy == 'recent' and age > self.recent_seconds):
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+
+        try:
+            image = Image.open(self._image_path(key))
+            image.load()
+            # 更新文件时间，重启后仍能恢复 LRU 顺序
+            os.utime(self._image_path(key), None)
+        except OSError as e:
+            print(f"⚠️ 读取缓存图片失败: {e}")
+            with self._lock:
+                self._remove(key)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return image
+
+    def put(self, key: str, image: Image.Image, meta: dict = None):
+        """写入缓存（同步，图片编码为 PNG）"""
+        if not self.enabled:
+            return
+        temp_path = self._temp_path(key)
+        try:
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(temp_path, format='PNG')
+        except Exception as e:
+            print(f"⚠️ 写入提示词图片缓存失败: {e}")
+            return
+        self._commit(key, temp_path, meta)
+
+    def _commit(self, key: str, temp_path: str, meta: dict = None):
+        """把已写好的临时文件放入缓存并更新索引"""
+        try:
+            image_path = self._image_path(key)
+            os.replace(temp_path, image_path)
+            created_at = time.time()
+            with open(self._meta_path(key), 'w', encoding='utf-8') as f:
+                json.dump(dict(meta or {}, created_at=created_at), f, ensure_ascii=False)
+            size = os.path.getsize(image_path)
+        except Exception as e:
+            print(f"⚠️ 写入提示词图片缓存失败: {e}")
+            return
+
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old['size']
+            self._index[key] = {'size': size, 'created_at': created_at}
+            self._total_bytes += size
+            self._evict()
+
+    def put_async(self, key: str, image: Image.Image, meta: dict = None):
+        """在后台线程中写入缓存"""
+        if not self.enabled:
+            return
+        source = getattr(image, 'filename', '')
+        if source and os.path.exists(source):
+            # 从文件打开的图片（如流式下载的结果）：直接复制原始字节，不解码也不重新编码；
+            # 复制在当前线程完成，避免源文件在后台写入之前被删除
+            temp_path = self._temp_path(key)
+            try:
+                shutil.copyfile(source, temp_path)
+            except OSError as e:
+                print(f"⚠️ 写入提示词图片缓存失败: {e}")
+                return
+            self._executor.submit(self._commit, key, temp_path, meta)
+        else:
+            self._executor.submit(self.put, key, image.copy(), meta)
+
+    def stats(self) -> dict:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._index),
+            'bytes': self._total_bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hit_policy': self.hit_policy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
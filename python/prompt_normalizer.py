@@ -0,0 +1,137 @@
+"""
+提示词规范化
+语音识别结果常常混有繁体字、客套话和标点（如"生成一張…的圖片。"、"请帮我画一个…"），
+这里把它们折叠成统一形式：
+- clean_prompt：繁转简、去掉开头的语气词和首尾标点，作为发送给上游的提示词
+- canonical_prompt：在 clean_prompt 基础上去掉请求套话、全部标点和空白，作为缓存键
+
+全部基于预先构建的转换表和预编译的正则表达式，每次请求只做几次线性扫描
+"""
+import re
+import unicodedata
+
+
+# 常用繁体 → 简体对照（每项两个字：繁体 + 简体）
+_TRAD_SIMP_PAIRS = """
+張张 圖图 畫画 個个 隻只 貓猫 龍龙 藍蓝 綠绿 紅红 黃黄 顏颜 飛飞 機机 車车 馬马 鳥鸟 魚鱼
+雞鸡 鴨鸭 鵝鹅 豬猪 蟲虫 獅狮 貝贝 殼壳 龜龟 鯨鲸 鯊鲨 島岛 雲云 風风 電电 陽阳 陰阴 燈灯
+樹树 葉叶 華华 園园 開开 關关 門门 間间 問问 聽听 說说 話话 語语 讀读 寫写 書书 學学 習习
+幫帮 請请 給给 讓让 謝谢 對对 們们 這这 裡里 裏里 來来 時时 後后 會会 為为 與与 還还 過过
+邊边 遠远 進进 運运 動动 場场 東东 樂乐 愛爱 媽妈 爺爷 孫孙 兒儿 國国 見见 長长 頭头 臉脸
+髮发 發发 體体 隊队 員员 點点 麗丽 濕湿 滿满 鐘钟 錶表 雙双 戰战 艦舰 槍枪 劍剑 寶宝 貴贵
+實实 傳传 鄉乡 戲戏 廳厅 廣广 廟庙 鋼钢 鐵铁 銀银 號号 專专 級级 線线 紙纸 筆笔 幾几 變变
+彎弯 灣湾 總总 聰聪 穩稳 態态 氣气 溫温 熱热 凍冻 燒烧 煙烟 塊块 壞坏 擁拥 無无 夢梦 歡欢
+戀恋 驚惊 嚇吓 懼惧 憂忧 舊旧 處处 術术 藝艺 繪绘 攝摄 剛刚 強强 藥药 醫医 護护 極极 輪轮
+軌轨 輛辆 橋桥 樓楼 層层 廚厨 飯饭 麵面 餅饼 蘋苹 蔥葱 蘿萝 蔔卜 湯汤 飲饮 買买 賣卖 錢钱
+貨货 興兴 舉举 農农 業业 產产 種种 蘭兰 鳳凤 獨独 獸兽 騎骑 駕驾 駱骆 駝驼 鵬鹏 鷹鹰 鶴鹤
+鴿鸽 鸚鹦 鵡鹉 蝦虾 螞蚂 蟻蚁 蝸蜗 獵猎 鬆松 鬧闹 鬥斗 劇剧 聲声 響响 靜静 曬晒 閃闪 爍烁
+燦灿 爛烂 漸渐 觀观 覽览 視视 現现 顯显 際际 陸陆 險险 隨随 隱隐 雜杂 難难 離离 雖虽 萬万
+億亿 參参 歲岁 歷历 歸归 師师 帥帅 帶带 幣币 幹干 庫库 應应 復复 徑径 從从 徵征 憶忆 懸悬
+戶户 擇择 擊击 擋挡 據据 擬拟 擴扩 擺摆 敗败 敵敌 數数 斷断 晝昼 暫暂 曆历 曉晓 樣样 標标
+橫横 檢检 權权 歐欧 殺杀 殘残 決决 沒没 淚泪 淺浅 減减 測测 濃浓 灑洒 灘滩 災灾 烏乌 煉炼
+爐炉 牆墙 狀状 猶犹 獎奖 環环 瑪玛 畢毕 當当 療疗 盡尽 監监 盤盘 礦矿 確确 禮礼 禍祸 稱称
+穀谷 窮穷 競竞 範范 築筑 簡简 籃篮 類类 糧粮 紀纪 約约 紋纹 純纯 細细 終终 組组 結结 絕绝
+統统 絲丝 經经 綁绑 維维 網网 緊紧 編编 練练 績绩 縣县 繩绳 織织 罰罚 羅罗 義义 聖圣 聯联
+職职 脫脱 腦脑 腳脚 膽胆 臨临 艱艰 莊庄 蓋盖 蘇苏 衛卫 衝冲 補补 裝装 製制 複复 親亲 覺觉
+訂订 計计 記记 許许 設设 證证 評评 詞词 試试 詩诗 誕诞 認认 誤误 課课 調调 談谈 豐丰 負负
+財财 貼贴 費费 資资 賽赛 贏赢 趕赶 跡迹 躍跃 軍军 軟软 載载 較较 輕轻 輸输 轉转 辦办 迴回
+連连 週周 遊游 達达 違违 遙遥 適适 遲迟 選选 遺遗 鄰邻 醜丑 釘钉 針针 釣钓 錄录 錯错 鍋锅
+鏡镜 鑽钻 閱阅 闊阔 階阶 靈灵 頁页 項项 順顺 須须 預预 領领 題题 額额 飄飘 飽饱 養养 館馆
+驗验 髒脏 鬍胡 鮮鲜 鳴鸣 麥麦 齊齐 齒齿 堅坚 執执 報报 壓压 夠够 奪夺 奮奋 婦妇 寧宁 將将
+尋寻 屬属 嶺岭 巖岩 廢废 彈弹 徹彻 惡恶 慣惯 慶庆 憑凭 懷怀 拋抛 揚扬 換换 損损 搖摇 搶抢
+撐撑 擔担 擠挤 攤摊 斬斩 暈晕 構构 槳桨 櫃柜 欄栏 沖冲 況况 湧涌 滅灭 滾滚 漁渔 潔洁 潛潜
+澤泽 濤涛 濱滨 燭烛 營营 爭争 犧牺 獻献 異异 癢痒 皺皱 盜盗 眾众 睜睁 碼码 磚砖 祕秘 窩窝
+筍笋 箏筝 節节 簾帘 籠笼 緣缘 縮缩 繡绣 纏缠 羨羡 翹翘 膚肤 蘆芦 蠟蜡 蠶蚕 襪袜 規规 觸触
+譜谱 讚赞 豎竖 賓宾 賞赏 質质 蹤踪 輩辈 轟轰 郵邮 醬酱 鈴铃 銅铜 鋪铺 錦锦 鍵键 鎖锁 鏈链
+鑰钥 閒闲 閣阁 陣阵 陳陈 雛雏 霧雾 頂顶 頸颈 顆颗 顧顾 餃饺 餘余 餵喂 騰腾 驢驴 鯉鲤 鴉鸦
+鵲鹊 鶯莺 冊册 劃划 勝胜 勞劳 勢势 區区 協协 卻却 廠厂 嚴严 團团 圍围 塵尘 壯壮 壺壶 夾夹
+妝妆 嬰婴 審审 寵宠 寬宽 帳帐 憐怜 攜携 暢畅 棟栋 楊杨 榮荣 檯台 臺台 颱台 櫻樱 毀毁 溝沟
+漢汉 澆浇 燙烫 爾尔 牽牵 疊叠 癡痴 盞盏 禱祷 窯窑 簽签 籤签 紗纱 絨绒 綿绵 縫缝 繽缤 纖纤
+聞闻 膠胶 蒼苍 蓮莲 薑姜 虛虚 螢萤 蠍蝎 褲裤 襯衬 詢询 誰谁 諾诺 貧贫 賀贺 購购 贈赠 輝辉
+轎轿 辮辫 遞递 邏逻 釋释 鏟铲 闖闯 鞦秋 韆千 颳刮 飼饲 餓饿 饅馒 驅驱 驕骄 髏髅 鱷鳄
+鴕鸵 鴛鸳 鴦鸯 鵰雕 鷺鹭 麼么 齡龄 嗎吗 嘆叹 嘗尝 噴喷 單单 啞哑 啟启 務务 傘伞 備备 傑杰
+僅仅 價价 儀仪 優优 兇凶 內内 兩两 凱凯 則则 劑剂 亞亚 侶侣 係系 俠侠 倆俩 倉仓 偉伟 側侧
+傷伤 傾倾 儘尽
+"""
+
+_TRAD_TO_SIMP = str.maketrans({pair[0]: pair[1] for pair in _TRAD_SIMP_PAIRS.split()})
+
+# 开头的口头语气词（"嗯，那个，画一只猫"）
+_LEADING_FILLER_RE = re.compile(r'^(?:(?:嗯+|呃+|额+|啊+|哦+|那个|就是|然后)[\s，,、。.!！?？~～…]*)+')
+
+# 首尾标点和空白
+_EDGE_PUNCT_RE = re.compile(r'^[\W_]+|[\W_]+$')
+
+# 连续空白
+_SPACE_RE = re.compile(r'\s+')
+
+# 全部标点和空白（\W 不包含汉字，汉字会保留）
+_PUNCT_RE = re.compile(r'[\W_]+')
+
+# 请求套话前缀的组成部分
+_POLITE = r'(?:请你?|麻烦你?)'
+_ASK = r'(?:能不能|可以)'
+_WANT = r'(?:我想要|我想看|我要|我想|想要)'
+_HELP = r'(?:帮我|给我|为我|替我|帮忙)'
+_VERB = r'(?:画出|画|生成|绘制|制作|创作|设计|做|来|出)'
+_MEASURE = r'(?:一(?:张|幅|个|只|副|份|条|头|匹|位|辆|棵|朵|座|艘|架))'
+
+# 请求套话前缀："请帮我画一个…"、"我想要一张…"、"生成一幅…"
+# 动词和"可以"本身也是常见的词首（设计师、画家、出租车、来自…、做饭…、可以飞的车），
+# 只在以"请/麻烦"或"帮我/给我"开头、或者后面跟着量词时才当作套话去掉
+_REQUEST_PREFIX_RE = re.compile(
+    rf'^(?:'
+    rf'{_POLITE}(?={_ASK}|{_WANT}|{_HELP}|{_VERB}|{_MEASURE}){_ASK}?{_WANT}?{_HELP}?{_VERB}?(?:一下)?{_MEASURE}?'
+    rf'|{_ASK}?{_WANT}?{_HELP}{_VERB}?(?:一下)?{_MEASURE}?'
+    rf'|{_ASK}?{_WANT}?{_VERB}?(?:一下)?{_MEASURE}'
+    rf')'
+)
+
+# 请求套话后缀："…的图片"、"…的画吧"、"…谢谢"（不带"的"的"照片"等是词的一部分，如"老照片"，不去掉）
+_REQUEST_SUFFIX_RE = re.compile(
+    r'(?:的(?:图片|图画|图像|照片|画面|画|图))?'
+    r'(?:吧|呀|啊|哦|呢|了|好吗|可以吗|好不好|吗)?'
+    r'(?:谢谢你?|谢啦)?$'
+)
+
+
+def to_simplified(text: str) -> str:
+    """繁体 → 简体（逐字查表）"""
+    return text.translate(_TRAD_TO_SIMP)
+
+
+def clean_prompt(text: str) -> str:
+    """
+    清理语音识别得到的提示词（发送给上游接口）
+
+    全角转半角、繁转简、去掉开头的语气词和首尾标点，保留句子本身的意思和措辞
+
+    Args:
+        text: 语音识别结果
+
+    Returns:
+        str: 清理后的提示词，清理后为空时返回去掉首尾空白的原文
+    """
+    original = (text or '').strip()
+    text = unicodedata.normalize('NFKC', original).translate(_TRAD_TO_SIMP)
+    text = _SPACE_RE.sub(' ', text)
+    text = _LEADING_FILLER_RE.sub('', text)
+    text = _EDGE_PUNCT_RE.sub('', text)
+    return text or original
+
+
+def canonical_prompt(text: str) -> str:
+    """
+    生成提示词的规范形式（用于缓存键）
+
+    "生成一張黑色小狗和老奶奶散步的圖片。" 和 "黑色小狗和老奶奶散步" 得到相同结果
+
+    Args:
+        text: 原始或已清理的提示词
+
+    Returns:
+        str: 规范形式，去掉套话后为空时返回去掉标点的清理结果
+    """
+    text = _PUNCT_RE.sub('', clean_prompt(text)).lower()
+    core = _REQUEST_SUFFIX_RE.sub('', _REQUEST_PREFIX_RE.sub('', text, count=1), count=1)
+    return core or text
@@ -0,0 +1,168 @@
+"""
+显示尺寸图片（预生成的缩小版本）
+上游返回的原图（如 2304×1728）远大于实际显示尺寸（约 900×900），每次更新都把原图发给浏览器，
+传输和解码都浪费。保存记录时按 config.RENDITION_SIZES 规划几档长边尺寸的缩小版本（只读取原图文件头），
+由 HistoryManager 在后台线程池中生成，和原图放在同一目录：
+    1700000000000.jpg  →  1700000000000_960.webp、1700000000000_1440.webp
+显示时按显示区域选择不小于所需尺寸的最小一档，没有合适的版本（或还没生成）时使用原图
+"""
+import os
+from PIL import Image
+import config
+
+# 配置的格式名 -> (PIL 格式, 扩展名)
+_FORMATS = {
+    'webp': ('WEBP', '.webp'),
+    'jpeg': ('JPEG', '.jpg'),
+    'jpg': ('JPEG', '.jpg'),
+}
+
+
+def parse_sizes(value: str) -> list:
+    """解析逗号分隔的长边尺寸列表（如 "960,1440"），返回从小到大排好序的整数列表"""
+    sizes = set()
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            size = int(item)
+        except ValueError:
+            print(f"⚠️ 忽略无效的显示尺寸: {item}")
+            continue
+        if size > 0:
+            sizes.add(size)
+    return sorted(sizes)
+
+
+def rendition_extension() -> str:
+    """按 config.RENDITION_FORMAT 得到的文件扩展名"""
+    return _FORMATS.get(config.RENDITION_FORMAT.lower(), _FORMATS['webp'])[1]
+
+
+def to_display_mode(image: Image.Image) -> Image.Image:
+    """转换为适合缩放和编码的颜色模式（有透明通道且输出 WebP 时为 RGBA，否则为 RGB）"""
+    pil_format = _FORMATS.get(config.RENDITION_FORMAT.lower(), _FORMATS['webp'])[0]
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    mode = 'RGBA' if has_alpha and pil_format == 'WEBP' else 'RGB'
+    return image if image.mode == mode else image.convert(mode)
+
+
+def save_rendition(image: Image.Image, path: str):
+    """
+    按 config.RENDITION_FORMAT / RENDITION_QUALITY 编码并保存
+    （先写临时文件再替换；临时文件名带进程号，7860/7861 同时生成同一文件时互不干扰）
+    """
+    pil_format = _FORMATS.get(config.RENDITION_FORMAT.lower(), _FORMATS['webp'])[0]
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    if pil_format == 'JPEG':
+        image.save(temp_path, format=pil_format, quality=config.RENDITION_QUALITY, optimize=True)
+    else:
+        image.save(temp_path, format=pil_format, quality=config.RENDITION_QUALITY)
+    os.replace(temp_path, path)
+
+
+def _scaled_size(size: tuple, long_edge: int) -> tuple:
+    """按长边等比缩放后的尺寸"""
+    width, height = size
+    scale = long_edge / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def plan_renditions(image_path: str, sizes: list = None) -> tuple:
+    """
+    规划原图的缩小版本（只读取文件头，不解码也不生成文件）
+
+    Args:
+        image_path: 原图路径
+        sizes: 长边尺寸列表，默认 config.RENDITION_SIZES
+
+    Returns:
+        (list, dict): 原图尺寸 [宽, 高] 和 {"长边尺寸": 文件路径}（只包含比原图小的尺寸）
+    """
+    sizes = parse_sizes(config.RENDITION_SIZES) if sizes is None else sorted(sizes)
+    extension = rendition_extension()
+    stem = os.path.splitext(image_path)[0]
+    with Image.open(image_path) as image:
+        original_size = list(image.size)
+    renditions = {str(size): f"{stem}_{size}{extension}" for size in sizes if size < max(original_size)}
+    return original_size, renditions
+
+
+def generate_renditions(image_path: str, sizes: list = None) -> tuple:
+    """
+    为原图生成显示尺寸的缩小版本（只生成比原图小的尺寸）
+
+    大尺寸先从原图缩小，小尺寸再从上一档结果缩小；JPEG 原图用 draft 让解码器直接按 1/2、1/4 解码，
+    缩放使用 LANCZOS 重采样，画质与一次性从原图缩小基本一致
+
+    Args:
+        image_path: 原图路径
+        sizes: 长边尺寸列表，默认 config.RENDITION_SIZES
+
+    Returns:
+        (list, dict): 原图尺寸 [宽, 高] 和 {"长边尺寸": 文件路径}
+    """
+    sizes = parse_sizes(config.RENDITION_SIZES) if sizes is None else sorted(sizes)
+    extension = rendition_extension()
+    stem = os.path.splitext(image_path)[0]
+    renditions = {}
+
+    with Image.open(image_path) as image:
+        original_size = list(image.size)
+        sizes = [size for size in sizes if size < max(image.size)]
+        if not sizes:
+            return original_size, renditions
+
+        image.draft('RGB', _scaled_size(image.size, sizes[-1]))
+        current = to_display_mode(image)
+
+        for size in reversed(sizes):
+            current = current.resize(_scaled_size(original_size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            path = f"{stem}_{size}{extension}"
+            save_rendition(current, path)
+            renditions[str(size)] = path
+
+    return original_size, renditions
+
+
+def select_rendition(record: dict, box_width: int, box_height: int) -> str:
+    """
+    选择适合显示区域的图片文件
+
+    Args:
+        record: 历史记录（renditions、image_size 字段由 generate_renditions 生成，旧记录没有）
+        box_width: 显示区域宽度（像素）
+        box_height: 显示区域高度（像素）
+
+    Returns:
+        str: 不小于所需尺寸的最小一档缩小版本路径，没有合适的版本时返回原图路径
+    """
+    renditions = record.get('renditions') or {}
+    if not renditions:
+        return record['image_path']
+
+    original_size = record.get('image_size')
+    if original_size:
+        # 图片按比例缩放到显示区域内时实际显示的长边长度
+        scale = min(box_width / original_size[0], box_height / original_size[1], 1.0)
+        needed = max(original_size) * scale
+    else:
+        needed = max(box_width, box_height)
+
+    for size in sorted(int(size) for size in renditions):
+        if size >= needed:
+            path = renditions[str(size)]
+            if os.path.exists(path):
+                return path
+    return record['image_path']
+
+
+def smallest_rendition(record: dict) -> str:
+    """记录中最小一档缩小版本的路径（用于生成更小的缩略图），没有时返回原图路径"""
+    renditions = record.get('renditions') or {}
+    for size in sorted(int(size) for size in renditions):
+        path = renditions[str(size)]
+        if os.path.exists(path):
+            return path
+    return record['image_path']
@@ -0,0 +1,94 @@
+"""
+文生图响应格式选择
+- url：接口返回图片地址，需要再从 CDN 下载一次（多一次往返）
+- b64_json：图片直接随接口响应返回（响应体大约大 1/3，但省掉一次往返）
+
+auto 模式下分别记录两种格式最近 N 次"拿到图片字节"的耗时
+（url：CDN 下载耗时；b64_json：接口响应头到达后读取并解码响应体的耗时），选择平均更快的一种
+"""
+import threading
+from collections import deque
+
+
+class ResponseFormatSelector:
+    """响应格式选择器（线程安全）"""
+
+    FORMATS = ('url', 'b64_json')
+
+    def __init__(self, mode: str = 'auto', window: int = 10, min_samples: int = 3, explore_every: int = 20):
+        """
+        Args:
+            mode: "url"、"b64_json" 或 "auto"
+            window: auto 模式下参与比较的最近耗时样本数
+            min_samples: 每种格式至少采集的样本数，不足时优先尝试该格式
+            explore_every: 每隔多少次请求改用另一种格式一次，刷新它的耗时样本
+        """
+        if mode not in self.FORMATS and mode != 'auto':
+            print(f"⚠️ 未知的响应格式: {mode}，使用 auto")
+            mode = 'auto'
+        self.mode = mode
+        self.min_samples = min_samples
+        self.explore_every = explore_every
+        self._lock = threading.Lock()
+        self._samples = {fmt: deque(maxlen=window) for fmt in self.FORMATS}
+        self._chosen = {fmt: 0 for fmt in self.FORMATS}
+        self._requests = 0
+
+        # 按选择时两种格式的平均耗时差累计的节省时间（秒）
+        self.estimated_saving = 0.0
+
+    def _average(self, fmt: str) -> float:
+        samples = self._samples[fmt]
+        return sum(samples) / len(samples) if samples else None
+
+    def choose(self) -> str:
+        """选择本次请求使用的响应格式"""
+        with self._lock:
+            self._requests += 1
+            if self.mode != 'auto':
+                choice = self.mode
+            else:
+                lacking = [fmt for fmt in self.FORMATS if len(self._samples[fmt]) < self.min_samples]
+                if lacking:
+                    choice = min(lacking, key=lambda fmt: len(self._samples[fmt]))
+                else:
+                    averages = {fmt: self._average(fmt) for fmt in self.FORMATS}
+                    fastest = min(self.FORMATS, key=averages.get)
+                    slowest = max(self.FORMATS, key=averages.get)
+                    if self.explore_every and self._requests % self.explore_every == 0:
+                        choice = slowest
+                    else:
+                        choice = fastest
+                        self.estimated_saving += averages[slowest] - averages[fastest]
+            self._chosen[choice] += 1
+            return choice
+
+    def record(self, fmt: str, seconds: float):
+        """记录一次获取图片字节的耗时"""
+        if fmt not in self._samples:
+            return
+        with self._lock:
+            self._samples[fmt].append(seconds)
+
+    def stats(self) -> dict:
+        """获取选择情况和各格式的平均耗时"""
+        with self._lock:
+            formats = {
+                fmt: {
+                    'chosen': self._chosen[fmt],
+                    'samples': len(self._samples[fmt]),
+                    'avg_seconds': self._average(fmt),
+                }
+                for fmt in self.FORMATS
+            }
+            averages = {fmt: info['avg_seconds'] for fmt, info in formats.items()}
+            if None in averages.values():
+                preferred = None
+            else:
+                preferred = min(self.FORMATS, key=averages.get)
+            return {
+                'mode': self.mode,
+                'preferred': preferred,
+                'formats': formats,
+                'estimated_saving_seconds': self.estimated_saving,
+            }
@@ -0,0 +1,316 @@
+"""
+语义近似提示词缓存
+把提示词（规范化后）表示为哈希字符 n-gram 向量，在历史记录中查找最相似的提示词，
+相似度超过阈值时直接复用那条记录的图片（"黑色小狗和老奶奶散步" ≈ "老奶奶遛黑色小狗"）
+
+字符 n-gram 分不清"红色的车"和"蓝色的车"、"在马路上行驶"和"没有在马路上行驶"，
+所以命中还要求两个提示词的内容字（去掉虚词后的字集合）完全相同：颜色、大小、数量、否定词
+任何一处不同都不复用，只有语序、虚词和同义词的差别可以复用
+
+向量是稀疏的（一个提示词只有几十个 n-gram）：
+- 双字 n-gram 建倒排表（每个哈希桶对应一组行号），查询时只统计与查询共享双字的行，选出候选
+- 候选按完整向量（单字 + 双字）计算余弦相似度重新排序
+单字出现得太频繁（"的"、"一"），不参与倒排，10 万条记录时查询仍在亚毫秒级
+"""
+import threading
+import zlib
+from prompt_normalizer import canonical_prompt
+
+# 尝试导入 NumPy（可选）
+try:
+    import numpy as np
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+    print("⚠️ numpy 未安装，语义近似缓存不可用")
+
+
+# 只影响措辞、不影响画面内容的字（比较内容字时忽略）
+_FUNCTION_CHARS = frozenset('的地得和与跟同及并在正着了是把被将个只张幅')
+
+# 同义词（左边折叠为右边，较长的在前）："老奶奶遛小狗" ≈ "小狗和老奶奶散步"
+_SYNONYMS = (
+    ('狗狗', '狗'),
+    ('猫咪', '猫'),
+    ('汽车', '车'),
+    ('遛', '散步'),
+)
+
+
+def normalize_prompt(text: str) -> str:
+    """规范化提示词（canonical_prompt + 同义词折叠）"""
+    text = canonical_prompt(text)
+    for source, target in _SYNONYMS:
+        text = text.replace(source, target)
+    return text
+
+
+def content_key(text: str) -> str:
+    """
+    提示词的内容字：去掉虚词后的字集合，排序后拼成字符串
+
+    Args:
+        text: 规范化后的提示词
+
+    Returns:
+        str: 内容字相同的两个提示词返回相同的字符串
+    """
+    return ''.join(sorted(set(text) - _FUNCTION_CHARS))
+
+
+def prompt_features(text: str, buckets: int = 1 << 20) -> tuple:
+    """
+    提取提示词的哈希字符 n-gram 特征（单字 + 双字），并做 L2 归一化
+
+    Args:
+        text: 提示词
+        buckets: 哈希桶数量
+
+    Returns:
+        (np.ndarray, np.ndarray, list, str): 排好序的桶编号、对应权重、用于倒排的桶编号
+            （有双字时为全部双字，只有一个字时为该单字）、内容字（见 content_key）
+    """
+    text = normalize_prompt(text)
+    counts = {}
+    index_keys = []
+    for n in (1, 2):
+        for i in range(len(text) - n + 1):
+            bucket = zlib.crc32(text[i:i + n].encode('utf-8')) % buckets
+            counts[bucket] = counts.get(bucket, 0.0) + 1.0
+            if n == 2 or len(text) == 1:
+                index_keys.append(bucket)
+    keys = np.array(sorted(counts), dtype=np.int64)
+    weights = np.array([counts[key] for key in keys.tolist()], dtype=np.float32)
+    norm = float(np.sqrt(np.dot(weights, weights)))
+    if norm:
+        weights /= norm
+    return keys, weights, list(set(index_keys)), content_key(text)
+
+
+class _GrowableArray:
+    """可增量追加的 NumPy 数组（容量不足时翻倍扩容）"""
+
+    def __init__(self, dtype, capacity: int = 1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def _reserve(self, size: int):
+        if size > len(self.data):
+            capacity = max(size, len(self.data) * 2)
+            data = np.empty(capacity, dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self, value):
+        self._reserve(self.size + 1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self, values):
+        self._reserve(self.size + len(values))
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class PromptVectorIndex:
+    """提示词向量索引（支持增量添加，线程安全）"""
+
+    def __init__(self, threshold: float = 0.8, max_candidates: int = 64, max_entries: int = 0):
+        """
+        Args:
+            threshold: 余弦相似度阈值，达到该值才视为命中
+            max_candidates: 倒排表召回后参与重新排序的最多候选数
+            max_entries: 最多保留的记录数（与 MAX_HISTORY 一致，超出时淘汰最早添加的记录），0 表示不限制
+        """
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self.clear()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        # 相似度达到阈值但内容字不同而没有复用的次数
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    def clear(self):
+        with self._lock:
+            # 行号 -> 记录（只保存 id、text、image_path 和内容字）
+            self._records = []
+            self._rows_by_id = {}
+            # 行号是否有效（失效的记录不从倒排表中移除，失效行过多时整体重建）
+            self._alive = _GrowableArray(bool)
+            self._live = 0
+            # 最早的可能仍有效的行号（超出 max_entries 时从这里开始淘汰）
+            self._oldest = 0
+            # 所有行的稀疏向量首尾相接保存，第 i 行位于 offsets[i]:offsets[i + 1]
+            self._feature_keys = _GrowableArray(np.int64, 16384)
+            self._feature_weights = _GrowableArray(np.float32, 16384)
+            self._offsets = _GrowableArray(np.int64)
+            self._offsets.append(0)
+            # 桶编号 -> 行号数组
+            self._postings = {}
+
+    def add(self, record: dict):
+        """添加一条历史记录（超出 max_entries 时淘汰最早的记录，与历史记录的裁剪保持一致）"""
+        features = prompt_features(record.get('text', ''))
+        with self._lock:
+            self._append(record, features)
+            self._evict()
+
+    def _append(self, record: dict, features: tuple):
+        """追加一行（调用方需持有锁）"""
+        keys, weights, index_keys, content = features
+        if not len(keys):
+            return
+        # 相同ID重复添加时，旧的一行失效
+        self._discard_row(self._rows_by_id.get(record['id']))
+        row = len(self._records)
+        self._records.append({
+            'id': record['id'],
+            'text': record.get('text', ''),
+            'image_path': record.get('image_path', ''),
+            'content': content,
+        })
+        self._rows_by_id[record['id']] = row
+        self._alive.append(True)
+        self._live += 1
+        self._feature_keys.extend(keys)
+        self._feature_weights.extend(weights)
+        self._offsets.append(self._feature_keys.size)
+        for key in index_keys:
+            posting = self._postings.get(key)
+            if posting is None:
+                posting = self._postings[key] = _GrowableArray(np.int32, 4)
+            posting.append(row)
+
+    def _discard_row(self, row):
+        """标记一行失效（调用方需持有锁）"""
+        if row is None or not self._alive.data[row]:
+            return
+        self._alive.data[row] = False
+        self._live -= 1
+        record_id = self._records[row]['id']
+        if self._rows_by_id.get(record_id) == row:
+            del self._rows_by_id[record_id]
+
+    def _evict(self):
+        """淘汰超出 max_entries 的最早记录；失效行多于有效行时重建，释放倒排表和向量占用的内存（调用方需持有锁）"""
+        while self.max_entries and self._live > self.max_entries:
+            self._discard_row(self._oldest)
+            self._oldest += 1
+        if len(self._records) - self._live > max(self._live, 1024):
+            alive = self._alive.view()
+            self.rebuild([record for row, record in enumerate(self._records) if alive[row]])
+
+    def rebuild(self, records: list):
+        """用给定的记录列表重建索引"""
+        with self._lock:
+            self.clear()
+            for record in records:
+                self._append(record, prompt_features(record.get('text', '')))
+            self._evict()
+
+    def discard(self, record_id: int):
+        """标记记录失效（如图片文件已不存在）"""
+        with self._lock:
+            self._discard_row(self._rows_by_id.get(record_id))
+
+    def _score(self, keys, weights, index_keys) -> tuple:
+        """
+        召回并计算候选行与查询向量的余弦相似度（调用方需持有锁）
+
+        Returns:
+            (np.ndarray, np.ndarray): 候选行号和对应的相似度，没有候选时为两个空数组
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        parts = [self._postings[key].view() for key in index_keys if key in self._postings]
+        if not len(keys) or not parts:
+            return empty
+
+        # 召回：与查询共享双字最多的若干行
+        candidates, shared = np.unique(np.concatenate(parts), return_counts=True)
+        alive = self._alive.view()[candidates]
+        candidates, shared = candidates[alive], shared[alive]
+        if not len(candidates):
+            return empty
+        if len(candidates) > self.max_candidates:
+            top = np.argpartition(-shared, self.max_candidates)[:self.max_candidates]
+            candidates = candidates[top]
+
+        # 重新排序：取出候选行的稀疏向量，与查询向量做点积（两边都已归一化，结果即余弦相似度）
+        offsets = self._offsets.view()
+        starts = offsets[candidates]
+        lengths = offsets[candidates + 1] - starts
+        segment_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        gather = np.arange(int(lengths.sum())) + np.repeat(starts - segment_starts, lengths)
+        row_keys = self._feature_keys.data[gather]
+        row_weights = self._feature_weights.data[gather]
+        position = np.minimum(np.searchsorted(keys, row_keys), len(keys) - 1)
+        products = np.where(keys[position] == row_keys, weights[position] * row_weights, 0.0)
+        return candidates, np.add.reduceat(products, segment_starts)
+
+    def search(self, text: str) -> tuple:
+        """
+        查找最相似的历史提示词（只按相似度，不检查内容字）
+
+        Args:
+            text: 提示词
+
+        Returns:
+            (dict, float): 最相似的记录和余弦相似度，没有候选时返回 (None, 0.0)
+        """
+        keys, weights, index_keys, _ = prompt_features(text)
+        with self._lock:
+            candidates, scores = self._score(keys, weights, index_keys)
+            if not len(candidates):
+                return None, 0.0
+            best = int(np.argmax(scores))
+            return self._records[int(candidates[best])], float(scores[best])
+
+    def lookup(self, text: str) -> dict:
+        """
+        查找可以复用图片的历史记录：相似度达到阈值，并且内容字完全相同
+
+        Returns:
+            dict: 命中的记录（相似度最高的一条），未命中返回None
+        """
+        keys, weights, index_keys, content = prompt_features(text)
+        with self._lock:
+            candidates, scores = self._score(keys, weights, index_keys)
+            record, score, rejected = None, 0.0, False
+            for row, row_score in zip(candidates.tolist(), scores.tolist()):
+                if row_score < self.threshold or row_score <= score:
+                    continue
+                if self._records[row]['content'] != content:
+                    rejected = True
+                    continue
+                record, score = self._records[row], row_score
+            if record is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.rejected += rejected
+        if record is not None:
+            print(f"🧭 语义缓存命中（相似度 {score:.2f}）: {record['text'][:50]}")
+        return record
+
+    def stats(self) -> dict:
+        """获取命中统计"""
+        total = self.hits + self.misses
+        return {
+            'entries': self._live,
+            'buckets': len(self._postings),
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'misses': self.misses,
+            'rejected': self.rejected,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,117 @@
+"""
+单飞合并（single-flight）
+相同键的并发调用只执行一次：第一个调用执行，执行期间到达的其他调用等待并共享结果，
+执行结束后键即释放（之后的调用重新执行，结果复用交给提示词缓存）。
+
+同步线程（Gradio 流程）和 asyncio 协程（VAD 流程）使用同一组 concurrent.futures.Future，
+两种流程之间的重复请求也会合并
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from metrics import metrics
+
+
+class SingleFlight:
+    """按键合并并发调用（线程安全）"""
+
+    def __init__(self, share=None, stage: str = None):
+        """
+        Args:
+            share: 把执行结果复制给每个等待者的函数 share(result) -> result（结果不能共用时使用，
+                   如各自保存到历史记录的下载文件），为None时共用同一个结果
+            stage: 等待者的等待耗时记录到 metrics 的阶段名，为None时不记录
+        """
+        self.share = share
+        self.stage = stage
+        self._lock = threading.Lock()
+        # 键 -> 等待者的 Future 列表（键存在表示正在执行）
+        self._calls = {}
+
+        # 统计信息
+        self.executed = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def _join(self, key: str):
+        """加入调用：返回None表示由当前调用执行，否则返回等待结果的 Future"""
+        with self._lock:
+            waiters = self._calls.get(key)
+            if waiters is None:
+                self._calls[key] = []
+                self.executed += 1
+                return None
+            future = Future()
+            waiters.append(future)
+            self.coalesced += 1
+            return future
+
+    def _deliver(self, key: str, result=None, error: BaseException = None):
+        """释放键，把结果（或异常）交给执行期间到达的所有等待者"""
+        with self._lock:
+            waiters = self._calls.pop(key, [])
+            if error is not None:
+                self.failed += 1
+        for future in waiters:
+            if error is not None:
+                future.set_exception(error)
+                continue
+            try:
+                future.set_result(self.share(result) if self.share else result)
+            except Exception as e:
+                future.set_exception(e)
+
+    def _observe_wait(self, start: float):
+        if self.stage:
+            metrics.observe(self.stage, time.perf_counter() - start)
+
+    def do(self, key: str, fn, *args, **kwargs):
+        """同步调用 fn(*args, **kwargs)，相同键正在执行时等待并返回那次的结果"""
+        start = time.perf_counter()
+        future = self._join(key)
+        if future is not None:
+            try:
+                return future.result()
+            finally:
+                self._observe_wait(start)
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._deliver(key, error=e)
+            raise
+        self._deliver(key, result)
+        return result
+
+    async def do_async(self, key: str, fn, *args, **kwargs):
+        """异步调用 await fn(*args, **kwargs)，相同键正在执行时等待并返回那次的结果"""
+        start = time.perf_counter()
+        future = self._join(key)
+        if future is not None:
+            try:
+                return await asyncio.wrap_future(future)
+            finally:
+                self._observe_wait(start)
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._deliver(key, error=e)
+            raise
+        # 复制结果可能涉及文件操作，放到线程池执行，不阻塞事件循环
+        await asyncio.get_running_loop().run_in_executor(None, self._deliver, key, result)
+        return result
+
+    def stats(self) -> dict:
+        """获取合并统计"""
+        with self._lock:
+            in_flight = len(self._calls)
+            waiting = sum(len(waiters) for waiters in self._calls.values())
+        total = self.executed + self.coalesced
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'in_flight': in_flight,
+            'waiting': waiting,
+            'coalesce_rate': self.coalesced / total if total else 0.0,
+        }
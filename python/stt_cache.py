@@ -0,0 +1,74 @@
+"""
+语音识别结果缓存
+按音频内容的哈希缓存识别出的文字，浏览器重试或 VAD 重复触发上传相同的录音时，
+直接返回上一次的识别结果，不再重新调用语音识别接口
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TranscriptCache:
+    """LRU + TTL 缓存（线程安全）"""
+
+    def __init__(self, max_entries: int = 64, ttl_seconds: float = 600):
+        """
+        Args:
+            max_entries: 最多缓存的识别结果数量
+            ttl_seconds: 缓存有效时间（秒），0 表示不过期
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # 音频哈希 -> (识别文字, 写入时间)
+        self._entries = OrderedDict()
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(audio_data: bytes) -> str:
+        """根据音频内容生成缓存键"""
+        return hashlib.sha256(audio_data).hexdigest()
+
+    def get(self, key: str) -> str:
+        """
+        查询缓存
+
+        Returns:
+            str: 识别文字，未命中或已过期返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, text: str):
+        """写入缓存"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (text, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,13 @@
+"""
+语音识别失败的提示文字
+audio_to_text（同步/异步版本）失败时不抛异常，而是返回以 STT_ERROR_PREFIX 开头的提示文字；
+这些文字不能当作提示词去生成图片。本模块没有任何副作用，benchmark/replay.py 等离线工具也可以直接导入
+"""
+
+# audio_to_text 失败时返回的文字以此开头
+STT_ERROR_PREFIX = "音频识别失败"
+
+
+def is_stt_error(text: str) -> bool:
+    """判断 audio_to_text 的返回值是否是识别失败的提示（不能作为提示词生成图片）"""
+    return bool(text) and text.startswith(STT_ERROR_PREFIX)
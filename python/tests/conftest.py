@@ -0,0 +1,19 @@
+"""
+单元测试公共配置
+在 python 目录下运行：python -m pytest -q tests
+
+config 导入时会创建 HISTORY_DIR 和缓存目录，history_manager 导入时会创建全局实例，
+所以在导入被测模块之前把这些目录指向临时目录（不影响真实的历史记录）
+"""
+import os
+import sys
+import tempfile
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+
+_WORK_DIR = tempfile.mkdtemp(prefix='s2i-tests-')
+os.environ['HISTORY_DIR'] = os.path.join(_WORK_DIR, 'history')
+os.environ['TTI_CACHE_DIR'] = os.path.join(_WORK_DIR, 'cache', 'tti')
+os.environ['PIPELINE_EVENT_LOG'] = ''
+os.environ['SEMANTIC_CACHE_ENABLED'] = 'false'
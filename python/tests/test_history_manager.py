@@ -0,0 +1,112 @@
+"""HistoryManager：保存记录、记录ID唯一、后台生成显示尺寸图片"""
+import os
+import threading
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import config
+from history_manager import HistoryManager
+
+
+def make_image_bytes(size=(64, 48)) -> bytes:
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def make_manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'HISTORY_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'THUMBNAIL_DIR', str(tmp_path / 'thumbnails'))
+    monkeypatch.setattr(config, 'RENDITION_SIZES', '960,1440')
+    managers = []
+
+    def factory(backend: str = 'json') -> HistoryManager:
+        managers.append(HistoryManager(backend))
+        return managers[-1]
+    yield factory
+    for manager in managers:
+        manager._rendition_executor.shutdown(wait=True)
+        manager.thumbnails._executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager()
+
+
+def test_add_record_saves_image_and_record(manager):
+    record = manager.add_record(make_image_bytes(), '霸王龙')
+
+    assert os.path.exists(record['image_path'])
+    assert record['image_path'].endswith('.jpg')
+    assert manager.get_latest_record()['id'] == record['id']
+    # 比所有显示尺寸都小的图片不需要缩小版本
+    assert record['renditions'] == {}
+    assert manager.pending_renditions(record['id']) is None
+
+
+def test_renditions_generated_in_background(manager):
+    record = manager.add_record(make_image_bytes((2000, 1500)), '霸王龙')
+
+    # 记录中先写好缩小版本的路径，文件在后台生成
+    assert record['image_size'] == [2000, 1500]
+    assert sorted(record['renditions']) == ['1440', '960']
+    manager.wait_renditions(record['id'])
+    assert manager.pending_renditions(record['id']) is None
+    for size, path in record['renditions'].items():
+        with Image.open(path) as image:
+            assert max(image.size) == int(size)
+    assert manager.get_record_by_id(record['id'])['renditions'] == record['renditions']
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_concurrent_add_record_ids_are_unique(make_manager, backend, monkeypatch):
+    manager = make_manager(backend)
+    # 时钟停在同一毫秒：ID 仍然各不相同，不会互相覆盖图片和记录
+    monkeypatch.setattr('history_manager.time.time', lambda: 1700000000.0)
+    image_bytes = make_image_bytes()
+    records = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(10):
+            record = manager.add_record(image_bytes, '霸王龙')
+            with lock:
+                records.append(record)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [record['id'] for record in records]
+    assert len(set(ids)) == 40
+    assert len({record['image_path'] for record in records}) == 40
+    assert len(manager.get_history()) == 40
+
+
+def test_record_ids_increase_after_restart_and_clock_going_back(make_manager, monkeypatch):
+    first = make_manager().add_record(make_image_bytes(), '霸王龙')
+    # 重启后时钟回拨：新ID仍然大于已有记录
+    monkeypatch.setattr('history_manager.time.time', lambda: (first['id'] - 5000) / 1000)
+    second = make_manager().add_record(make_image_bytes(), '三角龙')
+
+    assert second['id'] == first['id'] + 1
+
+
+def test_sqlite_imports_json_only_once(make_manager, tmp_path):
+    json_manager = make_manager('json')
+    record = json_manager.add_record(make_image_bytes(), '霸王龙')
+
+    # 第一次使用 SQLite：导入 JSON 历史记录，并把 JSON 文件改名，不会再次导入
+    sqlite_manager = make_manager('sqlite')
+    assert [r['id'] for r in sqlite_manager.get_history()] == [record['id']]
+    assert not os.path.exists(tmp_path / 'history.json')
+
+    # 清空后重启：已删除的记录不会从 JSON 导入回来
+    sqlite_manager.clear_history()
+    assert make_manager('sqlite').get_history() == []
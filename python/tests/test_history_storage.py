@@ -0,0 +1,147 @@
+"""两种历史记录存储引擎的行为一致性：追加、裁剪、相邻记录、分页"""
+import os
+
+import pytest
+
+from history_storage import JsonHistoryStorage, SqliteHistoryStorage
+
+
+def make_record(record_id: int) -> dict:
+    return {
+        'id': record_id,
+        'text': f"提示词 {record_id}",
+        'image_path': f"/tmp/{record_id}.png",
+        'timestamp': '2025-01-01T00:00:00',
+        'renditions': {'960': f"/tmp/{record_id}_960.webp"},
+    }
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def make_storage(request, tmp_path):
+    def factory(max_history: int = 50, compact_every: int = 100):
+        if request.param == 'json':
+            return JsonHistoryStorage(str(tmp_path), max_history, compact_every)
+        return SqliteHistoryStorage(os.path.join(str(tmp_path), 'history.db'), max_history)
+    return factory
+
+
+def ids(records: list) -> list:
+    return [record['id'] for record in records]
+
+
+def test_append_keeps_order_and_extra_fields(make_storage):
+    storage = make_storage()
+    for record_id in (1, 2, 3):
+        storage.append(make_record(record_id))
+
+    assert storage.count() == 3
+    assert ids(storage.all()) == [1, 2, 3]
+    assert storage.latest() == make_record(3)
+    assert storage.get_by_position(0)['id'] == 1
+    assert storage.get_by_position(3) is None
+    assert storage.position_of(2) == 1
+    assert storage.position_of(99) == -1
+
+
+def test_append_trims_to_max_history(make_storage):
+    storage = make_storage(max_history=5, compact_every=100)
+    for record_id in range(1, 13):
+        storage.append(make_record(record_id))
+
+    assert storage.count() == 5
+    assert ids(storage.all()) == [8, 9, 10, 11, 12]
+    assert storage.get_by_position(0)['id'] == 8
+    assert storage.position_of(7) == -1
+
+
+def test_reload_trims_to_max_history(make_storage):
+    # 日志还没合并时，重新打开也只保留最新的 max_history 条
+    storage = make_storage(max_history=5, compact_every=100)
+    for record_id in range(1, 13):
+        storage.append(make_record(record_id))
+
+    reopened = make_storage(max_history=5, compact_every=100)
+    assert ids(reopened.all()) == [8, 9, 10, 11, 12]
+
+
+def test_refresh_sees_other_writer_and_trims(make_storage):
+    reader = make_storage(max_history=5)
+    writer = make_storage(max_history=5)
+    for record_id in range(1, 9):
+        writer.append(make_record(record_id))
+
+    reader.refresh()
+    assert reader.latest()['id'] == 8
+    assert ids(reader.all()) == [4, 5, 6, 7, 8]
+
+
+def test_compaction_keeps_records(make_storage):
+    storage = make_storage(max_history=10, compact_every=3)
+    for record_id in range(1, 8):
+        storage.append(make_record(record_id))
+
+    assert ids(storage.all()) == list(range(1, 8))
+    assert ids(make_storage(max_history=10, compact_every=3).all()) == list(range(1, 8))
+
+
+def test_adjacent(make_storage):
+    storage = make_storage()
+    for record_id in (10, 20, 30, 40):
+        storage.append(make_record(record_id))
+
+    assert storage.adjacent(20, -1)['id'] == 10
+    assert storage.adjacent(20, 1)['id'] == 30
+    assert storage.adjacent(20, 2)['id'] == 40
+    assert storage.adjacent(10, -1) is None
+    assert storage.adjacent(40, 1) is None
+    assert storage.adjacent(99, 1) is None
+
+
+def test_page_newest_first_with_cursor(make_storage):
+    storage = make_storage()
+    for record_id in range(1, 8):
+        storage.append(make_record(record_id))
+
+    assert ids(storage.page(None, 3)) == [7, 6, 5]
+    assert ids(storage.page(5, 3)) == [4, 3, 2]
+    assert ids(storage.page(2, 3)) == [1]
+    assert storage.page(1, 3) == []
+    assert storage.page(99, 3) == []
+
+
+def test_replace_all_trims(make_storage):
+    storage = make_storage(max_history=3)
+    storage.append(make_record(100))
+    storage.replace_all([make_record(record_id) for record_id in range(1, 6)])
+
+    assert ids(storage.all()) == [3, 4, 5]
+    assert storage.latest()['id'] == 5
+
+
+def test_sqlite_trim_keeps_max_history_after_replacing_existing_id(tmp_path):
+    # INSERT OR REPLACE 给已有ID分配新的 seq，seq 出现空洞后仍然保留 max_history 条
+    storage = SqliteHistoryStorage(os.path.join(str(tmp_path), 'history.db'), max_history=3)
+    for record_id in (1, 2, 3):
+        storage.append(make_record(record_id))
+    storage.append(make_record(2))
+
+    assert storage.count() == 3
+    assert ids(storage.all()) == [1, 3, 2]
+
+    storage.append(make_record(4))
+
+    assert storage.count() == 3
+    assert ids(storage.all()) == [3, 2, 4]
+    assert storage.get_by_position(0)['id'] == 3
+    assert storage.position_of(4) == 2
+
+
+def test_sqlite_count_survives_reopen_and_replace(tmp_path):
+    db_path = os.path.join(str(tmp_path), 'history.db')
+    storage = SqliteHistoryStorage(db_path, max_history=5)
+    storage.replace_all([make_record(record_id) for record_id in (1, 2, 2, 3)])
+    storage.append(make_record(3))
+
+    assert storage.count() == 3
+    assert SqliteHistoryStorage(db_path, max_history=5).count() == 3
+    assert storage.position_of(3) == 2
@@ -0,0 +1,145 @@
+"""流式下载和 b64_json 增量解码：任意分块边界（字段名、转义符、base64 四字符组被截断）都能还原图片"""
+import base64
+import json
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_download import Base64JsonDecoder, DownloadTooLargeError, StreamingDownload, detect_image_extension
+
+
+def make_png() -> bytes:
+    # 像素不规则，base64 中同时包含 "/" 和 "+"
+    pixels = bytes((i * 7919 + i // 3) % 256 for i in range(16 * 9 * 3 * 16))
+    buffer = BytesIO()
+    Image.frombytes('RGB', (48, 36), pixels).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+PNG = make_png()
+
+
+def make_body(escape_slashes: bool = False, **fields) -> bytes:
+    encoded = base64.b64encode(PNG).decode('ascii')
+    body = json.dumps({'created': 1, 'data': [dict({'b64_json': encoded}, **fields)]})
+    if escape_slashes:
+        # 部分 JSON 库把 "/" 转义为 "\/"
+        body = body.replace('/', '\\/')
+    return body.encode('utf-8')
+
+
+def decode(chunks) -> tuple:
+    with StreamingDownload() as download:
+        decoder = Base64JsonDecoder(download)
+        for chunk in chunks:
+            decoder.feed(chunk)
+    response = decoder.close()
+    image = decoder.open_image()
+    return response, image, download
+
+
+def read_download(download) -> bytes:
+    with open(download.path, 'rb') as f:
+        return f.read()
+
+
+def split_at(body: bytes, *positions) -> list:
+    bounds = [0, *positions, len(body)]
+    return [body[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize('escape_slashes', [False, True])
+def test_every_two_chunk_split(escape_slashes):
+    body = make_body(escape_slashes, revised_prompt='a/b')
+    for position in range(len(body) + 1):
+        response, image, download = decode(split_at(body, position))
+        assert read_download(download) == PNG, position
+        assert image.size == (48, 36)
+        assert response['data'][0]['b64_json'] == ''
+        assert response['data'][0]['revised_prompt'] == 'a/b'
+        image.close()
+        download.discard()
+
+
+def test_single_byte_chunks():
+    body = make_body(escape_slashes=True)
+    response, image, download = decode(body[i:i + 1] for i in range(len(body)))
+    assert read_download(download) == PNG
+    assert response['created'] == 1
+    image.close()
+    download.discard()
+
+
+def test_marker_and_escape_split_across_chunks():
+    body = make_body(escape_slashes=True)
+    marker = body.index(b'"b64_json"')
+    escape = body.index(b'\\/')
+    # 在字段名中间、冒号前后和转义符之后截断
+    chunks = split_at(body, marker + 4, marker + 10, marker + 12, escape + 1)
+    response, image, download = decode(chunks)
+    assert read_download(download) == PNG
+    image.close()
+    download.discard()
+
+
+def test_response_without_b64_json():
+    body = json.dumps({'data': [{'url': 'https://example.com/a.png'}]}).encode('utf-8')
+    response, image, download = decode(split_at(body, 5))
+    assert image is None
+    assert response['data'][0]['url'] == 'https://example.com/a.png'
+    assert not os.path.exists(download.path)
+
+
+def test_null_b64_json_is_plain_json():
+    body = b'{"data": [{"b64_json": null, "url": "u"}]}'
+    response, image, download = decode(split_at(body, 20))
+    assert image is None
+    assert response['data'][0] == {'b64_json': None, 'url': 'u'}
+
+
+def test_error_response_is_parsed():
+    body = json.dumps({'error': {'message': '余额不足'}}, ensure_ascii=False).encode('utf-8')
+    response, image, _ = decode([body])
+    assert image is None
+    assert response['error']['message'] == '余额不足'
+
+
+def test_truncated_value_raises():
+    body = make_body()
+    cut = body.index(b'"b64_json"') + 40
+    with StreamingDownload() as download:
+        decoder = Base64JsonDecoder(download)
+        decoder.feed(body[:cut])
+        with pytest.raises(ValueError):
+            decoder.close()
+    download.discard()
+
+
+def test_streaming_download_enforces_max_bytes():
+    with pytest.raises(DownloadTooLargeError):
+        StreamingDownload(total=11, max_bytes=10)
+    with pytest.raises(DownloadTooLargeError):
+        with StreamingDownload(max_bytes=10) as download:
+            download.write(b'x' * 6)
+            download.write(b'x' * 6)
+    # 失败的下载文件会被删除
+    assert not os.path.exists(download.path)
+
+
+def test_streaming_download_reports_progress():
+    progress = []
+    with StreamingDownload(total=len(PNG), progress_callback=lambda done, total: progress.append((done, total))) as download:
+        download.write(PNG[:100])
+        download.write(PNG[100:])
+    assert progress == [(100, len(PNG)), (len(PNG), len(PNG))]
+    assert download.open_image().size == (48, 36)
+    download.discard()
+
+
+def test_detect_image_extension():
+    assert detect_image_extension(PNG[:16]) == '.png'
+    assert detect_image_extension(b'\xff\xd8\xff\xe0' + b'\0' * 12) == '.jpg'
+    assert detect_image_extension(b'RIFF\0\0\0\0WEBPVP8 ') == '.webp'
+    assert detect_image_extension(b'not an image....') is None
@@ -0,0 +1,111 @@
+"""提示词图片缓存：缓存键规范化、LRU 淘汰、命中策略、重启后恢复"""
+import os
+import time
+
+from PIL import Image
+
+from prompt_cache import PromptImageCache
+
+MODEL = 'doubao-seedream-4-0-250828'
+
+
+def make_image(color=(200, 120, 40)) -> Image.Image:
+    return Image.new('RGB', (8, 8), color)
+
+
+def make_cache(tmp_path, **kwargs) -> PromptImageCache:
+    return PromptImageCache(str(tmp_path / 'tti'), **kwargs)
+
+
+def test_key_ignores_request_wording_and_punctuation():
+    key = PromptImageCache.make_key('霸王龙', MODEL, '1K', '1:1')
+    assert PromptImageCache.make_key('请帮我画一个霸王龙', MODEL, '1K', '1:1') == key
+    assert PromptImageCache.make_key('霸王龙。', MODEL, '1K', '1:1') == key
+    assert PromptImageCache.make_key(' 霸王龙！ ', MODEL, '1K', '1:1') == key
+
+
+def test_key_depends_on_model_size_and_aspect_ratio():
+    key = PromptImageCache.make_key('霸王龙', MODEL, '1K', '1:1')
+    assert PromptImageCache.make_key('三角龙', MODEL, '1K', '1:1') != key
+    assert PromptImageCache.make_key('霸王龙', 'gemini-2.5-flash-image', '1K', '1:1') != key
+    assert PromptImageCache.make_key('霸王龙', MODEL, '2K', '1:1') != key
+    assert PromptImageCache.make_key('霸王龙', MODEL, '1K', '16:9') != key
+
+
+def test_put_then_get(tmp_path):
+    cache = make_cache(tmp_path)
+    key = cache.make_key('霸王龙', MODEL)
+    assert cache.get(key) is None
+
+    cache.put(key, make_image(), {'prompt': '霸王龙'})
+    image = cache.get(key)
+    assert image is not None
+    assert image.getpixel((0, 0)) == (200, 120, 40)
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.put('a', make_image())
+    cache.put('b', make_image())
+    # 访问 a 后，b 成为最久未使用的
+    assert cache.get('a') is not None
+    cache.put('c', make_image())
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['evictions'] == 1
+    assert not os.path.exists(cache._image_path('b'))
+
+
+def test_max_bytes_evicts_oldest(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('a', make_image())
+    cache.max_bytes = os.path.getsize(cache._image_path('a')) + 1
+    cache.put('b', make_image())
+
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+
+
+def test_recent_policy_treats_old_entries_as_miss(tmp_path):
+    cache = make_cache(tmp_path, hit_policy='recent', recent_seconds=60)
+    cache.put('a', make_image())
+    cache._index['a']['created_at'] = time.time() - 120
+
+    assert cache.get('a') is None
+    assert cache.stats()['stale'] == 1
+
+
+def test_index_survives_restart(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put('a', make_image())
+    cache.put('b', make_image())
+
+    reloaded = make_cache(tmp_path)
+    assert reloaded.stats()['entries'] == 2
+    assert reloaded.get('a') is not None
+
+
+def test_put_async_copies_file_backed_image(tmp_path):
+    source = tmp_path / 'download.png'
+    make_image((1, 2, 3)).save(source)
+    cache = make_cache(tmp_path)
+
+    with Image.open(source) as image:
+        cache.put_async('a', image)
+    # 源文件删除后缓存仍然有效（复制在调用线程完成）
+    os.remove(source)
+    cache._executor.shutdown(wait=True)
+
+    assert cache.get('a').getpixel((0, 0)) == (1, 2, 3)
+
+
+def test_disabled_cache_never_hits(tmp_path):
+    cache = make_cache(tmp_path, enabled=False)
+    cache.put('a', make_image())
+    assert cache.get('a') is None
+    assert not os.path.exists(str(tmp_path / 'tti'))
@@ -0,0 +1,68 @@
+"""提示词规范化：繁转简、语气词和标点清理、请求套话的去除（不能误伤普通词语）"""
+import pytest
+
+from prompt_normalizer import canonical_prompt, clean_prompt, to_simplified
+
+
+def test_to_simplified():
+    assert to_simplified('畫一隻藍色的貓') == '画一只蓝色的猫'
+
+
+def test_clean_prompt_strips_fillers_and_edge_punctuation():
+    assert clean_prompt('嗯，那个，画一只猫吧。') == '画一只猫吧'
+    assert clean_prompt('  生成一張圖片！ ') == '生成一张图片'
+    # 清理后为空时返回原文
+    assert clean_prompt('。。。') == '。。。'
+    assert clean_prompt(None) == ''
+
+
+@pytest.mark.parametrize('text', [
+    '生成一張黑色小狗和老奶奶散步的圖片。',
+    '请帮我画一幅黑色小狗和老奶奶散步的画',
+    '黑色小狗和老奶奶散步。',
+    '我想要一张黑色小狗和老奶奶散步的照片吧',
+])
+def test_request_wording_is_ignored(text):
+    assert canonical_prompt(text) == canonical_prompt('黑色小狗和老奶奶散步')
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('请帮我画一个霸王龙', '霸王龙'),
+    ('帮我画霸王龙', '霸王龙'),
+    ('请画霸王龙', '霸王龙'),
+    ('我想要一只猫', '猫'),
+    ('嗯，那个，画一只猫吧', '猫'),
+    ('可以帮我画一只猫吗', '猫'),
+    ('麻烦你设计一个Logo', 'logo'),
+    ('来一张夕阳下的海边灯塔的图片，谢谢', '夕阳下的海边灯塔'),
+])
+def test_request_prefix_removed(text, expected):
+    assert canonical_prompt(text) == expected
+
+
+@pytest.mark.parametrize('text', [
+    # 以动词或"可以"开头的普通词语，不能当作套话截掉
+    '设计师',
+    '画家',
+    '出租车',
+    '来自星星的孩子',
+    '做饭的妈妈',
+    '可以飞的车',
+    '出海的渔船',
+    '请帖',
+    # 不带"的"的"照片"等是词语的一部分
+    '老照片',
+])
+def test_ordinary_words_are_kept(text):
+    assert canonical_prompt(text) == text
+
+
+def test_distinct_prompts_do_not_collide():
+    assert canonical_prompt('设计师') != canonical_prompt('师')
+    assert canonical_prompt('画家') != canonical_prompt('家')
+    assert canonical_prompt('出租车') != canonical_prompt('租车')
+    assert canonical_prompt('老照片') != canonical_prompt('老')
+
+
+def test_prompt_made_only_of_request_words_falls_back():
+    assert canonical_prompt('帮我画一个吧') == '帮我画一个吧'
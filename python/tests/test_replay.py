@@ -0,0 +1,70 @@
+"""负载回放：控制台日志和流程事件日志还原为轨迹，识别失败的上传不占用文生图脚本"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark'))
+
+import replay  # noqa: E402
+
+# 三次上传：第二次识别失败（旧版本仍然把提示文字拿去生成图片）
+CONSOLE_LOG = """\
+💾 VAD 音频已保存: audio/vad_1766025855594.webm
+✅ 识别成功: 请帮我画一个霸王龙
+✅ 识别成功: 请帮我画一个霸王龙
+⏱️ 音频转文字耗时: 3.26 秒
+🎨 开始生成图片
+⏱️ 文字转图片耗时: 10.24 秒
+💾 VAD 音频已保存: audio/vad_1766025865594.webm
+✅ 识别成功: 音频识别失败，未返回文本
+⏱️ 音频转文字耗时: 3.60 秒
+🎨 开始生成图片
+⏱️ 文字转图片耗时: 16.97 秒
+💾 VAD 音频已保存: audio/vad_1766025875594.webm
+✅ 识别成功: 我想要霸王龙在吃鱼的图片
+✅ 识别成功: 我想要霸王龙在吃鱼的图片
+⏱️ 音频转文字耗时: 3.64 秒
+🎨 开始生成图片
+⏱️ 文字转图片耗时: 11.89 秒
+"""
+
+
+def test_console_log_marks_stt_error_as_failure(tmp_path):
+    path = tmp_path / 'console.log'
+    path.write_text(CONSOLE_LOG, encoding='utf-8')
+
+    trace = replay.load_trace(str(path))
+
+    assert [entry['offset'] for entry in trace] == [0.0, 10.0, 20.0]
+    assert [entry['status'] for entry in trace] == ['done', 'failed', 'done']
+    assert trace[1]['prompt'] is None
+    assert trace[1]['stt_error'] == '音频识别失败，未返回文本'
+    assert not trace[1]['reached_tti']
+    # 识别失败那次的文生图耗时不会错位到下一次上传
+    assert [entry['tti_seconds'] for entry in trace] == [10.24, None, 11.89]
+
+
+def test_script_only_has_tti_entries_for_uploads_that_reached_tti(tmp_path):
+    path = tmp_path / 'console.log'
+    path.write_text(CONSOLE_LOG, encoding='utf-8')
+
+    script = replay.build_script(replay.load_trace(str(path)))
+
+    assert [item['text'] for item in script['stt']] == ['请帮我画一个霸王龙', '', '我想要霸王龙在吃鱼的图片']
+    assert script['tti'] == [{'latency': 10.24}, {'latency': 11.89}]
+
+
+def test_event_log_skips_rejected_and_stt_failed_uploads():
+    events = [
+        {'event': 'job', 'received_at': 100.0, 'status': 'done', 'transcript': '霸王龙',
+         'stages': {'stt_request': 3.0, 'tti_request': 10.0}},
+        {'event': 'job', 'received_at': 101.0, 'status': 'rejected'},
+        {'event': 'job', 'received_at': 102.0, 'status': 'failed', 'stt_error': '音频识别失败，未返回文本',
+         'stages': {'stt_request': 2.0}},
+        {'event': 'job', 'received_at': 103.0, 'status': 'failed', 'transcript': '小猫',
+         'stages': {'stt_request': 3.0, 'tti_request': 5.0}},
+    ]
+
+    script = replay.build_script(replay.parse_event_log(events))
+
+    assert [item.get('text') for item in script['stt']] == ['霸王龙', None, '', '小猫']
+    assert script['tti'] == [{'latency': 10.0}, {'latency': 5.0}]
@@ -0,0 +1,105 @@
+"""语义近似提示词缓存：近义改写命中，颜色、属性、否定、主体不同时不命中，索引随历史记录裁剪"""
+import pytest
+
+pytest.importorskip('numpy')
+
+from semantic_cache import PromptVectorIndex, content_key, normalize_prompt  # noqa: E402
+
+RECORDS = [
+    {'id': 1, 'text': '黑色小狗和老奶奶散步', 'image_path': '1.png'},
+    {'id': 2, 'text': '一只红色的大汽车在马路上行驶', 'image_path': '2.png'},
+    {'id': 3, 'text': '小猫在草地上睡觉', 'image_path': '3.png'},
+]
+
+
+@pytest.fixture
+def index():
+    index = PromptVectorIndex(threshold=0.8)
+    index.rebuild(RECORDS)
+    return index
+
+
+def lookup_id(index, text):
+    record = index.lookup(text)
+    return record['id'] if record else None
+
+
+@pytest.mark.parametrize('text, record_id', [
+    ('黑色小狗和老奶奶散步', 1),
+    ('老奶奶遛黑色小狗', 1),
+    ('生成一张黑色小狗和老奶奶散步的图片', 1),
+    ('请帮我画一只红色的大汽车在马路上行驶', 2),
+    ('草地上小猫在睡觉', 3),
+])
+def test_paraphrase_hits(index, text, record_id):
+    assert lookup_id(index, text) == record_id
+
+
+@pytest.mark.parametrize('text', [
+    # 颜色不同
+    '一只蓝色的大汽车在马路上行驶',
+    # 大小不同
+    '一只红色的小汽车在马路上行驶',
+    # 否定
+    '一只红色的大汽车没有在马路上行驶',
+    '没有在马路上行驶',
+    # 主体不同
+    '小狗在草地上睡觉',
+    # 多了内容
+    '黑色小狗和老奶奶在雪地里散步',
+])
+def test_conflicting_prompt_misses(index, text):
+    assert lookup_id(index, text) is None
+
+
+def test_rejected_counts_similar_but_conflicting(index):
+    text = '一只蓝色的大汽车在马路上行驶'
+    record, score = index.search(text)
+    assert record['id'] == 2 and score >= index.threshold
+    assert index.lookup(text) is None
+    assert index.stats()['rejected'] == 1
+    assert index.stats()['misses'] == 1
+
+
+def test_content_key_ignores_function_words_and_order():
+    assert content_key(normalize_prompt('小猫在草地上睡觉')) == content_key(normalize_prompt('草地上的小猫睡觉'))
+    assert content_key(normalize_prompt('老奶奶遛狗狗')) == content_key(normalize_prompt('狗和老奶奶散步'))
+    assert content_key(normalize_prompt('红色的车')) != content_key(normalize_prompt('蓝色的车'))
+
+
+def test_discard_removes_record(index):
+    index.discard(1)
+    assert lookup_id(index, '黑色小狗和老奶奶散步') is None
+    assert len(index) == 2
+
+
+def test_max_entries_discards_oldest():
+    index = PromptVectorIndex(threshold=0.8, max_entries=2)
+    for record in RECORDS:
+        index.add(record)
+
+    assert len(index) == 2
+    # 最早的记录已随历史记录裁剪，不能再复用它的图片
+    assert lookup_id(index, '黑色小狗和老奶奶散步') is None
+    assert lookup_id(index, '小猫在草地上睡觉') == 3
+
+
+def test_many_adds_keep_index_bounded():
+    index = PromptVectorIndex(threshold=0.8, max_entries=5)
+    for record_id in range(3000):
+        index.add({'id': record_id, 'text': f"第{record_id}只小猫在草地上睡觉", 'image_path': ''})
+
+    assert len(index) == 5
+    # 失效行多于有效行时整体重建，不会无限增长
+    assert len(index._records) <= 1024 + 5
+    assert lookup_id(index, '第2999只小猫在草地上睡觉') == 2999
+    assert lookup_id(index, '第0只小猫在草地上睡觉') is None
+
+
+def test_same_id_added_twice_keeps_latest():
+    index = PromptVectorIndex(threshold=0.8)
+    index.add({'id': 1, 'text': '小猫在草地上睡觉', 'image_path': 'old.png'})
+    index.add({'id': 1, 'text': '小猫在草地上睡觉', 'image_path': 'new.png'})
+
+    assert len(index) == 1
+    assert index.lookup('小猫在草地上睡觉')['image_path'] == 'new.png'
@@ -0,0 +1,136 @@
+"""单飞合并：相同键的并发调用只执行一次，结果和异常都交给所有等待者"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(count: int, fn) -> list:
+    """在 count 个线程中同时调用 fn()，返回每个线程的结果或异常"""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def worker(index):
+        barrier.wait()
+        try:
+            results[index] = fn()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow(result, delay: float = 0.2, calls: list = None):
+    def fn():
+        if calls is not None:
+            calls.append(1)
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return fn
+
+
+def test_concurrent_calls_execute_once():
+    flight = SingleFlight()
+    calls = []
+    results = run_concurrently(5, lambda: flight.do('霸王龙', slow('image', calls=calls)))
+
+    assert results == ['image'] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert stats['executed'] == 1
+    assert stats['coalesced'] == 4
+    assert stats['in_flight'] == 0
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    calls = []
+    results = run_concurrently(2, lambda: flight.do(threading.current_thread().name, slow('x', 0.05, calls)))
+
+    assert results == ['x', 'x']
+    assert len(calls) == 2
+
+
+def test_error_is_delivered_to_every_waiter():
+    flight = SingleFlight()
+    calls = []
+    error = RuntimeError('上游超时')
+    results = run_concurrently(4, lambda: flight.do('霸王龙', slow(error, calls=calls)))
+
+    assert len(calls) == 1
+    assert all(result is error for result in results)
+    assert flight.stats()['failed'] == 1
+    # 失败后键被释放，下一次调用重新执行
+    assert flight.do('霸王龙', lambda: 'retry') == 'retry'
+
+
+def test_share_copies_result_for_waiters():
+    flight = SingleFlight(share=lambda result: dict(result, copy=True))
+    results = run_concurrently(3, lambda: flight.do('霸王龙', slow({'id': 1})))
+
+    originals = [result for result in results if 'copy' not in result]
+    copies = [result for result in results if result.get('copy')]
+    assert len(originals) == 1
+    assert len(copies) == 2
+
+
+def test_share_error_only_fails_that_waiter():
+    def share(result):
+        raise OSError('复制失败')
+
+    flight = SingleFlight(share=share)
+    results = run_concurrently(3, lambda: flight.do('霸王龙', slow('image')))
+
+    assert results.count('image') == 1
+    assert sum(isinstance(result, OSError) for result in results) == 2
+
+
+def test_async_and_thread_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return 'image'
+
+    thread_results = []
+
+    async def main():
+        task = asyncio.ensure_future(flight.do_async('霸王龙', generate))
+        await asyncio.sleep(0.05)
+        # 同步线程中的相同请求等待协程的结果
+        loop = asyncio.get_running_loop()
+        thread_results.append(await loop.run_in_executor(None, flight.do, '霸王龙', slow('other')))
+        return await task
+
+    result = asyncio.run(main())
+    assert result == 'image'
+    assert thread_results == ['image']
+    assert len(calls) == 1
+
+
+def test_async_error_propagates_to_async_waiters():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.1)
+        raise ValueError('生成失败')
+
+    async def main():
+        return await asyncio.gather(*(flight.do_async('霸王龙', fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()['executed'] == 1
+    assert flight.stats()['coalesced'] == 2
@@ -0,0 +1,100 @@
+"""
+历史记录缩略图
+分页浏览历史记录时使用的小尺寸预览图，第一次被请求时在后台线程池中生成并缓存到磁盘：
+    history/thumbnails/{记录ID}_{尺寸}.webp
+生成是幂等的：文件已存在时直接返回，同一张缩略图正在生成时返回同一个 Future，不会重复生成
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+from renditions import rendition_extension, save_rendition, smallest_rendition, to_display_mode
+
+
+class ThumbnailStore:
+    """缩略图磁盘缓存（线程安全）"""
+
+    def __init__(self, thumbnail_dir: str, size: int = 192, workers: int = 2):
+        """
+        Args:
+            thumbnail_dir: 缩略图目录
+            size: 缩略图长边尺寸（像素）
+            workers: 后台生成线程数
+        """
+        self.thumbnail_dir = thumbnail_dir
+        self.size = size
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        # 缩略图路径 -> 正在生成的 Future
+        self._pending = {}
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+
+        # 统计信息
+        self.generated = 0
+        self.failed = 0
+
+    def path_for(self, record: dict) -> str:
+        """记录对应的缩略图路径"""
+        return os.path.join(self.thumbnail_dir, f"{record['id']}_{self.size}{rendition_extension()}")
+
+    def is_ready(self, record: dict) -> bool:
+        """缩略图是否已生成"""
+        return os.path.exists(self.path_for(record))
+
+    def ensure(self, record: dict) -> Future:
+        """
+        确保缩略图存在（不阻塞，缺失时提交到后台生成）
+
+        Returns:
+            Future: 结果为缩略图路径；已存在时返回已完成的 Future
+        """
+        path = self.path_for(record)
+        with self._lock:
+            future = self._pending.get(path)
+            if future is not None:
+                return future
+            if os.path.exists(path):
+                future = Future()
+                future.set_result(path)
+                return future
+            future = self._executor.submit(self._generate, record, path)
+            self._pending[path] = future
+            return future
+
+    def _generate(self, record: dict, path: str) -> str:
+        try:
+            # 其他进程可能已经生成过
+            if os.path.exists(path):
+                return path
+            # 从最小一档显示尺寸图片缩小，比解码原图快得多
+            with Image.open(smallest_rendition(record)) as image:
+                image.draft('RGB', (self.size, self.size))
+                thumbnail = to_display_mode(image)
+                thumbnail.thumbnail((self.size, self.size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+                save_rendition(thumbnail, path)
+            self.generated += 1
+            return path
+        except Exception as e:
+            self.failed += 1
+            print(f"⚠️ 生成缩略图失败（记录 {record.get('id')}）: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def clear(self):
+        """删除所有缩略图"""
+        for filename in os.listdir(self.thumbnail_dir):
+            try:
+                os.remove(os.path.join(self.thumbnail_dir, filename))
+            except OSError as e:
+                print(f"⚠️ 删除缩略图失败: {e}")
+
+    def stats(self) -> dict:
+        """获取生成统计"""
+        return {
+            'size': self.size,
+            'pending': len(self._pending),
+            'generated': self.generated,
+            'failed': self.failed,
+        }